@@ -0,0 +1,10 @@
+"""Helpers shared by the benchmark scripts."""
+
+import math
+
+
+def percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile of values, e.g. fraction=0.95 for p95."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
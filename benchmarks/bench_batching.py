@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark micro-batching of short voice notes.
+
+Replays Poisson arrivals of short synthetic clips at several rates, once with
+batching disabled and once enabled, and reports throughput and latency
+percentiles as JSON.
+
+Usage:
+    python benchmarks/bench_batching.py --rates 0.5 1 2 4 --jobs 40
+    python benchmarks/bench_batching.py --window-ms 250 --batch-size 8 -o batching.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import transcription  # noqa: E402
+from _common import percentile  # noqa: E402
+from synthetic_audio import write_synthetic_wav  # noqa: E402
+
+
+async def replay(clips, rate: float, seed: int) -> dict:
+    """Submit clips with exponential inter-arrival times and time each job."""
+    rng = random.Random(seed)
+    latencies = []
+
+    async def job(path: Path):
+        started = time.monotonic()
+        await transcription.transcribe_audio(str(path), language='en')
+        latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    tasks = []
+    for path in clips:
+        tasks.append(asyncio.ensure_future(job(path)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+
+    return {
+        'jobs': len(clips),
+        'throughput_jobs_per_s': len(clips) / elapsed,
+        'latency_p50_s': percentile(latencies, 0.50),
+        'latency_p95_s': percentile(latencies, 0.95),
+        'latency_max_s': max(latencies),
+    }
+
+
+async def run(args) -> dict:
+    # Every mode replays the same clips; cache hits would hide the decoding
+    transcription.TRANSCRIPTION_CACHE_ENABLED = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        clips = []
+        for i in range(args.jobs):
+            path = Path(tmp) / f"clip_{i}.wav"
+            rng = random.Random(i)
+            seconds = rng.uniform(args.min_seconds, args.max_seconds)
+            write_synthetic_wav(path, seconds, tones=([rng.uniform(150, 400) for _ in range(3)],))
+            clips.append(path)
+
+        # Load the model once so neither mode pays for it
+        transcription.WHISPER_BATCH_WINDOW_MS = 0
+        await transcription.transcribe_audio(str(clips[0]), language='en')
+
+        results = []
+        for rate in args.rates:
+            for window_ms in (0, args.window_ms):
+                transcription.WHISPER_BATCH_WINDOW_MS = window_ms
+                transcription.WHISPER_BATCH_SIZE = args.batch_size
+                transcription._batcher = None
+                stats = await replay(clips, rate, seed=args.seed)
+                stats.update({
+                    'arrival_rate_per_s': rate,
+                    'batching': window_ms > 0,
+                    'window_ms': window_ms,
+                    'batch_size': args.batch_size,
+                })
+                if transcription._batcher is not None:
+                    stats['mean_batch_size'] = (
+                        transcription._batcher.jobs_run / max(transcription._batcher.batches_run, 1)
+                    )
+                results.append(stats)
+                print(json.dumps(stats), file=sys.stderr)
+
+        await transcription.shutdown()
+
+    return {
+        'model': transcription.WHISPER_MODEL,
+        'compute_type': transcription.WHISPER_COMPUTE_TYPE,
+        'workers': transcription.WHISPER_WORKERS,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rates', type=float, nargs='+', default=[0.5, 1.0, 2.0, 4.0],
+                        help='Arrival rates to replay, in jobs per second')
+    parser.add_argument('--jobs', type=int, default=40, help='Clips per run')
+    parser.add_argument('--min-seconds', type=float, default=3.0)
+    parser.add_argument('--max-seconds', type=float, default=25.0)
+    parser.add_argument('--window-ms', type=int, default=200, help='Batching window for the enabled runs')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
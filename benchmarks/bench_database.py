@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Throughput of the database layer under concurrent message handling.
+
+Runs the same workload against two implementations of database access:
+
+    legacy      a new connection per call in rollback-journal mode, every
+                call serialized by one asyncio lock (the original layer)
+    persistent  database.py as it is: long-lived WAL connections, reads on
+                reader threads and writes on the single writer thread
+
+Many coroutines each handle a series of messages the way the bot does:
+check whether the message was processed, read the chat's settings, then
+mark the message processed. The report gives database operations per
+second and per-message latency percentiles as JSON.
+
+Usage:
+    python benchmarks/bench_database.py --coroutines 100 --messages 50
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from _common import percentile  # noqa: E402
+
+# Database operations per handled message
+OPS_PER_MESSAGE = 3
+
+
+class LegacyDatabase:
+    """The original access pattern: connect, run, commit and close on every call, one call at a time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = asyncio.Lock()
+
+    async def _run(self, sql: str, params: tuple, fetch: bool):
+        def call():
+            conn = sqlite3.connect(self.path)
+            conn.row_factory = sqlite3.Row
+            try:
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                row = cursor.fetchone() if fetch else None
+                conn.commit()
+                return row
+            finally:
+                conn.close()
+
+        async with self.lock:
+            return await asyncio.get_event_loop().run_in_executor(None, call)
+
+    async def is_message_processed(self, chat_id: int, message_id: int) -> bool:
+        row = await self._run(
+            "SELECT 1 FROM processed_messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id), True
+        )
+        return row is not None
+
+    async def get_delete_after_transcription(self, chat_id: int) -> bool:
+        row = await self._run(
+            "SELECT delete_after_transcription FROM chat_settings WHERE chat_id = ?", (chat_id,), True
+        )
+        return bool(row[0]) if row else True
+
+    async def mark_message_processed(self, chat_id: int, message_id: int):
+        await self._run(
+            "INSERT OR IGNORE INTO processed_messages (chat_id, message_id) VALUES (?, ?)",
+            (chat_id, message_id), False
+        )
+
+
+async def handle_messages(db, chat_id: int, messages: int, latencies: list):
+    for message_id in range(messages):
+        started = time.monotonic()
+        if not await db.is_message_processed(chat_id, message_id):
+            await db.get_delete_after_transcription(chat_id)
+            await db.mark_message_processed(chat_id, message_id)
+        latencies.append(time.monotonic() - started)
+
+
+async def run_mode(mode: str, directory: str, coroutines: int, messages: int) -> dict:
+    import database
+
+    database.DB_PATH = os.path.join(directory, f"{mode}.db")
+    database.init_database()
+    for chat_id in range(coroutines):
+        await database.set_delete_after_transcription(chat_id, chat_id % 2 == 0)
+    await database.close_database()
+
+    if mode == 'legacy':
+        # The original layer never enabled WAL
+        with sqlite3.connect(database.DB_PATH) as conn:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        db = LegacyDatabase(database.DB_PATH)
+    else:
+        db = database
+
+    latencies = []
+    started = time.monotonic()
+    await asyncio.gather(*(handle_messages(db, chat_id, messages, latencies) for chat_id in range(coroutines)))
+    wall = time.monotonic() - started
+    await database.close_database()
+
+    ops = coroutines * messages * OPS_PER_MESSAGE
+    return {
+        'mode': mode,
+        'coroutines': coroutines,
+        'messages': coroutines * messages,
+        'ops': ops,
+        'wall_s': wall,
+        'ops_per_s': ops / wall,
+        'message_p50_ms': percentile(latencies, 0.50) * 1000,
+        'message_p95_ms': percentile(latencies, 0.95) * 1000,
+        'message_max_ms': max(latencies) * 1000,
+    }
+
+
+def run(args) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for mode in args.modes:
+            stats = asyncio.run(run_mode(mode, directory, args.coroutines, args.messages))
+            results.append(stats)
+            print(json.dumps(stats), file=sys.stderr)
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coroutines', type=int, default=100, help='Messages handled at once')
+    parser.add_argument('--messages', type=int, default=50, help='Messages each coroutine handles')
+    parser.add_argument('--modes', nargs='+', choices=['legacy', 'persistent'], default=['legacy', 'persistent'])
+    parser.add_argument('--dir', help='Directory for the database files, e.g. on the disk the bot uses '
+                                      '(default: the system temporary directory)')
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
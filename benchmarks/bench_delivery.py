@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+CPU cost of the YouTube delivery formats.
+
+Builds stand-ins for YouTube's native audio streams (AAC in .m4a, as itag
+140, and Opus in .webm, as itag 251) with FFmpeg, then runs the same FFmpeg
+step yt-dlp's FFmpegExtractAudio runs for each delivery format:
+
+    mp3  decode + re-encode with libmp3lame at 192 kbps
+    m4a  stream copy of the AAC track into an .m4a container
+
+and reports CPU seconds (user + system of the FFmpeg child) per minute of
+audio as JSON.
+
+Usage:
+    python benchmarks/bench_delivery.py --durations 60 600 --repeat 3
+    python benchmarks/bench_delivery.py --source speech.wav -o delivery.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from synthetic_audio import write_synthetic_wav  # noqa: E402
+
+SAMPLE_RATE = 44100
+# Tones mixed into the left and right channel of the synthetic source
+SOURCE_TONES = ((220.0, 330.0), (247.0, 370.0))
+
+# FFmpeg arguments that produce each native stream from the source WAV
+NATIVE_STREAMS = {
+    'm4a': ['-c:a', 'aac', '-b:a', '128k'],
+    'webm': ['-c:a', 'libopus', '-b:a', '160k'],
+}
+
+# What FFmpegExtractAudio runs per delivery format, and the inputs it can take
+DELIVERY_MODES = {
+    'mp3': {
+        'args': ['-vn', '-acodec', 'libmp3lame', '-b:a', '192k'],
+        'extension': 'mp3',
+        'inputs': ['m4a', 'webm'],
+    },
+    'm4a': {
+        'args': ['-vn', '-acodec', 'copy', '-bsf:a', 'aac_adtstoasc'],
+        'extension': 'm4a',
+        'inputs': ['m4a'],
+    },
+}
+
+
+def make_native_streams(directory: Path, duration: float, source=None):
+    """Create the native stream files for one duration; returns {container: path}."""
+    base = directory / f"source_{duration:g}s.wav"
+    if not base.exists():
+        if source:
+            subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-stream_loop', '-1', '-i', str(source),
+                 '-t', str(duration), '-ac', '2', '-ar', str(SAMPLE_RATE), str(base)],
+                check=True
+            )
+        else:
+            write_synthetic_wav(base, duration, tones=SOURCE_TONES, sample_rate=SAMPLE_RATE)
+
+    streams = {}
+    for container, args in NATIVE_STREAMS.items():
+        path = directory / f"native_{duration:g}s.{container}"
+        if not path.exists():
+            subprocess.run(
+                ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(base), '-vn', *args, str(path)],
+                check=True
+            )
+        streams[container] = path
+    return streams
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def time_delivery(source: Path, mode: dict, output: Path):
+    """Run one delivery step; returns (CPU seconds, wall seconds)."""
+    cpu_before = _children_cpu_seconds()
+    started = time.monotonic()
+    subprocess.run(
+        ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(source), *mode['args'], str(output)],
+        check=True
+    )
+    return _children_cpu_seconds() - cpu_before, time.monotonic() - started
+
+
+def run(args) -> dict:
+    directory = Path(args.fixtures_dir or tempfile.mkdtemp(prefix='delivery_bench_'))
+    directory.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    for duration in args.durations:
+        streams = make_native_streams(directory, duration, args.source)
+        for name, mode in DELIVERY_MODES.items():
+            for container in mode['inputs']:
+                output = directory / f"out_{name}_{container}_{duration:g}s.{mode['extension']}"
+                cpu, wall = [], []
+                for _ in range(args.repeat):
+                    cpu_seconds, wall_seconds = time_delivery(streams[container], mode, output)
+                    cpu.append(cpu_seconds)
+                    wall.append(wall_seconds)
+
+                minutes = duration / 60
+                stats = {
+                    'mode': name,
+                    'native_stream': container,
+                    'duration_s': duration,
+                    'cpu_s': min(cpu),
+                    'cpu_s_per_audio_minute': min(cpu) / minutes,
+                    'wall_s': min(wall),
+                    'output_bytes': output.stat().st_size,
+                }
+                results.append(stats)
+                print(json.dumps(stats), file=sys.stderr)
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--durations', type=float, nargs='+', default=[60, 600],
+                        help='Audio lengths to test, in seconds')
+    parser.add_argument('--source', help='Recording to build the native streams from instead of a synthetic tone')
+    parser.add_argument('--fixtures-dir', help='Where to keep generated files (default: a temp dir)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case; the fastest is reported')
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
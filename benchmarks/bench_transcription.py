@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Transcription benchmark suite with real-time-factor reporting.
+
+Generates audio fixtures of several durations and formats (.ogg voice,
+.mp3, .m4a) with FFmpeg, then sweeps model size, compute type, beam size and
+CPU threads. Every configuration runs in a fresh process so model load time
+and peak RSS are measured in isolation.
+
+Usage:
+    # Sweep and write a report
+    python benchmarks/bench_transcription.py run -o baseline.json \\
+        --models tiny base --compute-types int8 --beam-sizes 1 5 --threads 4
+
+    # Use a real recording instead of the synthetic tone as fixture source
+    python benchmarks/bench_transcription.py run --source speech.wav -o candidate.json
+
+    # Compare two reports; exits 1 if the candidate regressed
+    python benchmarks/bench_transcription.py compare baseline.json candidate.json --threshold 0.10
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from _common import percentile  # noqa: E402
+from synthetic_audio import write_synthetic_wav  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+# FFmpeg arguments per fixture format; .ogg mirrors Telegram voice notes
+FORMATS = {
+    'ogg': ['-c:a', 'libopus', '-b:a', '32k'],
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '128k'],
+    'm4a': ['-c:a', 'aac', '-b:a', '128k'],
+}
+
+
+def make_fixtures(directory: Path, durations, formats, source=None):
+    """
+    Create one fixture per (duration, format), reusing files from earlier runs.
+
+    Returns:
+        List of dicts with path, format and duration
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    fixtures = []
+
+    for duration in durations:
+        base = directory / f"source_{duration:g}s.wav"
+        if not base.exists():
+            if source:
+                # Loop the recording as needed and cut it to length
+                subprocess.run(
+                    ['ffmpeg', '-y', '-loglevel', 'error', '-stream_loop', '-1', '-i', str(source),
+                     '-t', str(duration), '-ac', '1', '-ar', str(SAMPLE_RATE), str(base)],
+                    check=True
+                )
+            else:
+                write_synthetic_wav(base, duration, sample_rate=SAMPLE_RATE)
+
+        for fmt in formats:
+            path = directory / f"fixture_{duration:g}s.{fmt}"
+            if not path.exists():
+                subprocess.run(
+                    ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(base), *FORMATS[fmt], str(path)],
+                    check=True
+                )
+            fixtures.append({'path': str(path), 'format': fmt, 'duration': duration})
+
+    return fixtures
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_config(config, fixtures, repeat, result_queue):
+    """Child process: load one model configuration and time every fixture."""
+    import threading
+
+    from faster_whisper import WhisperModel
+
+    import transcription
+
+    started = time.monotonic()
+    model = WhisperModel(
+        config['model'],
+        device='cpu',
+        compute_type=config['compute_type'],
+        cpu_threads=config['threads']
+    )
+    load_seconds = time.monotonic() - started
+
+    options = {
+        'beam_size': config['beam_size'],
+        'best_of': config['beam_size'],
+        'temperature': 0.0,
+    }
+    if config.get('language'):
+        options['language'] = config['language']
+
+    results = []
+    for fixture in fixtures:
+        latencies = []
+        for _ in range(repeat):
+            started = time.monotonic()
+            transcription._decode_segments(
+                model, fixture['path'], options, float('inf'), threading.Event()
+            )
+            latencies.append(time.monotonic() - started)
+
+        results.append({
+            'fixture': Path(fixture['path']).name,
+            'format': fixture['format'],
+            'duration_s': fixture['duration'],
+            'latency_p50_s': percentile(latencies, 0.50),
+            'latency_p95_s': percentile(latencies, 0.95),
+            'rtf_p50': percentile(latencies, 0.50) / fixture['duration'],
+        })
+
+    result_queue.put({
+        'config': config,
+        'model_load_s': load_seconds,
+        'peak_rss_mb': _peak_rss_mb(),
+        'rtf_mean': sum(r['rtf_p50'] for r in results) / len(results),
+        'fixtures': results,
+    })
+
+
+def command_run(args) -> int:
+    fixtures_dir = Path(args.fixtures_dir or tempfile.mkdtemp(prefix='whisper_bench_'))
+    fixtures = make_fixtures(fixtures_dir, args.durations, args.formats, args.source)
+
+    configs = [
+        {'model': m, 'compute_type': c, 'beam_size': b, 'threads': t, 'language': lang or None}
+        for m, c, b, t, lang in itertools.product(
+            args.models, args.compute_types, args.beam_sizes, args.threads, args.languages
+        )
+    ]
+
+    ctx = multiprocessing.get_context('spawn')
+    runs = []
+    for config in configs:
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=run_config, args=(config, fixtures, args.repeat, result_queue))
+        process.start()
+        try:
+            # Read before joining: the child cannot exit until its result is consumed
+            run = result_queue.get(timeout=args.config_timeout)
+        except queue.Empty:
+            run = None
+        process.join()
+        if run is None:
+            print(f"Configuration failed: {config}", file=sys.stderr)
+            continue
+        runs.append(run)
+        print(
+            f"{config}: load {run['model_load_s']:.2f}s, RTF {run['rtf_mean']:.3f}, "
+            f"peak RSS {run['peak_rss_mb']:.0f} MB",
+            file=sys.stderr
+        )
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'repeat': args.repeat,
+        'runs': runs,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+    return 0
+
+
+def _index(report):
+    keyed = {}
+    for run in report['runs']:
+        config_key = json.dumps(run['config'], sort_keys=True)
+        keyed[(config_key, None)] = run
+        for fixture in run['fixtures']:
+            keyed[(config_key, fixture['fixture'])] = fixture
+    return keyed
+
+
+def command_compare(args) -> int:
+    baseline = _index(json.loads(Path(args.baseline).read_text()))
+    candidate = _index(json.loads(Path(args.candidate).read_text()))
+
+    checks = {
+        None: ['model_load_s', 'peak_rss_mb', 'rtf_mean'],
+        'fixture': ['latency_p50_s', 'latency_p95_s'],
+    }
+
+    regressions = 0
+    for key in sorted(baseline.keys() & candidate.keys(), key=str):
+        config_key, fixture = key
+        metrics = checks[None] if fixture is None else checks['fixture']
+        for metric in metrics:
+            old, new = baseline[key][metric], candidate[key][metric]
+            change = (new - old) / old if old else 0.0
+            flag = ''
+            if change > args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            label = fixture or 'overall'
+            print(f"{config_key} {label} {metric}: {old:.3f} -> {new:.3f} ({change:+.1%}){flag}")
+
+    missing = baseline.keys() - candidate.keys()
+    if missing:
+        print(f"{len(missing)} baseline entries missing from candidate", file=sys.stderr)
+
+    print(f"{regressions} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Run the benchmark sweep')
+    run.add_argument('--models', nargs='+', default=['base'])
+    run.add_argument('--compute-types', nargs='+', default=['int8'])
+    run.add_argument('--beam-sizes', type=int, nargs='+', default=[5])
+    run.add_argument('--threads', type=int, nargs='+', default=[0],
+                     help='cpu_threads values; 0 lets CTranslate2 choose')
+    run.add_argument('--languages', nargs='+', default=[''],
+                     help="Language hints to sweep; '' runs language detection")
+    run.add_argument('--durations', type=float, nargs='+', default=[5, 30, 120])
+    run.add_argument('--formats', nargs='+', choices=sorted(FORMATS), default=sorted(FORMATS))
+    run.add_argument('--source', help='Recording to build fixtures from instead of a synthetic tone')
+    run.add_argument('--fixtures-dir', help='Where to keep generated fixtures (default: a temp dir)')
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--config-timeout', type=float, default=3600,
+                     help='Seconds allowed for one configuration')
+    run.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+
+    compare = subparsers.add_parser('compare', help='Compare two reports')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, default=0.10,
+                         help='Relative increase counted as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        return command_run(args)
+    return command_compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
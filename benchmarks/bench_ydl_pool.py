@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Per-request overhead of fresh vs pooled YoutubeDL instances.
+
+Serves a small JSON document from a local HTTP server and registers a
+fixture extractor that fetches it, so every request goes through yt-dlp's
+real option handling, extractor setup, HTTP stack and format selection
+without touching YouTube. Each mode runs the same metadata-only requests
+(the bot's preflight) from a few threads:
+
+    fresh   a new YoutubeDL per request, closed afterwards
+    pooled  instances checked out of ydl_pool.YoutubeDLPool
+
+and reports per-request latency percentiles as JSON.
+
+Usage:
+    python benchmarks/bench_ydl_pool.py --requests 200 --threads 4
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from _common import percentile  # noqa: E402
+
+# Options of the bot's preflight profile
+PREFLIGHT_OPTS = {'format': 'bestaudio/best', 'quiet': True, 'no_warnings': True}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Answers every GET with the metadata of a two-format audio-only video."""
+
+    def do_GET(self):
+        video_id = self.path.rsplit('/', 1)[-1]
+        host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        body = json.dumps({
+            'id': video_id,
+            'title': f"Fixture {video_id}",
+            'duration': 600,
+            'formats': [
+                {'format_id': '140', 'url': f"{host}/media/{video_id}.m4a", 'ext': 'm4a',
+                 'acodec': 'mp4a.40.2', 'vcodec': 'none', 'abr': 128},
+                {'format_id': '251', 'url': f"{host}/media/{video_id}.webm", 'ext': 'webm',
+                 'acodec': 'opus', 'vcodec': 'none', 'abr': 160},
+            ],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_fixture_extractor(base_url: str):
+    """Build an extractor for fixture://<id> links backed by the local server."""
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class FixtureIE(InfoExtractor):
+        _VALID_URL = r'fixture://(?P<id>[\w-]+)'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return self._download_json(f"{base_url}/info/{video_id}", video_id)
+
+    return FixtureIE
+
+
+def run_mode(mode: str, extractor, requests: int, threads: int) -> dict:
+    import yt_dlp
+
+    from ydl_pool import YoutubeDLPool
+
+    pool = YoutubeDLPool(max_idle=threads, on_create=lambda ydl: ydl.add_info_extractor(extractor()))
+    ie_key = extractor.ie_key()
+
+    def one_request(index):
+        url = f"fixture://video{index}"
+        started = time.monotonic()
+        if mode == 'fresh':
+            with yt_dlp.YoutubeDL(PREFLIGHT_OPTS) as ydl:
+                ydl.add_info_extractor(extractor())
+                ydl.extract_info(url, download=False, ie_key=ie_key)
+        else:
+            with pool.checkout('preflight', lambda: PREFLIGHT_OPTS) as pooled:
+                pooled.ydl.extract_info(url, download=False, ie_key=ie_key)
+        return time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(one_request, range(requests)))
+    wall = time.monotonic() - started
+    pool.close()
+
+    return {
+        'mode': mode,
+        'requests': requests,
+        'threads': threads,
+        'wall_s': wall,
+        'requests_per_s': requests / wall,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p95_ms': percentile(latencies, 0.95) * 1000,
+        'latency_max_ms': max(latencies) * 1000,
+        'instances_created': pool.created if mode == 'pooled' else requests,
+    }
+
+
+def run(args) -> dict:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    extractor = make_fixture_extractor(base_url)
+
+    results = []
+    try:
+        # One untimed request per mode so imports and regex compilation are excluded
+        for mode in args.modes:
+            run_mode(mode, extractor, 1, 1)
+        for mode in args.modes:
+            stats = run_mode(mode, extractor, args.requests, args.threads)
+            results.append(stats)
+            print(json.dumps(stats), file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    return {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per mode')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent requests, like YOUTUBE_DOWNLOAD_WORKERS')
+    parser.add_argument('--modes', nargs='+', choices=['fresh', 'pooled'], default=['fresh', 'pooled'])
+    parser.add_argument('-o', '--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""
+YouTube captions as a cheap substitute for running Whisper.
+
+Many videos carry manual subtitles or YouTube's own speech recognition
+("automatic captions"). yt-dlp lists both in a video's metadata; fetching a
+track costs one small HTTP request instead of downloading the audio and
+decoding it on the CPU. Tracks in WebVTT or YouTube's SRV (timedtext XML)
+formats are parsed into the same TranscriptionResult that transcription.py
+returns.
+
+Automatic captions are only used in the video's original language; YouTube
+also offers them machine-translated into every other language, which reads
+worse than a Whisper transcript.
+"""
+
+import html
+import logging
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from typing import Any, Dict, List, Optional
+
+from transcription import TranscriptionResult
+
+logger = logging.getLogger(__name__)
+
+# Try captions before downloading audio for /transcribe
+YOUTUBE_CAPTIONS = os.environ.get('YOUTUBE_CAPTIONS', '1') == '1'
+# Comma-separated languages whose manual subtitles are preferred over the
+# video's original language, e.g. "en,de"
+YOUTUBE_CAPTION_LANGUAGES = [
+    language.strip() for language in os.environ.get('YOUTUBE_CAPTION_LANGUAGES', '').split(',')
+    if language.strip()
+]
+
+# Track formats in order of preference; srv3 has no repeated lines to undo
+CAPTION_FORMATS = ('srv3', 'vtt', 'srv2', 'srv1')
+
+CaptionTrack = namedtuple('CaptionTrack', ['language', 'ext', 'url', 'automatic'])
+
+# One caption cue: start and end in seconds, and its text
+CaptionCue = namedtuple('CaptionCue', ['start', 'end', 'text'])
+
+_TAG_PATTERN = re.compile(r'<[^>]*>')
+_VTT_TIMING_PATTERN = re.compile(r'^\s*((?:\d+:)?\d+:\d+\.\d+)\s+-->\s+((?:\d+:)?\d+:\d+\.\d+)')
+
+
+class CaptionError(Exception):
+    """Raised when a caption track cannot be parsed."""
+    pass
+
+
+def _matches(key: str, language: str) -> bool:
+    """Whether a track key such as 'en-US' is in a language such as 'en'."""
+    return key == language or key.startswith(language + '-')
+
+
+def _pick_format(formats: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    by_ext = {fmt.get('ext'): fmt for fmt in formats if fmt.get('url')}
+    for ext in CAPTION_FORMATS:
+        if ext in by_ext:
+            return by_ext[ext]
+    return None
+
+
+def _track(key: str, formats: List[Dict[str, Any]], automatic: bool) -> Optional[CaptionTrack]:
+    fmt = _pick_format(formats)
+    if fmt is None:
+        return None
+    language = key[:-len('-orig')] if key.endswith('-orig') else key
+    return CaptionTrack(language, fmt['ext'], fmt['url'], automatic)
+
+
+def choose_track(info: Dict[str, Any], languages: Optional[List[str]] = None) -> Optional[CaptionTrack]:
+    """
+    Pick the caption track to use for a video, if any.
+
+    Manual subtitles in a preferred language come first, then manual
+    subtitles in the video's original language, then automatic captions in
+    the original language.
+
+    Args:
+        info: yt-dlp info dict of the video (``extract_info(download=False)``)
+        languages: Preferred languages, most preferred first; the video's
+            original language is always tried after them
+
+    Returns:
+        CaptionTrack, or None if the video has no usable track
+    """
+    original = info.get('language')
+    wanted = [language for language in (languages or []) if language]
+    if original and original not in wanted:
+        wanted.append(original)
+
+    subtitles = {key: formats for key, formats in (info.get('subtitles') or {}).items() if key != 'live_chat'}
+    for language in wanted:
+        for key, formats in subtitles.items():
+            if _matches(key, language):
+                track = _track(key, formats, automatic=False)
+                if track is not None:
+                    return track
+
+    automatic = info.get('automatic_captions') or {}
+    # YouTube marks the untranslated recognition track with an -orig suffix
+    keys = [key for key in automatic if key.endswith('-orig')]
+    if original:
+        keys = [key for key in keys if _matches(key, original)] + [original]
+    for key in keys:
+        if key in automatic:
+            track = _track(key, automatic[key], automatic=True)
+            if track is not None:
+                return track
+    return None
+
+
+def _clean(text: str) -> str:
+    """Strip markup and entities and collapse whitespace."""
+    return ' '.join(html.unescape(_TAG_PATTERN.sub('', text)).split())
+
+
+def _vtt_seconds(timestamp: str) -> float:
+    seconds = 0.0
+    for part in timestamp.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_vtt(data: str) -> List[CaptionCue]:
+    """
+    Parse a WebVTT track.
+
+    YouTube's automatic captions scroll: every cue repeats the line before
+    it and adds a new one. Lines equal to the previous line are dropped so
+    each spoken line appears once.
+    """
+    if not data.lstrip('\ufeff').startswith('WEBVTT'):
+        raise CaptionError("Not a WebVTT file")
+
+    cues = []
+    last_line = None
+    cue = None
+
+    def finish(cue):
+        if cue is not None and cue[2]:
+            cues.append(CaptionCue(cue[0], cue[1], ' '.join(cue[2])))
+
+    # Only an empty line ends a cue; YouTube puts whitespace-only lines in them
+    for line in data.splitlines():
+        timing = _VTT_TIMING_PATTERN.match(line)
+        if timing:
+            finish(cue)
+            start, end = (_vtt_seconds(value) for value in timing.groups())
+            cue = (start, end, [])
+        elif not line:
+            finish(cue)
+            cue = None
+        elif cue is not None:
+            # Lines outside cues are the header, identifiers and NOTE,
+            # STYLE or REGION blocks
+            text = _clean(line)
+            if text and text != last_line:
+                cue[2].append(text)
+                last_line = text
+    finish(cue)
+    return cues
+
+
+def parse_srv(data: str) -> List[CaptionCue]:
+    """
+    Parse a YouTube timedtext track in srv1, srv2 or srv3 format.
+
+    srv1 gives times in seconds (start, dur) on <text> elements; srv2 and
+    srv3 give milliseconds (t, d) on <text> or <p> elements, with srv3
+    splitting words into <s> children.
+    """
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError as e:
+        raise CaptionError(f"Not a timedtext file: {e}") from e
+
+    cues = []
+    for element in root.iter():
+        if element.tag not in ('text', 'p'):
+            continue
+        text = _clean(''.join(element.itertext()))
+        if 'start' in element.attrib:
+            # srv1 escapes its markup twice
+            text = _clean(text)
+            start = float(element.get('start'))
+            end = start + float(element.get('dur', 0))
+        else:
+            start = int(element.get('t', 0)) / 1000
+            end = start + int(element.get('d', 0)) / 1000
+        if text:
+            cues.append(CaptionCue(start, end, text))
+    return cues
+
+
+def parse_captions(data: str, ext: str) -> List[CaptionCue]:
+    """
+    Parse a caption track by its yt-dlp extension.
+
+    Raises:
+        CaptionError: If the format is unsupported or the data is malformed
+    """
+    if ext == 'vtt':
+        return parse_vtt(data)
+    if ext in ('srv1', 'srv2', 'srv3'):
+        return parse_srv(data)
+    raise CaptionError(f"Unsupported caption format: {ext}")
+
+
+def to_result(cues: List[CaptionCue], track: CaptionTrack, info: Dict[str, Any], size: int) -> TranscriptionResult:
+    """Build a TranscriptionResult with the metadata keys Whisper results carry."""
+    metadata = {
+        'language': track.language.split('-')[0],
+        'language_probability': None,
+        'duration': info.get('duration') or (cues[-1].end if cues else 0.0),
+        'file_name': f"{info.get('id')}.{track.language}.{track.ext}",
+        'file_size': size,
+        'segments_count': len(cues),
+        'avg_logprob': None,
+        'source': 'automatic_captions' if track.automatic else 'subtitles',
+    }
+    return TranscriptionResult(text=' '.join(cue.text for cue in cues), metadata=metadata)
+
+
+def fetch_blocking(ydl, info: Dict[str, Any], languages: Optional[List[str]] = None) -> Optional[TranscriptionResult]:
+    """
+    Fetch and parse the best caption track of a video (blocking).
+
+    Args:
+        ydl: YoutubeDL the info came from; its ``urlopen`` carries the
+            cookies and headers YouTube expects
+        info: yt-dlp info dict of the video
+        languages: Preferred languages, see ``choose_track``
+
+    Returns:
+        TranscriptionResult, or None if the video has no usable captions
+    """
+    track = choose_track(info, languages)
+    if track is None:
+        logger.debug(f"No usable captions for {info.get('id')}")
+        return None
+
+    try:
+        with ydl.urlopen(track.url) as response:
+            raw = response.read()
+        cues = parse_captions(raw.decode('utf-8', errors='replace'), track.ext)
+    except Exception as e:
+        logger.warning(f"Could not use {track.language} captions of {info.get('id')}: {e}")
+        return None
+
+    if not cues:
+        return None
+    logger.info(
+        f"Using {'automatic' if track.automatic else 'manual'} {track.language} captions "
+        f"({track.ext}, {len(cues)} cues) for {info.get('id')}"
+    )
+    return to_result(cues, track, info, len(raw))
@@ -1,28 +1,214 @@
+"""
+SQLite storage for chat settings, processed markers, caches and jobs.
+
+Connections are long-lived. The database runs in WAL mode, so reads never
+wait for a write: reads go to a small pool of reader threads, each holding
+its own connection, and every write goes to one writer thread that owns
+the only connection allowed to write. Since the writer runs one function
+at a time, a function's reads and writes together are never interleaved
+with another write. SQL statements are module constants, so each
+connection prepares them once and reuses them from its statement cache.
+
+Processed-message and processed-audio markers are written behind: they are
+buffered in memory, which answers lookups for them, and committed in
+groups, so a busy chat costs one transaction per batch of messages instead
+of one per message. A crash can lose the last DB_MARKER_FLUSH_MS of
+markers; those messages may then be handled again after the restart.
+
+Chat settings are read for nearly every message but rarely change, so rows
+of chat_settings are cached in memory (bounded, least recently used
+evicted first), loaded at init_database and written through by
+set_chat_setting.
+"""
+import os
 import sqlite3
+import json
 import logging
 import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Optional, Set, Any
+from typing import Optional, Set, Any, Dict, List, Tuple
 from functools import wraps
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = "bot_data.db"
 
-_db_lock = asyncio.Lock()
+# Threads (and connections) answering reads at once
+DB_READERS = int(os.environ.get('DB_READERS', '4'))
+# NORMAL skips the fsync on every commit in WAL mode: a power loss can lose
+# the last commits but never corrupts the database. FULL syncs every commit
+DB_SYNCHRONOUS = os.environ.get('DB_SYNCHRONOUS', 'NORMAL').upper()
+# The value is put into a PRAGMA as is, and SQLite silently ignores ones it
+# does not know
+_SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+if DB_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+    raise ValueError(
+        f"Invalid DB_SYNCHRONOUS {DB_SYNCHRONOUS!r}; choose one of {', '.join(_SYNCHRONOUS_MODES)}"
+    )
+# Page cache of each connection, in KiB
+DB_CACHE_KIB = int(os.environ.get('DB_CACHE_KIB', '8192'))
+
+# Processed-message and processed-audio markers are buffered and written in
+# one transaction this many milliseconds after the first arrives...
+DB_MARKER_FLUSH_MS = float(os.environ.get('DB_MARKER_FLUSH_MS', '50'))
+# ...or as soon as this many are waiting
+DB_MARKER_FLUSH_ITEMS = int(os.environ.get('DB_MARKER_FLUSH_ITEMS', '100'))
+
+# Chats whose settings are kept in memory, least recently used evicted first
+DB_SETTINGS_CACHE_SIZE = int(os.environ.get('DB_SETTINGS_CACHE_SIZE', '10000'))
+
+# Stages a job passes through; a job's row is deleted once it finishes
+JOB_STAGES = ('queued', 'downloading', 'transcoding', 'uploading', 'transcribing')
+
+# Columns of chat_settings that get_chat_setting and set_chat_setting accept
+CHAT_SETTINGS = ('delete_after_transcription', 'admin_prompted', 'audio_format')
+
+_SELECT_CHAT_ROW = f"SELECT {', '.join(CHAT_SETTINGS)} FROM chat_settings WHERE chat_id = ?"
+_SELECT_CHAT_ROWS = f"SELECT chat_id, {', '.join(CHAT_SETTINGS)} FROM chat_settings LIMIT ?"
+_UPDATE_CHAT_SETTING = {
+    name: f"UPDATE chat_settings SET {name} = ? WHERE chat_id = ?" for name in CHAT_SETTINGS
+}
+_INSERT_CHAT = "INSERT OR IGNORE INTO chat_settings (chat_id) VALUES (?)"
+_SELECT_CHAT_IDS = "SELECT DISTINCT chat_id FROM chat_settings"
+
+_SELECT_MESSAGE_PROCESSED = "SELECT 1 FROM processed_messages WHERE chat_id = ? AND message_id = ?"
+_INSERT_MESSAGE_PROCESSED = "INSERT OR IGNORE INTO processed_messages (chat_id, message_id) VALUES (?, ?)"
+_SELECT_AUDIO_PROCESSED = "SELECT 1 FROM processed_audio_ids WHERE audio_file_id = ?"
+_INSERT_AUDIO_PROCESSED = "INSERT OR IGNORE INTO processed_audio_ids (audio_file_id) VALUES (?)"
+
+_SELECT_TRANSCRIPTION = "SELECT text, metadata FROM transcription_cache WHERE cache_key = ?"
+_TOUCH_TRANSCRIPTION = "UPDATE transcription_cache SET last_used_at = ? WHERE cache_key = ?"
+_INSERT_TRANSCRIPTION = (
+    "INSERT OR REPLACE INTO transcription_cache "
+    "(cache_key, text, metadata, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)"
+)
+_EXPIRE_TRANSCRIPTIONS = "DELETE FROM transcription_cache WHERE last_used_at < ?"
+_TRIM_TRANSCRIPTIONS = (
+    "DELETE FROM transcription_cache WHERE cache_key IN ("
+    "SELECT cache_key FROM transcription_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)"
+)
+
+_SELECT_LANGUAGE = "SELECT language, streak, hinted_since_check FROM chat_languages WHERE chat_id = ?"
+_COUNT_HINTED = "UPDATE chat_languages SET hinted_since_check = hinted_since_check + 1 WHERE chat_id = ?"
+_REPLACE_LANGUAGE = (
+    "INSERT OR REPLACE INTO chat_languages (chat_id, language, streak, hinted_since_check) "
+    "VALUES (?, ?, ?, 0)"
+)
+_CLEAR_LANGUAGE_HINT = "UPDATE chat_languages SET streak = 0, hinted_since_check = 0 WHERE chat_id = ?"
+
+_SELECT_FILE_ID = "SELECT file_id FROM youtube_file_ids WHERE video_id = ? AND format = ? AND bitrate = ?"
+_REPLACE_FILE_ID = (
+    "INSERT OR REPLACE INTO youtube_file_ids (video_id, format, bitrate, file_id, created_at) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+_DELETE_FILE_ID = "DELETE FROM youtube_file_ids WHERE video_id = ? AND format = ? AND bitrate = ?"
+
+_INSERT_JOB = (
+    "INSERT OR IGNORE INTO jobs (kind, chat_id, message_id, payload, stage, created_at, updated_at) "
+    "VALUES (?, ?, ?, ?, 'queued', ?, ?)"
+)
+_SELECT_JOB = "SELECT * FROM jobs WHERE chat_id = ? AND message_id = ? AND kind = ?"
+_UPDATE_JOB_STAGE = "UPDATE jobs SET stage = ?, updated_at = ? WHERE job_id = ?"
+_UPDATE_JOB = "UPDATE jobs SET stage = ?, artifacts = ?, updated_at = ? WHERE job_id = ?"
+_COUNT_JOB_ATTEMPT = "UPDATE jobs SET attempts = attempts + 1 WHERE job_id = ?"
+_SELECT_JOB_ATTEMPTS = "SELECT attempts FROM jobs WHERE job_id = ?"
+_DELETE_JOB = "DELETE FROM jobs WHERE job_id = ?"
+_SELECT_JOBS = "SELECT * FROM jobs ORDER BY job_id"
+
+_local = threading.local()
+# Every open connection, so close_database can close them from any thread
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+# Bumped when connections are closed; threads then open fresh ones
+_generation = 0
+_writer: Optional[ThreadPoolExecutor] = None
+_readers: Optional[ThreadPoolExecutor] = None
+
+# Markers not yet committed; lookups consult them before the database
+_pending_messages: Set[Tuple[int, int]] = set()
+_pending_audio: Set[str] = set()
+_pending_lock = threading.Lock()
+_flusher: Optional[asyncio.Task] = None
+
+# chat_settings rows by chat ID, least recently used first; None records
+# that a chat has no row, so its defaults apply
+_settings_cache: "OrderedDict[int, Optional[Dict[str, Any]]]" = OrderedDict()
+_settings_lock = threading.Lock()
+# Bumped by every settings write, so a read that raced with one is not cached
+_settings_version = 0
+_settings_hits = 0
+_settings_misses = 0
+_markers_waiting: Optional[asyncio.Event] = None
+_markers_full: Optional[asyncio.Event] = None
+
+def _connect() -> sqlite3.Connection:
+    # Each connection is used by a single thread; check_same_thread is off
+    # only so that close_database may close it
+    conn = sqlite3.connect(DB_PATH, timeout=5.0, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size = {-DB_CACHE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+def _thread_connection() -> sqlite3.Connection:
+    """The calling thread's connection, opened on first use."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect()
+        with _connections_lock:
+            _connections.append(conn)
+            _local.conn, _local.generation = conn, _generation
+    return conn
+
+def _close_connections():
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Error closing database connection: {e}")
+
+def _get_writer() -> ThreadPoolExecutor:
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+    return _writer
+
+def _get_readers() -> ThreadPoolExecutor:
+    global _readers
+    if _readers is None:
+        _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix='sqlite-reader')
+    return _readers
 
 def async_db_operation(func):
+    """Run a function that writes on the writer thread, one at a time."""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(_get_writer(), lambda: func(*args, **kwargs))
+    return wrapper
+
+def async_db_read(func):
+    """Run a read-only function on a reader thread, alongside other reads and writes."""
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        async with _db_lock:
-            loop = asyncio.get_event_loop()
-            return await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(_get_readers(), lambda: func(*args, **kwargs))
     return wrapper
 
 @contextmanager
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """The calling thread's connection; the block's changes are committed when it succeeds."""
+    conn = _thread_connection()
     try:
         yield conn
         conn.commit()
@@ -30,21 +216,55 @@ def get_db_connection():
         conn.rollback()
         logger.error(f"Database error: {e}")
         raise
-    finally:
-        conn.close()
+
+async def close_database():
+    """Commit buffered markers, wait for pending operations, then close every connection."""
+    global _writer, _readers, _flusher
+    if _flusher is not None:
+        flusher, _flusher = _flusher, None
+        if flusher.get_loop() is asyncio.get_event_loop():
+            flusher.cancel()
+            try:
+                await flusher
+            except asyncio.CancelledError:
+                pass
+    await flush_markers()
+    
+    executors = [executor for executor in (_writer, _readers) if executor is not None]
+    _writer = _readers = None
+    loop = asyncio.get_event_loop()
+    for executor in executors:
+        await loop.run_in_executor(None, executor.shutdown, True)
+    # The last connection to close checkpoints the WAL into the database file
+    _close_connections()
 
 def init_database():
+    # Connections and markers of a previous database (or DB_PATH) are not reused
+    _close_connections()
+    with _pending_lock:
+        _pending_messages.clear()
+        _pending_audio.clear()
+    _reset_settings_cache()
     with get_db_connection() as conn:
         cursor = conn.cursor()
         
+        # Persistent: recorded in the database file, so set once here
+        cursor.execute("PRAGMA journal_mode = WAL")
+        
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS chat_settings (
                 chat_id INTEGER PRIMARY KEY,
                 delete_after_transcription INTEGER DEFAULT 1,
-                admin_prompted INTEGER DEFAULT 0
+                admin_prompted INTEGER DEFAULT 0,
+                audio_format TEXT
             )
         """)
         
+        # Databases created before audio_format existed
+        cursor.execute("PRAGMA table_info(chat_settings)")
+        if 'audio_format' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE chat_settings ADD COLUMN audio_format TEXT")
+        
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS processed_messages (
                 chat_id INTEGER,
@@ -60,34 +280,140 @@ def init_database():
             )
         """)
         
-        logger.info("Database initialized successfully")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS transcription_cache (
+                cache_key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transcription_cache_last_used
+            ON transcription_cache (last_used_at)
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_languages (
+                chat_id INTEGER PRIMARY KEY,
+                language TEXT NOT NULL,
+                streak INTEGER NOT NULL DEFAULT 0,
+                hinted_since_check INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS youtube_file_ids (
+                video_id TEXT NOT NULL,
+                format TEXT NOT NULL,
+                bitrate TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (video_id, format, bitrate)
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                artifacts TEXT NOT NULL DEFAULT '{}',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (chat_id, message_id, kind)
+            )
+        """)
+        
+        # Warm the settings cache so the first message of each chat is a hit
+        cursor.execute(_SELECT_CHAT_ROWS, (DB_SETTINGS_CACHE_SIZE,))
+        rows = cursor.fetchall()
+        with _settings_lock:
+            for row in rows:
+                _store_settings(row['chat_id'], _row_settings(row))
+        
+        logger.info(f"Database initialized successfully; cached settings of {len(rows)} chats")
 
-@async_db_operation
-def get_chat_setting(chat_id: int, setting_name: str, default: Any = None) -> Any:
+def _row_settings(row) -> Optional[Dict[str, Any]]:
+    return None if row is None else {name: row[name] for name in CHAT_SETTINGS}
+
+def _store_settings(chat_id: int, settings: Optional[Dict[str, Any]]):
+    # Callers hold _settings_lock
+    _settings_cache[chat_id] = settings
+    _settings_cache.move_to_end(chat_id)
+    while len(_settings_cache) > DB_SETTINGS_CACHE_SIZE:
+        _settings_cache.popitem(last=False)
+
+def _reset_settings_cache():
+    global _settings_hits, _settings_misses
+    with _settings_lock:
+        _settings_cache.clear()
+        _settings_hits = _settings_misses = 0
+
+def settings_cache_stats() -> Dict[str, Any]:
+    """Lookups of the chat settings cache since init_database, for monitoring its hit rate."""
+    with _settings_lock:
+        lookups = _settings_hits + _settings_misses
+        return {
+            'hits': _settings_hits,
+            'misses': _settings_misses,
+            'hit_rate': _settings_hits / lookups if lookups else None,
+            'size': len(_settings_cache),
+        }
+
+@async_db_read
+def _load_chat_settings(chat_id: int) -> Optional[Dict[str, Any]]:
+    with _settings_lock:
+        version = _settings_version
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            f"SELECT {setting_name} FROM chat_settings WHERE chat_id = ?",
-            (chat_id,)
-        )
-        row = cursor.fetchone()
-        if row is None:
-            return default
-        return row[0]
+        cursor.execute(_SELECT_CHAT_ROW, (chat_id,))
+        settings = _row_settings(cursor.fetchone())
+    with _settings_lock:
+        if version == _settings_version:
+            _store_settings(chat_id, settings)
+    return settings
+
+async def get_chat_setting(chat_id: int, setting_name: str, default: Any = None) -> Any:
+    """A chat's setting, from the settings cache when possible; default if the chat has no settings."""
+    global _settings_hits, _settings_misses
+    if setting_name not in CHAT_SETTINGS:
+        raise ValueError(f"Unknown chat setting {setting_name!r}")
+    with _settings_lock:
+        cached = chat_id in _settings_cache
+        if cached:
+            settings = _settings_cache[chat_id]
+            _settings_cache.move_to_end(chat_id)
+            _settings_hits += 1
+        else:
+            _settings_misses += 1
+    if not cached:
+        settings = await _load_chat_settings(chat_id)
+    if settings is None:
+        return default
+    return settings[setting_name]
 
 @async_db_operation
 def set_chat_setting(chat_id: int, setting_name: str, value: Any):
+    global _settings_version
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO chat_settings (chat_id) VALUES (?)",
-            (chat_id,)
-        )
-        cursor.execute(
-            f"UPDATE chat_settings SET {setting_name} = ? WHERE chat_id = ?",
-            (value, chat_id)
-        )
-        logger.info(f"Chat {chat_id}: Set {setting_name} to {value}")
+        cursor.execute(_INSERT_CHAT, (chat_id,))
+        cursor.execute(_UPDATE_CHAT_SETTING[setting_name], (value, chat_id))
+        cursor.execute(_SELECT_CHAT_ROW, (chat_id,))
+        settings = _row_settings(cursor.fetchone())
+    # Write through once committed; the version bump keeps reads that
+    # started before this write from caching the old row
+    with _settings_lock:
+        _settings_version += 1
+        _store_settings(chat_id, settings)
+    logger.info(f"Chat {chat_id}: Set {setting_name} to {value}")
 
 async def get_delete_after_transcription(chat_id: int) -> bool:
     result = await get_chat_setting(chat_id, "delete_after_transcription", default=1)
@@ -96,6 +422,13 @@ async def get_delete_after_transcription(chat_id: int) -> bool:
 async def set_delete_after_transcription(chat_id: int, delete: bool):
     await set_chat_setting(chat_id, "delete_after_transcription", 1 if delete else 0)
 
+async def get_audio_format(chat_id: int) -> Optional[str]:
+    """The chat's YouTube delivery format, or None to use the global default."""
+    return await get_chat_setting(chat_id, "audio_format", default=None)
+
+async def set_audio_format(chat_id: int, audio_format: Optional[str]):
+    await set_chat_setting(chat_id, "audio_format", audio_format)
+
 async def get_admin_prompted(chat_id: int) -> bool:
     result = await get_chat_setting(chat_id, "admin_prompted", default=0)
     return bool(result)
@@ -103,49 +436,266 @@ async def get_admin_prompted(chat_id: int) -> bool:
 async def set_admin_prompted(chat_id: int, prompted: bool):
     await set_chat_setting(chat_id, "admin_prompted", 1 if prompted else 0)
 
-@async_db_operation
-def is_message_processed(chat_id: int, message_id: int) -> bool:
+@async_db_read
+def _is_message_stored(chat_id: int, message_id: int) -> bool:
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM processed_messages WHERE chat_id = ? AND message_id = ?",
-            (chat_id, message_id)
-        )
+        cursor.execute(_SELECT_MESSAGE_PROCESSED, (chat_id, message_id))
         return cursor.fetchone() is not None
 
+async def is_message_processed(chat_id: int, message_id: int) -> bool:
+    with _pending_lock:
+        if (chat_id, message_id) in _pending_messages:
+            return True
+    return await _is_message_stored(chat_id, message_id)
+
+async def mark_message_processed(chat_id: int, message_id: int):
+    """Record a handled message; stored with the next group commit, answered from memory until then."""
+    with _pending_lock:
+        _pending_messages.add((chat_id, message_id))
+    _markers_added()
+    logger.debug(f"Marked message {message_id} in chat {chat_id} as processed")
+
+@async_db_read
+def _is_audio_stored(audio_file_id: str) -> bool:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SELECT_AUDIO_PROCESSED, (audio_file_id,))
+        return cursor.fetchone() is not None
+
+async def is_audio_processed(audio_file_id: str) -> bool:
+    with _pending_lock:
+        if audio_file_id in _pending_audio:
+            return True
+    return await _is_audio_stored(audio_file_id)
+
+async def mark_audio_processed(audio_file_id: str):
+    """Record a transcribed audio file; stored with the next group commit, answered from memory until then."""
+    with _pending_lock:
+        _pending_audio.add(audio_file_id)
+    _markers_added()
+    logger.debug(f"Marked audio {audio_file_id} as processed")
+
+def _write_pending_markers(conn: sqlite3.Connection) -> Tuple[List[Tuple[int, int]], List[str]]:
+    """Insert every buffered marker on conn, in the caller's transaction; returns what was written."""
+    with _pending_lock:
+        messages = list(_pending_messages)
+        audio = list(_pending_audio)
+    if messages:
+        conn.executemany(_INSERT_MESSAGE_PROCESSED, messages)
+    if audio:
+        conn.executemany(_INSERT_AUDIO_PROCESSED, [(audio_file_id,) for audio_file_id in audio])
+    return messages, audio
+
+def _forget_pending_markers(messages: List[Tuple[int, int]], audio: List[str]):
+    # Only once committed, so a lookup finds each marker in memory or on disk
+    with _pending_lock:
+        _pending_messages.difference_update(messages)
+        _pending_audio.difference_update(audio)
+
 @async_db_operation
-def mark_message_processed(chat_id: int, message_id: int):
+def flush_markers() -> int:
+    """
+    Commit every buffered processed-message and processed-audio marker now.
+    
+    Returns:
+        Number of markers written
+    """
+    with get_db_connection() as conn:
+        messages, audio = _write_pending_markers(conn)
+    _forget_pending_markers(messages, audio)
+    count = len(messages) + len(audio)
+    if count:
+        logger.debug(f"Group commit of {count} processed markers")
+    return count
+
+def _markers_added():
+    global _flusher, _markers_waiting, _markers_full
+    loop = asyncio.get_event_loop()
+    if _flusher is None or _flusher.done() or _flusher.get_loop() is not loop:
+        _markers_waiting = asyncio.Event()
+        _markers_full = asyncio.Event()
+        _flusher = loop.create_task(_flush_markers_periodically())
+    with _pending_lock:
+        pending = len(_pending_messages) + len(_pending_audio)
+    _markers_waiting.set()
+    if pending >= DB_MARKER_FLUSH_ITEMS:
+        _markers_full.set()
+
+async def _flush_markers_periodically():
+    while True:
+        await _markers_waiting.wait()
+        # Gather whatever else arrives within the interval, unless the buffer fills first
+        try:
+            await asyncio.wait_for(_markers_full.wait(), DB_MARKER_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        _markers_waiting.clear()
+        _markers_full.clear()
+        try:
+            await flush_markers()
+        except Exception as e:
+            # Still buffered; retried after the next interval
+            logger.error(f"Could not write processed markers: {e}")
+            _markers_waiting.set()
+
+@async_db_read
+def get_all_chat_ids() -> Set[int]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO processed_messages (chat_id, message_id) VALUES (?, ?)",
-            (chat_id, message_id)
-        )
-        logger.debug(f"Marked message {message_id} in chat {chat_id} as processed")
+        cursor.execute(_SELECT_CHAT_IDS)
+        return {row[0] for row in cursor.fetchall()}
 
 @async_db_operation
-def is_audio_processed(audio_file_id: str) -> bool:
+def get_cached_transcription(cache_key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT 1 FROM processed_audio_ids WHERE audio_file_id = ?",
-            (audio_file_id,)
-        )
-        return cursor.fetchone() is not None
+        cursor.execute(_SELECT_TRANSCRIPTION, (cache_key,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        cursor.execute(_TOUCH_TRANSCRIPTION, (time.time(), cache_key))
+        return row[0], json.loads(row[1])
 
 @async_db_operation
-def mark_audio_processed(audio_file_id: str):
+def store_cached_transcription(cache_key: str, text: str, metadata: Dict[str, Any],
+                               max_entries: int, max_age_seconds: float):
+    now = time.time()
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO processed_audio_ids (audio_file_id) VALUES (?)",
-            (audio_file_id,)
-        )
-        logger.debug(f"Marked audio {audio_file_id} as processed")
+        cursor.execute(_INSERT_TRANSCRIPTION, (cache_key, text, json.dumps(metadata), now, now))
+        # Evict entries unused for too long, then the least recently used
+        # ones beyond the size limit.
+        cursor.execute(_EXPIRE_TRANSCRIPTIONS, (now - max_age_seconds,))
+        cursor.execute(_TRIM_TRANSCRIPTIONS, (max_entries,))
+        logger.debug(f"Cached transcription {cache_key[:12]}")
 
 @async_db_operation
-def get_all_chat_ids() -> Set[int]:
+def get_language_hint(chat_id: int, min_streak: int, recheck_every: int) -> Optional[str]:
+    """Return the chat's remembered language once it is established, else None.
+    
+    Every recheck_every hinted clips, None is returned once so the caller
+    runs language detection again.
+    """
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT chat_id FROM chat_settings")
-        return {row[0] for row in cursor.fetchall()}
+        cursor.execute(_SELECT_LANGUAGE, (chat_id,))
+        row = cursor.fetchone()
+        if row is None or row[1] < min_streak or row[2] >= recheck_every:
+            return None
+        cursor.execute(_COUNT_HINTED, (chat_id,))
+        return row[0]
+
+@async_db_read
+def peek_language_hint(chat_id: int, min_streak: int) -> Optional[str]:
+    """Return the chat's established language without counting it as a hinted clip.
+    
+    For lookups that do not run Whisper, such as choosing a caption track,
+    so they neither write nor bring the next recheck closer.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SELECT_LANGUAGE, (chat_id,))
+        row = cursor.fetchone()
+        if row is None or row[1] < min_streak:
+            return None
+        return row[0]
+
+@async_db_operation
+def record_detected_language(chat_id: int, language: str, confident: bool):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SELECT_LANGUAGE, (chat_id,))
+        row = cursor.fetchone()
+        if not confident:
+            streak = 0
+        elif row is not None and row[0] == language:
+            streak = row[1] + 1
+        else:
+            streak = 1
+        cursor.execute(_REPLACE_LANGUAGE, (chat_id, language, streak))
+        logger.debug(f"Chat {chat_id}: detected {language} (streak {streak})")
+
+@async_db_operation
+def clear_language_hint(chat_id: int):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_CLEAR_LANGUAGE_HINT, (chat_id,))
+        logger.info(f"Chat {chat_id}: cleared language hint")
+
+@async_db_read
+def get_youtube_file_id(video_id: str, audio_format: str, bitrate: str) -> Optional[str]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SELECT_FILE_ID, (video_id, audio_format, bitrate))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+@async_db_operation
+def store_youtube_file_id(video_id: str, audio_format: str, bitrate: str, file_id: str):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_REPLACE_FILE_ID, (video_id, audio_format, bitrate, file_id, time.time()))
+        logger.debug(f"Stored Telegram file_id for video {video_id} ({audio_format} {bitrate})")
+
+@async_db_operation
+def delete_youtube_file_id(video_id: str, audio_format: str, bitrate: str):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_DELETE_FILE_ID, (video_id, audio_format, bitrate))
+
+@async_db_operation
+def create_job(kind: str, chat_id: int, message_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Record an accepted job in the 'queued' stage, or return the existing job for the message."""
+    now = time.time()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_INSERT_JOB, (kind, chat_id, message_id, json.dumps(payload), now, now))
+        cursor.execute(_SELECT_JOB, (chat_id, message_id, kind))
+        return _job_from_row(cursor.fetchone())
+
+@async_db_operation
+def update_job(job_id: int, stage: str, artifacts: Optional[Dict[str, Any]] = None):
+    """Move a job to a stage, replacing its artifacts when given."""
+    if stage not in JOB_STAGES:
+        raise ValueError(f"Unknown job stage {stage!r}")
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if artifacts is None:
+            cursor.execute(_UPDATE_JOB_STAGE, (stage, time.time(), job_id))
+        else:
+            cursor.execute(_UPDATE_JOB, (stage, json.dumps(artifacts), time.time(), job_id))
+
+@async_db_operation
+def record_job_attempt(job_id: int) -> int:
+    """Count a resume of a job; returns how many times it has been resumed."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_COUNT_JOB_ATTEMPT, (job_id,))
+        cursor.execute(_SELECT_JOB_ATTEMPTS, (job_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+@async_db_operation
+def finish_job(job_id: int):
+    with get_db_connection() as conn:
+        # Buffered markers are committed with the job's deletion, so a
+        # restart never finds a finished job's message unmarked
+        messages, audio = _write_pending_markers(conn)
+        cursor = conn.cursor()
+        cursor.execute(_DELETE_JOB, (job_id,))
+    _forget_pending_markers(messages, audio)
+
+@async_db_read
+def get_unfinished_jobs() -> List[Dict[str, Any]]:
+    """Jobs left over from an earlier run, oldest first."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_SELECT_JOBS)
+        return [_job_from_row(row) for row in cursor.fetchall()]
+
+def _job_from_row(row) -> Dict[str, Any]:
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['artifacts'] = json.loads(job['artifacts'])
+    return job
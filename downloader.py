@@ -0,0 +1,948 @@
+"""
+YouTube audio download module using yt-dlp.
+
+Downloads run on a dedicated, bounded thread pool so the event loop stays
+responsive while yt-dlp fetches and FFmpeg transcodes. Progress reported by
+yt-dlp's hooks is forwarded to an optional callback on the event loop.
+
+With YOUTUBE_STREAMING_TRANSCODE, FFmpeg reads the audio stream straight
+from YouTube and encodes it as it arrives, so downloading and transcoding
+overlap and no intermediate source file is written.
+
+Each download works in its own scratch directory (see scratch.py) and only
+the finished file is moved out. Finished files are kept in an on-disk cache
+keyed by (video ID, format, bitrate) and evicted least recently used first
+once the cache exceeds its byte budget.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import subprocess
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, AsyncIterator, Callable, FrozenSet, List, Set
+
+import captions
+import scratch
+from ydl_pool import YoutubeDLPool
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """Base exception for download errors."""
+    pass
+
+
+class DownloadBusyError(DownloadError):
+    """Raised when every download worker is busy and the wait queue is full."""
+    pass
+
+
+class DownloadCancelledError(DownloadError):
+    """Raised inside yt-dlp's hooks to abort a download nobody waits for."""
+    pass
+
+
+class DownloadRejectedError(DownloadError):
+    """Raised before downloading when a video can never be delivered; the message is user-facing."""
+    pass
+
+
+# Downloads running at once; each one is mostly network and FFmpeg time, so
+# threads are enough to overlap them.
+YOUTUBE_DOWNLOAD_WORKERS = int(os.environ.get('YOUTUBE_DOWNLOAD_WORKERS', '4'))
+# Downloads allowed to wait for a free worker before callers get DownloadBusyError
+YOUTUBE_DOWNLOAD_MAX_QUEUE = int(os.environ.get('YOUTUBE_DOWNLOAD_MAX_QUEUE', '32'))
+# Idle YoutubeDL instances kept per option profile for reuse between downloads
+YOUTUBE_DL_POOL_SIZE = int(os.environ.get('YOUTUBE_DL_POOL_SIZE', str(YOUTUBE_DOWNLOAD_WORKERS)))
+
+# On-disk cache of finished files; 0 disables it and files are removed after use
+YOUTUBE_CACHE_DIR = os.environ.get('YOUTUBE_CACHE_DIR', 'audio_cache')
+YOUTUBE_CACHE_MAX_BYTES = int(os.environ.get('YOUTUBE_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+
+# Delivery formats. 'mp3' re-encodes to 192 kbps MP3. 'm4a' sends YouTube's
+# native AAC stream remuxed into an .m4a container, with no decode or
+# re-encode; only if a video has no AAC stream is its audio converted.
+AudioFormat = namedtuple('AudioFormat', ['name', 'bitrate', 'selector', 'codec', 'quality'])
+AUDIO_FORMATS = {
+    'mp3': AudioFormat('mp3', '192', 'bestaudio/best', 'mp3', '192'),
+    'm4a': AudioFormat('m4a', 'native', 'bestaudio[ext=m4a]/bestaudio/best', 'm4a', None),
+}
+# Format used for chats that have not chosen one
+YOUTUBE_AUDIO_FORMAT = os.environ.get('YOUTUBE_AUDIO_FORMAT', 'mp3')
+# Format fetched for transcription: the native AAC stream, which Whisper's
+# decoder reads directly, with no MP3 encode and decode in between
+TRANSCRIPTION_AUDIO_FORMAT = 'm4a'
+
+# Telegram's upload limit for bots. Files that would exceed it are sent at a
+# lower MP3 bitrate, or split into numbered parts, or rejected up front.
+TELEGRAM_UPLOAD_LIMIT_BYTES = int(os.environ.get('TELEGRAM_UPLOAD_LIMIT_BYTES', str(50 * 1024 * 1024)))
+# Most parts a video may be split into; longer ones are rejected
+YOUTUBE_MAX_PARTS = int(os.environ.get('YOUTUBE_MAX_PARTS', '4'))
+# Longest video accepted, in seconds; 0 means no limit
+YOUTUBE_MAX_DURATION = int(os.environ.get('YOUTUBE_MAX_DURATION', '0'))
+# MP3 bitrates tried, highest first, when a video does not fit at the default
+MP3_FALLBACK_BITRATES = ('160', '128', '96')
+# Size estimates are rough (VBR, container overhead); aim below the limit
+_UPLOAD_HEADROOM = 0.95
+
+# Pipe the stream through FFmpeg while it downloads instead of downloading
+# the whole file first and transcoding it afterwards
+YOUTUBE_STREAMING_TRANSCODE = os.environ.get('YOUTUBE_STREAMING_TRANSCODE', '0') == '1'
+
+# Canonical 11-character video ID in watch, short, embed, live and youtu.be links
+_VIDEO_ID_PATTERN = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:[^#\s]*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)([A-Za-z0-9_-]{11})'
+)
+
+# Any YouTube link in a message
+_URL_PATTERN = re.compile(r'(?:https?://)?(?:(?:www|m|music)\.)?(?:youtube\.com|youtu\.be)/[^\s<>"]+')
+
+# Playlist entries expanded from a single link at most
+YOUTUBE_PLAYLIST_MAX_ITEMS = int(os.environ.get('YOUTUBE_PLAYLIST_MAX_ITEMS', '200'))
+
+# Fields of yt-dlp's info dict kept next to a cached file
+_CACHED_INFO_FIELDS = ('id', 'title', 'duration', 'uploader')
+
+# parts lists the files to upload when path is too large to send whole;
+# cached is True when the file came from the disk cache instead of yt-dlp
+DownloadedAudio = namedtuple(
+    'DownloadedAudio', ['path', 'info', 'audio_format', 'parts', 'cached'], defaults=(None, False)
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_slots: Optional[asyncio.Semaphore] = None
+_waiting = 0
+_active = set()
+# In-flight downloads keyed by video ID (or URL when there is none)
+_flights: Dict[str, '_Flight'] = {}
+# Callers currently delivering each file, and files one of them wants kept
+_holders: Dict[str, int] = {}
+_kept: Set[str] = set()
+# Callers uploading from each directory of split parts. Every cache hit
+# splits into a directory of its own; a coalesced download shares one.
+_part_holders: Dict[str, int] = {}
+# Warm YoutubeDL instances shared by preflights, downloads and playlist expansion
+_ydl_pool = YoutubeDLPool(max_idle=YOUTUBE_DL_POOL_SIZE)
+
+
+class _Flight:
+    """A download in progress and the callers waiting for it."""
+
+    def __init__(self):
+        self.listeners: List[Callable] = []
+        self.waiters = 0
+        self.task: Optional[asyncio.Future] = None
+
+
+def is_youtube_url(text: str) -> bool:
+    """Whether text contains a YouTube link."""
+    return 'youtube.com' in text or 'youtu.be' in text
+
+
+def parse_video_id(url: str) -> Optional[str]:
+    """Extract the canonical YouTube video ID from a link, or None."""
+    match = _VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+
+def extract_youtube_urls(text: str) -> List[str]:
+    """Every distinct YouTube link in text, in order of appearance."""
+    urls = []
+    for match in _URL_PATTERN.finditer(text):
+        url = match.group(0).rstrip('.,;:!?)')
+        if not url.startswith('http'):
+            url = 'https://' + url
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def is_playlist_url(url: str) -> bool:
+    """Whether a link names a playlist rather than a single video."""
+    # watch?v=...&list=... plays one video of a playlist; treat it as that video
+    return 'list=' in url and parse_video_id(url) is None
+
+
+async def expand_playlist(url: str, max_items: int = None) -> AsyncIterator[str]:
+    """
+    Yield the video links of a playlist as yt-dlp pages through it.
+
+    Entries are fetched lazily in a worker thread, so the first videos can
+    start downloading before the rest of the playlist is known.
+
+    Args:
+        url: Playlist link
+        max_items: Stop after this many entries (default: YOUTUBE_PLAYLIST_MAX_ITEMS)
+
+    Raises:
+        DownloadError: If yt-dlp cannot read the playlist
+    """
+    max_items = max_items or YOUTUBE_PLAYLIST_MAX_ITEMS
+    loop = asyncio.get_event_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            opts = {'extract_flat': 'in_playlist', 'lazy_playlist': True, 'quiet': True, 'no_warnings': True}
+            with _ydl_pool.checkout('playlist', lambda: opts) as pooled:
+                # process=False leaves entries as a generator that fetches pages on demand
+                playlist = pooled.ydl.extract_info(url, download=False, process=False)
+                for count, entry in enumerate(playlist.get('entries') or []):
+                    if stop.is_set() or count >= max_items:
+                        break
+                    if entry and entry.get('id'):
+                        loop.call_soon_threadsafe(
+                            queue.put_nowait, f"https://www.youtube.com/watch?v={entry['id']}"
+                        )
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, DownloadError(f"Could not read playlist: {e}"))
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    future = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, DownloadError):
+                raise item
+            yield item
+        await future
+    finally:
+        stop.set()
+
+
+def get_audio_format(name: Optional[str] = None) -> AudioFormat:
+    """
+    Look up a delivery format by name, defaulting to YOUTUBE_AUDIO_FORMAT.
+
+    Raises:
+        ValueError: If the name is not a known format
+    """
+    name = name or YOUTUBE_AUDIO_FORMAT
+    if name not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format {name!r}; choose one of {', '.join(AUDIO_FORMATS)}")
+    return AUDIO_FORMATS[name]
+
+
+def cache_key(video_id: str, audio_format: AudioFormat) -> str:
+    """Name shared by a video's cached file and its in-flight download."""
+    return f"{video_id}-{audio_format.name}-{audio_format.bitrate}"
+
+
+def _cache_path(video_id: str, audio_format: AudioFormat) -> str:
+    return os.path.join(YOUTUBE_CACHE_DIR, f"{cache_key(video_id, audio_format)}.{audio_format.name}")
+
+
+def _cached_audio(video_id: str, audio_format: AudioFormat) -> Optional[DownloadedAudio]:
+    """Return the cached file for a video, marking it recently used."""
+    path = _cache_path(video_id, audio_format)
+    sidecar = path + '.json'
+    # The sidecar is written only once a file is complete, so a file still
+    # being downloaded never counts as a hit
+    if not (os.path.exists(path) and os.path.exists(sidecar)):
+        return None
+    try:
+        with open(sidecar) as f:
+            info = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+        return None
+    return DownloadedAudio(path, info, audio_format, cached=True)
+
+
+def _store_in_cache(download: DownloadedAudio, protected: FrozenSet[str]):
+    """Register a finished download in the disk cache and evict down to the budget."""
+    with open(download.path + '.json', 'w') as f:
+        json.dump({key: download.info.get(key) for key in _CACHED_INFO_FIELDS}, f)
+    _evict(protected | {download.path})
+
+
+def _evict(protected: FrozenSet[str]):
+    """Remove least recently used cache files until the cache fits its byte budget."""
+    entries = []
+    for entry in os.scandir(YOUTUBE_CACHE_DIR):
+        # Skip sidecars and files still being written
+        if entry.name.endswith(('.json', '.part')) or not entry.is_file():
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= YOUTUBE_CACHE_MAX_BYTES:
+            break
+        if path in protected:
+            # Still being delivered, or just added
+            continue
+        for stale in (path, path + '.json'):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        total -= size
+        logger.info(f"Evicted {path} from the audio cache")
+
+
+def _parts_dir(download: DownloadedAudio) -> Optional[str]:
+    return os.path.dirname(download.parts[0]) if download.parts else None
+
+
+def _hold(download: DownloadedAudio) -> DownloadedAudio:
+    """Count a caller that will deliver this file; see ``release``."""
+    _holders[download.path] = _holders.get(download.path, 0) + 1
+    directory = _parts_dir(download)
+    if directory is not None:
+        _part_holders[directory] = _part_holders.get(directory, 0) + 1
+    return download
+
+
+async def release(download: DownloadedAudio, keep: bool):
+    """
+    Hand a delivered file back: keep it in the disk cache or delete it.
+
+    Several callers can hold the same file (coalesced requests, cache hits).
+    Nothing is deleted until the last of them releases it, and the file
+    stays if any holder asked to keep it or it was already cached. Split
+    parts are counted by their own directory, which is removed once every
+    caller uploading from it has released it.
+
+    Args:
+        download: Result of download_audio
+        keep: Keep the file in the cache (subject to its byte budget); when
+            False or caching is disabled the file is removed. Callers pass
+            the chat's delete-after-processing setting, so the cache only
+            fills with downloads for chats that keep files
+    """
+    path = download.path
+    if keep:
+        _kept.add(path)
+
+    loop = asyncio.get_event_loop()
+    directory = _parts_dir(download)
+    if directory is not None:
+        # Parts are only for uploading; the whole file is what gets cached
+        uploading = _part_holders.get(directory, 1) - 1
+        if uploading > 0:
+            _part_holders[directory] = uploading
+        else:
+            _part_holders.pop(directory, None)
+            await loop.run_in_executor(None, scratch.remove_dir, directory)
+
+    remaining = _holders.get(path, 1) - 1
+    if remaining > 0:
+        _holders[path] = remaining
+        return
+    _holders.pop(path, None)
+
+    kept = path in _kept
+    _kept.discard(path)
+    if download.cached or (kept and YOUTUBE_CACHE_MAX_BYTES > 0):
+        return
+
+    for stale in (path, path + '.json'):
+        try:
+            await loop.run_in_executor(None, os.remove, stale)
+        except FileNotFoundError:
+            pass
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=YOUTUBE_DOWNLOAD_WORKERS,
+            thread_name_prefix='youtube-download'
+        )
+    return _executor
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(YOUTUBE_DOWNLOAD_WORKERS)
+    return _slots
+
+
+def _build_ydl_opts(audio_format: AudioFormat) -> Dict[str, Any]:
+    """yt-dlp options for a download in the given delivery format."""
+    postprocessor = {
+        'key': 'FFmpegExtractAudio',
+        # FFmpegExtractAudio stream-copies when the source codec already
+        # matches, e.g. AAC into .m4a
+        'preferredcodec': audio_format.codec,
+    }
+    if audio_format.quality:
+        postprocessor['preferredquality'] = audio_format.quality
+
+    return {
+        'format': audio_format.selector,
+        'postprocessors': [postprocessor],
+        # Files are named by video ID so they double as disk cache entries.
+        # They are written under paths['home'], set per job to its scratch
+        # directory, and moved into the cache once complete.
+        'outtmpl': cache_key('%(id)s', audio_format) + '.%(ext)s',
+        'paths': {'home': scratch.SCRATCH_DIR},
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+
+def _progress_event(status: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a yt-dlp progress dict to the fields callers care about."""
+    return {
+        'stage': 'downloading' if status.get('status') == 'downloading' else status.get('status'),
+        'downloaded_bytes': status.get('downloaded_bytes'),
+        'total_bytes': status.get('total_bytes') or status.get('total_bytes_estimate'),
+        'speed': status.get('speed'),
+        'eta': status.get('eta'),
+    }
+
+
+def _move_into_cache(source: str, video_id: str, audio_format: AudioFormat) -> str:
+    """Move a finished file from a scratch directory to its cache path."""
+    os.makedirs(YOUTUBE_CACHE_DIR, exist_ok=True)
+    path = _cache_path(video_id, audio_format)
+    # Scratch may be another filesystem, where a move is a copy; only a
+    # complete file gets the final name
+    partial = path + '.part'
+    shutil.move(source, partial)
+    os.replace(partial, path)
+    return path
+
+
+def _download_blocking(info: Dict[str, Any], audio_format: AudioFormat, emit: Callable,
+                       cancel_event: threading.Event, workdir: str) -> DownloadedAudio:
+    """Download and transcode with yt-dlp from preflight info (runs in a worker thread)."""
+    def progress_hook(status):
+        if cancel_event.is_set():
+            raise DownloadCancelledError("Download cancelled")
+        emit(_progress_event(status))
+
+    def postprocessor_hook(status):
+        if cancel_event.is_set():
+            raise DownloadCancelledError("Download cancelled")
+        if status.get('status') == 'started':
+            emit({'stage': 'transcoding', 'postprocessor': status.get('postprocessor')})
+
+    profile = f"download-{audio_format.name}-{audio_format.bitrate}"
+    params = {'paths': {'home': workdir}}
+    with _ydl_pool.checkout(profile, lambda: _build_ydl_opts(audio_format), params) as pooled:
+        pooled.progress_hook = progress_hook
+        pooled.postprocessor_hook = postprocessor_hook
+        # Reuses the extraction done by the preflight
+        info = pooled.ydl.process_ie_result(info, download=True)
+        filename = pooled.ydl.prepare_filename(info)
+
+    path = _move_into_cache(f"{filename.rsplit('.', 1)[0]}.{audio_format.name}", info['id'], audio_format)
+    return DownloadedAudio(path, info, audio_format)
+
+
+def _selected_stream(info: Dict[str, Any]) -> Dict[str, Any]:
+    """The format yt-dlp selected for an audio download."""
+    return info if info.get('url') else (info.get('requested_formats') or [info])[0]
+
+
+def _estimate_bytes(info: Dict[str, Any], audio_format: AudioFormat) -> Optional[float]:
+    """Expected output size from metadata alone, or None if it cannot be told."""
+    duration = info.get('duration')
+    if audio_format.quality:
+        # Re-encoded at a constant bitrate
+        return duration * int(audio_format.quality) * 1000 / 8 if duration else None
+
+    stream = _selected_stream(info)
+    size = stream.get('filesize') or stream.get('filesize_approx')
+    if size:
+        return size
+    if duration and stream.get('abr'):
+        return duration * stream['abr'] * 1000 / 8
+    return None
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def _check_duration(info: Dict[str, Any]):
+    """Reject videos longer than YOUTUBE_MAX_DURATION."""
+    duration = info.get('duration')
+    if YOUTUBE_MAX_DURATION and duration and duration > YOUTUBE_MAX_DURATION:
+        raise DownloadRejectedError(
+            f"This video is {_format_duration(duration)} long; "
+            f"the limit is {_format_duration(YOUTUBE_MAX_DURATION)}."
+        )
+
+
+def _plan_delivery(info: Dict[str, Any], audio_format: AudioFormat) -> AudioFormat:
+    """
+    Decide from metadata how a video will be delivered.
+
+    Returns the format to download in: the requested one, or a lower MP3
+    bitrate when that makes the file fit in one upload. Files that still do
+    not fit are split into parts after downloading.
+
+    Raises:
+        DownloadRejectedError: If the video is too long, or too large even
+            when split into YOUTUBE_MAX_PARTS parts
+    """
+    _check_duration(info)
+
+    budget = TELEGRAM_UPLOAD_LIMIT_BYTES * _UPLOAD_HEADROOM
+    estimate = _estimate_bytes(info, audio_format)
+    if estimate is None or estimate <= budget:
+        return audio_format
+
+    if audio_format.name == 'mp3':
+        for bitrate in MP3_FALLBACK_BITRATES:
+            if int(bitrate) >= int(audio_format.bitrate):
+                continue
+            candidate = audio_format._replace(bitrate=bitrate, quality=bitrate)
+            if _estimate_bytes(info, candidate) <= budget:
+                logger.info(f"Video {info.get('id')} fits one upload at {bitrate} kbps")
+                return candidate
+
+    parts = math.ceil(estimate / budget)
+    if parts > YOUTUBE_MAX_PARTS:
+        raise DownloadRejectedError(
+            f"This video is too large to send: about {estimate / (1024 * 1024):.0f} MB, "
+            f"which would take {parts} files (the limit is {YOUTUBE_MAX_PARTS})."
+        )
+
+    logger.info(f"Video {info.get('id')} will be sent in {parts} parts")
+    return audio_format
+
+
+def _preflight_opts(audio_format: AudioFormat) -> Dict[str, Any]:
+    """yt-dlp options for fetching metadata only."""
+    return {'format': audio_format.selector, 'quiet': True, 'no_warnings': True}
+
+
+def _preflight_blocking(url: str, audio_format: AudioFormat, for_upload: bool = True):
+    """
+    Fetch metadata only and plan the delivery (runs in a worker thread).
+
+    Files that are not uploaded are only checked against the duration limit.
+
+    Returns:
+        Tuple of (yt-dlp info dict, AudioFormat to download in)
+    """
+    with _ydl_pool.checkout(f"preflight-{audio_format.name}", lambda: _preflight_opts(audio_format)) as pooled:
+        info = pooled.ydl.extract_info(url, download=False)
+
+    if info.get('_type') == 'playlist':
+        raise DownloadRejectedError("Playlists are not supported; please send a link to a single video.")
+
+    if not for_upload:
+        _check_duration(info)
+        return info, audio_format
+    return info, _plan_delivery(info, audio_format)
+
+
+def _split_for_upload(download: DownloadedAudio) -> DownloadedAudio:
+    """Split a file over the upload limit into parts of equal duration (runs in a worker thread)."""
+    size = os.path.getsize(download.path)
+    if size <= TELEGRAM_UPLOAD_LIMIT_BYTES:
+        return download
+
+    duration = download.info.get('duration')
+    parts = math.ceil(size / (TELEGRAM_UPLOAD_LIMIT_BYTES * _UPLOAD_HEADROOM))
+    if not duration or parts > YOUTUBE_MAX_PARTS:
+        raise DownloadRejectedError(
+            f"This audio is {size / (1024 * 1024):.0f} MB, too large to send."
+        )
+
+    extension = download.audio_format.name
+    # Lives until release(), which removes it after the parts are uploaded
+    directory = scratch.make_dir('parts')
+    try:
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', download.path,
+             '-f', 'segment', '-segment_time', str(math.ceil(duration / parts)),
+             '-segment_format', 'ipod' if extension == 'm4a' else extension,
+             '-reset_timestamps', '1', '-c', 'copy',
+             os.path.join(directory, f"part%02d.{extension}")],
+            check=True
+        )
+    except Exception:
+        scratch.remove_dir(directory)
+        raise
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    logger.info(f"Split {download.path} into {len(paths)} parts")
+    return download._replace(parts=paths)
+
+
+def _prepare_blocking(url: str, audio_format: AudioFormat, emit: Callable, for_upload: bool):
+    """
+    Preflight one video and look for it in the cache (runs in a worker thread).
+
+    Returns:
+        Tuple of (info dict, AudioFormat to download in, cached DownloadedAudio or None)
+    """
+    emit({'stage': 'checking'})
+    info, planned = _preflight_blocking(url, audio_format, for_upload)
+
+    download = None
+    if planned != audio_format and YOUTUBE_CACHE_MAX_BYTES > 0:
+        download = _cached_audio(info['id'], planned)
+    return info, planned, download
+
+
+def _scratch_bytes(info: Dict[str, Any], audio_format: AudioFormat) -> int:
+    """Scratch space a download needs at its peak: the source stream plus the output."""
+    output = _estimate_bytes(info, audio_format)
+    if output is None:
+        # Unknown size; assume the largest file that could be delivered
+        output = TELEGRAM_UPLOAD_LIMIT_BYTES * YOUTUBE_MAX_PARTS
+    if YOUTUBE_STREAMING_TRANSCODE:
+        return int(output)
+
+    stream = _selected_stream(info)
+    source = stream.get('filesize') or stream.get('filesize_approx')
+    if not source and info.get('duration') and stream.get('abr'):
+        source = info['duration'] * stream['abr'] * 1000 / 8
+    return int(output + (source or output))
+
+
+def _ffmpeg_output_args(audio_format: AudioFormat, acodec: Optional[str]) -> List[str]:
+    """FFmpeg encoder and muxer arguments matching what FFmpegExtractAudio would produce."""
+    if audio_format.name == 'm4a':
+        # Same rule as FFmpegExtractAudio: copy AAC, convert anything else
+        if acodec and acodec.startswith('mp4a'):
+            codec = ['-c:a', 'copy']
+        else:
+            codec = ['-c:a', 'aac', '-b:a', '128k']
+        return [*codec, '-f', 'ipod']
+    return ['-c:a', 'libmp3lame', '-b:a', f"{audio_format.quality}k", '-f', 'mp3']
+
+
+def _stream_blocking(info: Dict[str, Any], audio_format: AudioFormat, emit: Callable,
+                     cancel_event: threading.Event, workdir: str) -> DownloadedAudio:
+    """
+    Download and transcode in one FFmpeg pass (runs in a worker thread).
+
+    The preflight already resolved the stream URL; FFmpeg fetches it over
+    HTTP and encodes as bytes arrive, so memory stays bounded and the only
+    file written is the output.
+    """
+    stream = _selected_stream(info)
+    headers = ''.join(f"{key}: {value}\r\n" for key, value in (stream.get('http_headers') or {}).items())
+    duration = info.get('duration')
+
+    output = os.path.join(workdir, os.path.basename(_cache_path(info['id'], audio_format)))
+
+    command = ['ffmpeg', '-y', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1']
+    if headers:
+        command += ['-headers', headers]
+    command += ['-i', stream['url'], '-vn', *_ffmpeg_output_args(audio_format, stream.get('acodec')), output]
+
+    emit({'stage': 'streaming', 'processed_seconds': 0, 'duration': duration})
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        for line in process.stdout:
+            if cancel_event.is_set():
+                raise DownloadCancelledError("Download cancelled")
+            key, _, value = line.strip().partition('=')
+            # out_time_us is FFmpeg's position in the output, in microseconds
+            if key == 'out_time_us' and value.isdigit():
+                emit({'stage': 'streaming', 'processed_seconds': int(value) / 1e6, 'duration': duration})
+
+        if process.wait() != 0:
+            raise DownloadError(f"FFmpeg failed: {process.stderr.read().strip()[-500:]}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    return DownloadedAudio(_move_into_cache(output, info['id'], audio_format), info, audio_format)
+
+
+async def _run_worker(cancel_event: threading.Event, func: Callable, *args):
+    """
+    Run func on the download pool and wait for it even if the caller is cancelled.
+
+    On cancellation, cancel_event stops yt-dlp or FFmpeg at its next check,
+    and the cancellation is re-raised only once the thread has returned, so
+    the worker slot and the scratch directory are never given up while the
+    thread still writes to them.
+    """
+    future = asyncio.get_event_loop().run_in_executor(_get_executor(), func, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel_event.set()
+        while not future.done():
+            try:
+                await asyncio.shield(future)
+            except asyncio.CancelledError:
+                continue
+            except Exception:
+                break
+        raise
+
+
+async def _fetch(url: str, audio_format: AudioFormat, listeners: List[Callable],
+                 resume_key: Optional[str] = None, for_upload: bool = True) -> DownloadedAudio:
+    """Run one download on the worker pool, reporting progress to every listener."""
+    global _waiting
+
+    loop = asyncio.get_event_loop()
+    cancel_event = threading.Event()
+
+    def deliver(event):
+        for callback in list(listeners):
+            try:
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    asyncio.ensure_future(result)
+            except Exception as e:
+                logger.warning(f"Download progress callback failed: {e}")
+
+    def emit(event):
+        if not cancel_event.is_set():
+            loop.call_soon_threadsafe(deliver, event)
+
+    slots = _get_slots()
+    _waiting += 1
+    try:
+        await slots.acquire()
+    finally:
+        _waiting -= 1
+
+    _active.add(cancel_event)
+    try:
+        logger.info(f"Downloading: {url}")
+        info, planned, download = await _run_worker(
+            cancel_event, _prepare_blocking, url, audio_format, emit, for_upload
+        )
+        if download is None:
+            fetch = _stream_blocking if YOUTUBE_STREAMING_TRANSCODE else _download_blocking
+            # Waits here, holding the worker slot, while scratch space is short.
+            # With a resume key, yt-dlp continues the .part file a previous
+            # run of the same job left in its scratch directory.
+            async with scratch.job_dir('youtube', _scratch_bytes(info, planned), key=resume_key) as workdir:
+                download = await _run_worker(cancel_event, fetch, info, planned, emit, cancel_event, workdir)
+        if for_upload:
+            download = await _run_worker(cancel_event, _split_for_upload, download)
+    except DownloadError:
+        raise
+    except Exception as e:
+        raise DownloadError(str(e)) from e
+    finally:
+        # The worker thread has returned by now; nothing more to stop
+        cancel_event.set()
+        _active.discard(cancel_event)
+        slots.release()
+
+    if YOUTUBE_CACHE_MAX_BYTES > 0 and not download.cached:
+        try:
+            await loop.run_in_executor(None, _store_in_cache, download, frozenset(_holders))
+        except OSError as e:
+            logger.warning(f"Could not add {download.path} to the audio cache: {e}")
+
+    return download
+
+
+def _start_flight(key: str, url: str, audio_format: AudioFormat, resume_key: Optional[str],
+                  for_upload: bool) -> _Flight:
+    flight = _Flight()
+    flight.task = asyncio.ensure_future(_fetch(url, audio_format, flight.listeners, resume_key, for_upload))
+    _flights[key] = flight
+
+    def forget(_):
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+    flight.task.add_done_callback(forget)
+    return flight
+
+
+async def download_audio(
+    url: str,
+    on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    audio_format: Optional[str] = None,
+    resume_key: Optional[str] = None,
+    for_upload: bool = True
+) -> DownloadedAudio:
+    """
+    Download a YouTube video's audio on the download worker pool.
+
+    Metadata is fetched first: videos that can never be delivered are
+    rejected before any audio is downloaded, and ones too large for a
+    single upload get a lower MP3 bitrate or are split into parts. A file
+    already in the disk cache is returned without downloading, and
+    concurrent requests for the same video share a single download.
+
+    Args:
+        url: YouTube video URL
+        on_progress: Optional callback receiving progress dicts (stage,
+            downloaded_bytes, total_bytes, speed, eta) on the event loop;
+            may return an awaitable, which is scheduled
+        audio_format: Name of a delivery format in AUDIO_FORMATS (default:
+            YOUTUBE_AUDIO_FORMAT)
+        resume_key: Stable name of the job asking for the video; partial
+            files are kept under it if the download is interrupted, and a
+            later call with the same key picks up where it stopped
+        for_upload: Plan for Telegram's upload limit (lower bitrate, parts,
+            rejection); False for files used locally, e.g. for transcription
+
+    Returns:
+        DownloadedAudio with the file path and yt-dlp's info dict; upload
+        ``parts`` instead of ``path`` when set, and pass it to ``release``
+        once the file has been delivered
+
+    Raises:
+        ValueError: If audio_format is not a known format
+        DownloadRejectedError: If the video is too long or too large to deliver
+        DownloadBusyError: If all workers are busy and the queue is full
+        DownloadError: If yt-dlp fails
+    """
+    audio_format = get_audio_format(audio_format)
+    video_id = parse_video_id(url)
+    key = cache_key(video_id or url, audio_format)
+    # Both share the cached file, but only uploads are limited by size
+    flight_key = key if for_upload else f"{key}-local"
+
+    flight = _flights.get(flight_key)
+    if flight is None and video_id and YOUTUBE_CACHE_MAX_BYTES > 0:
+        loop = asyncio.get_event_loop()
+        cached = await loop.run_in_executor(None, _cached_audio, video_id, audio_format)
+        if cached is not None:
+            logger.info(f"Audio cache hit for video {video_id}")
+            if for_upload:
+                cached = await loop.run_in_executor(None, _split_for_upload, cached)
+            return _hold(cached)
+        # Someone may have started it while we looked
+        flight = _flights.get(flight_key)
+
+    if flight is None:
+        if _get_slots().locked() and _waiting >= YOUTUBE_DOWNLOAD_MAX_QUEUE:
+            raise DownloadBusyError(
+                f"All {YOUTUBE_DOWNLOAD_WORKERS} download workers are busy and "
+                f"{_waiting} downloads are already queued"
+            )
+        flight = _start_flight(flight_key, url, audio_format, resume_key, for_upload)
+    else:
+        logger.info(f"Joining in-flight download of {flight_key}")
+
+    if on_progress is not None:
+        flight.listeners.append(on_progress)
+    flight.waiters += 1
+    try:
+        download = await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        if on_progress is not None:
+            flight.listeners.remove(on_progress)
+        if flight.waiters == 0 and not flight.task.done():
+            # Nobody is waiting any more; later requests start afresh
+            if _flights.get(flight_key) is flight:
+                del _flights[flight_key]
+            flight.task.cancel()
+
+    return _hold(download)
+
+
+async def download_for_transcription(
+    url: str,
+    on_progress: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    resume_key: Optional[str] = None
+) -> DownloadedAudio:
+    """
+    Fetch a video's native audio for transcription.
+
+    Uses the same workers, disk cache and in-flight coalescing as
+    deliveries; an .m4a already downloaded for a chat is reused as is. The
+    file is never split or planned against the upload limit. Pass the
+    result to ``release`` when done.
+
+    Raises:
+        DownloadRejectedError: If the video is longer than YOUTUBE_MAX_DURATION
+        DownloadBusyError: If all workers are busy and the queue is full
+        DownloadError: If yt-dlp fails
+    """
+    return await download_audio(
+        url,
+        on_progress=on_progress,
+        audio_format=TRANSCRIPTION_AUDIO_FORMAT,
+        resume_key=resume_key,
+        for_upload=False
+    )
+
+
+def _captions_blocking(url: str, languages: List[str]):
+    audio_format = get_audio_format(TRANSCRIPTION_AUDIO_FORMAT)
+    # Same profile as the transcription download's preflight, so the
+    # fallback reuses the warm instance
+    with _ydl_pool.checkout(f"preflight-{audio_format.name}", lambda: _preflight_opts(audio_format)) as pooled:
+        info = pooled.ydl.extract_info(url, download=False)
+        if info.get('_type') == 'playlist':
+            return None
+        return captions.fetch_blocking(pooled.ydl, info, languages)
+
+
+async def fetch_captions(url: str, languages: Optional[List[str]] = None):
+    """
+    Get a video's transcript from its YouTube captions, without downloading audio.
+
+    Captions are not limited by YOUTUBE_MAX_DURATION; they cost one small
+    request whatever the length of the video.
+
+    Args:
+        url: Video URL
+        languages: Preferred caption languages, see ``captions.choose_track``
+
+    Returns:
+        transcription.TranscriptionResult, or None if the video has no usable
+        captions or they could not be fetched
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        return await loop.run_in_executor(None, _captions_blocking, url, languages or [])
+    except Exception as e:
+        logger.warning(f"Could not fetch captions for {url}: {e}")
+        return None
+
+
+async def prewarm():
+    """Build the YoutubeDL instances the default format needs before the first request."""
+    audio_format = get_audio_format()
+
+    def build():
+        _ydl_pool.prewarm(
+            f"preflight-{audio_format.name}",
+            lambda: _preflight_opts(audio_format),
+            YOUTUBE_DOWNLOAD_WORKERS
+        )
+        _ydl_pool.prewarm(
+            f"download-{audio_format.name}-{audio_format.bitrate}",
+            lambda: _build_ydl_opts(audio_format),
+            YOUTUBE_DOWNLOAD_WORKERS
+        )
+
+    await asyncio.get_event_loop().run_in_executor(None, build)
+
+
+async def shutdown():
+    """Stop the download pool; running downloads are aborted at their next hook call."""
+    global _executor
+    for cancel_event in list(_active):
+        cancel_event.set()
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.get_event_loop().run_in_executor(None, executor.shutdown, True)
+    _ydl_pool.close()
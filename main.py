@@ -1,21 +1,44 @@
 import os
+import time
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
+import tempfile
+from datetime import datetime, timezone
+from telegram import Update, Chat, Message, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
+from telegram.error import BadRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
-import yt_dlp
 
-from flask import Flask
-from threading import Thread
+from flask import Flask, jsonify
+from threading import Thread, Event
 
+import captions
 import database
+import downloader
+import scratch
 import transcription
 
 app = Flask('')
 
+# Set once startup (including the optional model warmup) has finished
+startup_complete = Event()
+# Why the last model warmup failed, reported by /ready while it is retried
+warmup_failure = {}
+
 @app.route('/')
 def home():
     return "Bot is running!"
 
+@app.route('/ready')
+def ready():
+    """Readiness probe: 503 until startup and model warmup are done."""
+    if not startup_complete.is_set():
+        return jsonify({'ready': False, **warmup_failure}), 503
+    return jsonify({
+        'ready': True,
+        **transcription.warmup_stats(),
+        'settings_cache': database.settings_cache_stats(),
+    }), 200
+
 def run():
     app.run(host='0.0.0.0', port=8080)
 
@@ -66,7 +89,8 @@ async def start(update: Update, context: CallbackContext):
     await update.message.reply_text(
         'Hi! I can help you with:\n'
         '🎵 Send me a YouTube link and I\'ll convert it to MP3\n'
-        '🎤 Send me a voice message or audio file and I\'ll transcribe it\n\n'
+        '🎤 Send me a voice message or audio file and I\'ll transcribe it\n'
+        '📝 Send /transcribe with a YouTube link for a transcript of the video\n\n'
         'All transcription happens locally on the server - no external APIs needed!'
     )
     
@@ -75,9 +99,76 @@ async def start(update: Update, context: CallbackContext):
         await prompt_admin_for_deletion_setting(update, context)
         await database.set_admin_prompted(chat_id, True)
 
+def format_download_progress(event: dict) -> str:
+    """Status message text for a downloader progress event."""
+    if event.get('stage') == 'checking':
+        return 'Checking video... 🔎'
+    
+    if event.get('stage') == 'transcoding':
+        return 'Converting audio... 🎛'
+    
+    if event.get('stage') == 'streaming':
+        duration = event.get('duration')
+        if duration:
+            return f"Downloading and converting... {min(event['processed_seconds'] / duration, 1):.0%} ⏳"
+        return 'Downloading and converting... ⏳'
+    
+    downloaded = event.get('downloaded_bytes') or 0
+    total = event.get('total_bytes')
+    if total:
+        return f"Downloading... {downloaded / total:.0%} ⏳"
+    return f"Downloading... {downloaded / (1024 * 1024):.1f} MB ⏳"
+
+async def send_cached_audio(message, video_id: str, audio_format: downloader.AudioFormat) -> bool:
+    """
+    Re-send a video's audio by the Telegram file_id of an earlier upload.
+    
+    Returns:
+        True if the audio was sent; False if there is no usable file_id
+    """
+    file_id = await database.get_youtube_file_id(video_id, audio_format.name, audio_format.bitrate)
+    if file_id is None:
+        return False
+    
+    try:
+        await message.reply_audio(audio=file_id)
+    except BadRequest as e:
+        # Telegram no longer knows the file; fall back to downloading
+        logger.warning(f"Cached file_id for video {video_id} rejected: {e}")
+        await database.delete_youtube_file_id(video_id, audio_format.name, audio_format.bitrate)
+        return False
+    
+    logger.info(f"Sent video {video_id} from cached file_id")
+    return True
+
+async def send_downloaded_audio(message, download, video_id: str, audio_format: downloader.AudioFormat):
+    """
+    Upload a downloaded file as a reply to message, in numbered parts if it was split.
+    
+    The Telegram file_id of a single-file upload is remembered under the
+    requested format so the video can later be re-sent without uploading.
+    """
+    title = download.info.get('title') or download.info.get('id') or 'audio'
+    paths = download.parts or [download.path]
+    
+    for i, path in enumerate(paths, start=1):
+        part_title = title if len(paths) == 1 else f"{title} ({i}/{len(paths)})"
+        with open(path, 'rb') as audio:
+            sent_message = await message.reply_audio(
+                audio=audio,
+                title=part_title,
+                filename=f"{part_title}.{download.audio_format.name}"
+            )
+        
+        if sent_message.audio:
+            await database.mark_audio_processed(sent_message.audio.file_id)
+            if video_id and len(paths) == 1:
+                await database.store_youtube_file_id(
+                    video_id, audio_format.name, audio_format.bitrate, sent_message.audio.file_id
+                )
+
 async def download_audio(update: Update, context: CallbackContext):
-    """Download YouTube video as MP3."""
-    url = update.message.text
+    """Download the audio of every YouTube video or playlist linked in a message."""
     chat_id = update.effective_chat.id
     message_id = update.message.message_id
     
@@ -86,51 +177,218 @@ async def download_audio(update: Update, context: CallbackContext):
         return
     
     # Check if it's a YouTube URL
-    if 'youtube.com' not in url and 'youtu.be' not in url:
+    urls = downloader.extract_youtube_urls(update.message.text)
+    if not urls:
         await update.message.reply_text('Please send a valid YouTube link!')
         return
     
-    await update.message.reply_text('Downloading... ⏳')
+    job = await database.create_job('youtube', chat_id, message_id, {
+        'text': update.message.text,
+        'chat_type': update.effective_chat.type,
+    })
+    await run_job(job, process_youtube_message, update.message, urls, job)
+
+async def process_youtube_message(message, urls, job):
+    """Deliver the videos linked in a message; also how an interrupted job is resumed."""
+    chat_id = message.chat_id
+    message_id = message.message_id
+    
+    if len(urls) > 1 or downloader.is_playlist_url(urls[0]):
+        await download_batch(message, urls, job)
+        return
     
+    url = urls[0]
+    audio_format = downloader.get_audio_format(await database.get_audio_format(chat_id))
+    
+    video_id = downloader.parse_video_id(url)
+    if video_id and await send_cached_audio(message, video_id, audio_format):
+        await database.mark_message_processed(chat_id, message_id)
+        return
+    
+    status_message = await open_status_message(message, job, 'Downloading... ⏳')
+    await advance_job(job, 'downloading')
+    last_edit = 0.0
+    
+    async def on_progress(event: dict):
+        nonlocal last_edit
+        await advance_job(job, DOWNLOAD_STAGE_TO_JOB_STAGE.get(event.get('stage'), job['stage']))
+        # Stage changes always show; progress at most every few seconds
+        if event.get('stage') in ('downloading', 'streaming') and time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await edit_status_message(status_message, format_download_progress(event))
+        except Exception as e:
+            logger.warning(f"Could not update download progress: {e}")
+    
+    delete_after = await database.get_delete_after_transcription(chat_id)
+    download = None
     try:
-        # Configure yt-dlp options
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': '%(title)s.%(ext)s',
-            'quiet': True,
-        }
+        # Runs on the download worker pool; the event loop keeps serving other chats
+        download = await downloader.download_audio(
+            url, on_progress=on_progress, audio_format=audio_format.name, resume_key=job_key(job)
+        )
         
-        # Download the audio
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            mp3_file = filename.rsplit('.', 1)[0] + '.mp3'
+        # Send the audio file
+        await advance_job(job, 'uploading')
+        await edit_status_message(status_message, f'Uploading your {audio_format.name.upper()}... 📤')
+        await send_downloaded_audio(message, download, video_id, audio_format)
         
-        # Send the MP3 file
-        await update.message.reply_text('Uploading your MP3... 📤')
-        with open(mp3_file, 'rb') as audio:
-            sent_message = await update.message.reply_audio(audio=audio)
+        await database.mark_message_processed(chat_id, message_id)
         
+    except downloader.DownloadRejectedError as e:
+        logger.info(f"Rejected {url} for chat {chat_id}: {e}")
+        await edit_status_message(status_message, f"Sorry, I can't send this one. {e}")
         await database.mark_message_processed(chat_id, message_id)
         
-        if sent_message.audio:
-            await database.mark_audio_processed(sent_message.audio.file_id)
+    except downloader.DownloadBusyError as e:
+        logger.warning(f"Download queue full for message {message_id} in chat {chat_id}: {e}")
+        await edit_status_message(
+            status_message,
+            'Sorry, all download workers are busy right now. Please send the link again in a few minutes.'
+        )
         
-        delete_after = await database.get_delete_after_transcription(chat_id)
-        if delete_after:
-            os.remove(mp3_file)
-            logger.info(f"Deleted MP3 file for chat {chat_id} per settings")
-        else:
-            logger.info(f"Kept MP3 file for chat {chat_id} per settings")
+    except downloader.DownloadCancelledError:
+        # Shutting down; the job is resumed on the next start
+        raise
         
     except Exception as e:
         logger.error(f"Error: {e}")
-        await update.message.reply_text(f'Sorry, an error occurred: {str(e)}')
+        await message.reply_text(f'Sorry, an error occurred: {str(e)}')
+    
+    finally:
+        if download is not None:
+            # Kept files live in the size-bounded audio cache; deleted ones
+            # never reach it, so it stays empty for chats that delete files
+            await downloader.release(download, keep=not delete_after)
+            if delete_after:
+                logger.info(f"Deleted audio file for chat {chat_id} per settings")
+            else:
+                logger.info(f"Kept audio file for chat {chat_id} per settings")
+
+async def iterate_videos(urls):
+    """Yield video links in order, expanding playlists as they are reached."""
+    for url in urls:
+        if downloader.is_playlist_url(url):
+            async for video_url in downloader.expand_playlist(url):
+                yield video_url
+        else:
+            yield url
+
+async def download_batch(message, urls, job):
+    """
+    Download several videos for one message and deliver them in order.
+    
+    Up to YOUTUBE_BATCH_CONCURRENCY videos are fetched at once. Each is sent
+    as soon as it and every video before it are ready, and a single status
+    message tracks the whole batch. A resumed batch skips the videos it
+    already handled. When the batch is cancelled, videos that finished
+    downloading but were not sent yet are released like sent ones.
+    """
+    chat_id = message.chat_id
+    message_id = message.message_id
+    audio_format = downloader.get_audio_format(await database.get_audio_format(chat_id))
+    delete_after = await database.get_delete_after_transcription(chat_id)
+    
+    status_message = await open_status_message(message, job, 'Collecting videos... ⏳')
+    await advance_job(job, 'downloading')
+    # Videos handled (sent or failed) before an interruption
+    done = job['artifacts'].get('done', 0)
+    progress = {'sent': job['artifacts'].get('sent', 0), 'failed': [], 'total': None}
+    last_edit = 0.0
+    
+    async def show_progress(final: bool = False):
+        nonlocal last_edit
+        if not final and time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        total = progress['total'] if progress['total'] is not None else '?'
+        if final:
+            text = f"✅ Sent {progress['sent']} of {total}."
+        else:
+            text = f"Downloading... {progress['sent']} of {total} sent ⏳"
+        if progress['failed']:
+            text += f"\n\n{len(progress['failed'])} failed:\n" + "\n".join(progress['failed'][:10])
+        try:
+            await edit_status_message(status_message, text)
+        except Exception as e:
+            logger.warning(f"Could not update batch progress: {e}")
+    
+    # Bounds videos downloading or waiting for their turn to be sent, so a
+    # slow early video cannot pile up finished files behind it
+    slots = asyncio.Semaphore(YOUTUBE_BATCH_CONCURRENCY)
+    pending: asyncio.Queue = asyncio.Queue()
+    
+    async def fetch(url: str, index: int):
+        video_id = downloader.parse_video_id(url)
+        if video_id and await database.get_youtube_file_id(video_id, audio_format.name, audio_format.bitrate):
+            # Sent before; re-sent by file_id when its turn comes
+            return None
+        return await downloader.download_audio(
+            url, audio_format=audio_format.name, resume_key=f"{job_key(job)}.{index}"
+        )
+    
+    async def produce():
+        count = 0
+        try:
+            async for url in iterate_videos(urls):
+                if count >= done:
+                    await slots.acquire()
+                    await pending.put((count, url, asyncio.ensure_future(fetch(url, count))))
+                count += 1
+        except Exception as e:
+            logger.error(f"Could not expand playlist for chat {chat_id}: {e}")
+            progress['failed'].append(f"Playlist: {e}")
+        finally:
+            progress['total'] = count
+            await pending.put(None)
+    
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            index, url, task = item
+            video_id = downloader.parse_video_id(url)
+            download = None
+            try:
+                download = await task
+                if download is None and not await send_cached_audio(message, video_id, audio_format):
+                    download = await downloader.download_audio(
+                        url, audio_format=audio_format.name, resume_key=f"{job_key(job)}.{index}"
+                    )
+                if download is not None:
+                    await send_downloaded_audio(message, download, video_id, audio_format)
+                progress['sent'] += 1
+            except downloader.DownloadCancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Batch item {url} failed for chat {chat_id}: {e}")
+                progress['failed'].append(f"{url} ({e})")
+            finally:
+                if download is not None:
+                    await downloader.release(download, keep=not delete_after)
+                slots.release()
+            await advance_job(job, 'downloading', done=index + 1, sent=progress['sent'])
+            await show_progress()
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item is None:
+                continue
+            task = item[2]
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None and task.result() is not None:
+                # Downloaded but never sent; its holder has to hand it back
+                await downloader.release(task.result(), keep=not delete_after)
+    
+    await show_progress(final=True)
+    await database.mark_message_processed(chat_id, message_id)
+    logger.info(f"Batch for message {message_id} in chat {chat_id}: "
+                f"{progress['sent']} sent, {len(progress['failed'])} failed")
 
 async def handle_deletion_callback(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -176,6 +434,151 @@ async def handle_change_command(update: Update, context: CallbackContext):
     await update.message.reply_text(message)
     logger.info(f"Chat {chat_id}: Admin {user_id} toggled deletion setting to {new_setting}")
 
+async def handle_format_command(update: Update, context: CallbackContext):
+    """Show or set the chat's YouTube delivery format: /format [mp3|m4a|default]."""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    
+    if not context.args:
+        current = await database.get_audio_format(chat_id)
+        await update.message.reply_text(
+            f"Current format: {current or downloader.YOUTUBE_AUDIO_FORMAT}"
+            f"{'' if current else ' (default)'}\n\n"
+            "Use /format mp3 for MP3 files that play everywhere, or /format m4a to get "
+            "YouTube's original audio without re-encoding (faster, no quality loss).\n"
+            "/format default goes back to the bot's default."
+        )
+        return
+    
+    if not await is_user_admin(update, context, user_id):
+        await update.message.reply_text("Sorry, only administrators can change this setting.")
+        return
+    
+    choice = context.args[0].lower()
+    if choice == 'default':
+        await database.set_audio_format(chat_id, None)
+        await update.message.reply_text(f"✅ Changed: Using the default format ({downloader.YOUTUBE_AUDIO_FORMAT}).")
+        return
+    
+    if choice not in downloader.AUDIO_FORMATS:
+        await update.message.reply_text(f"Unknown format. Choose one of: {', '.join(downloader.AUDIO_FORMATS)}, default")
+        return
+    
+    await database.set_audio_format(chat_id, choice)
+    await update.message.reply_text(f"✅ Changed: YouTube audio will now be sent as {choice}.")
+    logger.info(f"Chat {chat_id}: Admin {user_id} set audio format to {choice}")
+
+async def handle_transcribe_command(update: Update, context: CallbackContext):
+    """Transcribe a YouTube video: /transcribe <url>, or /transcribe in reply to a link."""
+    chat_id = update.effective_chat.id
+    message_id = update.message.message_id
+    
+    if await database.is_message_processed(chat_id, message_id):
+        logger.debug(f"Message {message_id} already processed, skipping")
+        return
+    
+    text = ' '.join(context.args or [])
+    if not text and update.message.reply_to_message:
+        text = update.message.reply_to_message.text or ''
+    urls = [url for url in downloader.extract_youtube_urls(text) if not downloader.is_playlist_url(url)]
+    if not urls:
+        await update.message.reply_text('Usage: /transcribe <YouTube link>, or reply /transcribe to a message with a link.')
+        return
+    
+    job = await database.create_job('youtube_transcript', chat_id, message_id, {
+        'url': urls[0],
+        'chat_type': update.effective_chat.type,
+    })
+    await run_job(job, transcribe_youtube, update.message, urls[0], job)
+
+async def transcribe_youtube(message, url: str, job):
+    """
+    Transcribe a video from its captions, or else by downloading its native
+    audio for Whisper; also how an interrupted job is resumed.
+    """
+    chat_id = message.chat_id
+    message_id = message.message_id
+    
+    status_message = await open_status_message(
+        message, job,
+        'Looking for captions... ⏳' if captions.YOUTUBE_CAPTIONS else 'Downloading audio for transcription... ⏳'
+    )
+    await advance_job(job, 'downloading')
+    last_edit = 0.0
+    
+    async def on_progress(event: dict):
+        nonlocal last_edit
+        await advance_job(job, DOWNLOAD_STAGE_TO_JOB_STAGE.get(event.get('stage'), job['stage']))
+        if event.get('stage') in ('downloading', 'streaming') and time.monotonic() - last_edit < STREAM_EDIT_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await edit_status_message(status_message, format_download_progress(event))
+        except Exception as e:
+            logger.warning(f"Could not update download progress: {e}")
+    
+    download = None
+    try:
+        if captions.YOUTUBE_CAPTIONS:
+            # Existing captions cost one small request; Whisper costs the
+            # whole download plus about real time on a CPU
+            # Only picks a track; no Whisper run to count towards the recheck
+            hint = await database.peek_language_hint(chat_id, LANGUAGE_HINT_MIN_STREAK)
+            languages = ([hint] if hint else []) + captions.YOUTUBE_CAPTION_LANGUAGES
+            result = await downloader.fetch_captions(url, languages)
+            if result is not None:
+                await send_transcription(status_message, result.text, result.metadata['language'])
+                await database.mark_message_processed(chat_id, message_id)
+                logger.info(f"Sent {url} from its captions ({result.metadata['source']}) for message {message_id} in chat {chat_id}")
+                return
+            await edit_status_message(status_message, 'No captions; downloading audio for transcription... ⏳')
+        
+        # Shares the download workers and audio cache with deliveries; the
+        # native audio goes straight to Whisper's 16 kHz decoder
+        download = await downloader.download_for_transcription(url, on_progress=on_progress, resume_key=job_key(job))
+        
+        await advance_job(job, 'transcribing')
+        await edit_status_message(status_message, 'Transcribing... ⏳')
+        # Whisper runs at least about real time on CPU, so allow for long videos
+        timeout = max(300, int(download.info.get('duration') or 0))
+        transcribed_text, metadata = await stream_transcription_to_message(
+            status_message, download.path, timeout=timeout
+        )
+        
+        if transcribed_text:
+            await send_transcription(status_message, transcribed_text, metadata['language'])
+            await database.mark_message_processed(chat_id, message_id)
+            logger.info(f"Transcribed {url} for message {message_id} in chat {chat_id}")
+        else:
+            await edit_status_message(status_message, 'Sorry, I could not transcribe this video.')
+        
+    except downloader.DownloadRejectedError as e:
+        logger.info(f"Rejected {url} for transcription in chat {chat_id}: {e}")
+        await edit_status_message(status_message, f"Sorry, I can't transcribe this one. {e}")
+        await database.mark_message_processed(chat_id, message_id)
+        
+    except (downloader.DownloadBusyError, transcription.TranscriptionBusyError) as e:
+        logger.warning(f"Workers busy for transcription of {url} in chat {chat_id}: {e}")
+        await edit_status_message(
+            status_message,
+            'Sorry, all workers are busy right now. Please try again in a few minutes.'
+        )
+        
+    except (downloader.DownloadCancelledError, transcription.TranscriptionCancelledError):
+        # Shutting down; the job is resumed on the next start
+        raise
+        
+    except Exception as e:
+        logger.error(f"Error transcribing {url}: {e}", exc_info=True)
+        await message.reply_text(f'Sorry, an error occurred: {str(e)}')
+    
+    finally:
+        if download is not None:
+            # Kept in the size-bounded cache for repeat requests and m4a
+            # deliveries, unless the chat asked for files to be deleted
+            keep = not await database.get_delete_after_transcription(chat_id)
+            await downloader.release(download, keep=keep)
+
 async def handle_text_message(update: Update, context: CallbackContext):
     text = update.message.text.strip()
     
@@ -184,11 +587,231 @@ async def handle_text_message(update: Update, context: CallbackContext):
     
     if text.lower() == "change" or (mention_pattern in text and "change" in text.lower()):
         await handle_change_command(update, context)
-    elif 'youtube.com' in text or 'youtu.be' in text:
+    elif downloader.is_youtube_url(text):
         await download_audio(update, context)
     else:
         await update.message.reply_text('Please send a valid YouTube link!')
 
+# Videos of one multi-link or playlist message downloaded at once
+YOUTUBE_BATCH_CONCURRENCY = int(os.getenv('YOUTUBE_BATCH_CONCURRENCY', '3'))
+# Telegram rejects messages over 4096 characters; keep some headroom for headers
+MAX_MESSAGE_LENGTH = 4000
+# Minimum seconds between progressive edits of a transcription status message
+STREAM_EDIT_INTERVAL = 2.0
+# After this many consecutive confident detections of the same language in a
+# chat, later clips pass it as a hint and skip language detection
+LANGUAGE_HINT_MIN_STREAK = int(os.getenv('LANGUAGE_HINT_MIN_STREAK', '3'))
+# Detections below this probability do not count towards the streak
+LANGUAGE_HINT_MIN_PROBABILITY = float(os.getenv('LANGUAGE_HINT_MIN_PROBABILITY', '0.8'))
+# Run detection again after this many hinted clips, in case the chat switched
+LANGUAGE_RECHECK_EVERY = int(os.getenv('LANGUAGE_RECHECK_EVERY', '20'))
+# A hinted clip decoding below this average log probability (Whisper's own
+# fallback threshold) suggests the hint is wrong, so the chat is re-detected
+LANGUAGE_HINT_MIN_AVG_LOGPROB = -1.0
+# Restarts an interrupted job is resumed across before it is given up
+# Seconds between attempts when the startup model warmup fails
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Job stage recorded for each downloader progress stage
+DOWNLOAD_STAGE_TO_JOB_STAGE = {
+    'checking': 'downloading',
+    'downloading': 'downloading',
+    'streaming': 'downloading',
+    'transcoding': 'transcoding',
+}
+
+async def edit_status_message(status_message, text: str):
+    """Edit a status message, ignoring Telegram's 'message is not modified' error."""
+    try:
+        await status_message.edit_text(text)
+    except BadRequest as e:
+        if 'not modified' not in str(e).lower():
+            raise
+
+def job_key(job) -> str:
+    """Scratch key under which a job keeps partial downloads across restarts."""
+    return f"job{job['job_id']}"
+
+async def advance_job(job, stage: str, **artifacts):
+    """Record a job's stage and artifacts when they change; failures only cost resumability."""
+    if stage == job['stage'] and all(job['artifacts'].get(k) == v for k, v in artifacts.items()):
+        return
+    job['stage'] = stage
+    job['artifacts'].update(artifacts)
+    try:
+        await database.update_job(job['job_id'], stage, dict(job['artifacts']))
+    except Exception as e:
+        logger.warning(f"Could not record stage {stage} of job {job['job_id']}: {e}")
+
+async def run_job(job, runner, *args):
+    """
+    Run a job and remove it from the jobs table once it is done.
+    
+    Runners report failures to the user themselves. A job interrupted by a
+    shutdown or crash stays in the table and is resumed on the next start.
+    """
+    try:
+        await runner(*args)
+    except (downloader.DownloadCancelledError, transcription.TranscriptionCancelledError):
+        logger.info(f"Job {job['job_id']} interrupted; it will resume on the next start")
+        return
+    await database.finish_job(job['job_id'])
+    scratch.forget(job_key(job))
+
+def restore_message(bot, chat_id: int, chat_type: str, message_id: int, text: str = None) -> Message:
+    """Rebuild enough of a Telegram message to reply to or edit it after a restart."""
+    message = Message(
+        message_id=message_id,
+        date=datetime.now(timezone.utc),
+        chat=Chat(id=chat_id, type=chat_type),
+        text=text
+    )
+    message.set_bot(bot)
+    return message
+
+async def open_status_message(message, job, text: str):
+    """Show text in the job's status message, reusing the one from before a restart."""
+    status_message_id = job['artifacts'].get('status_message_id')
+    if status_message_id:
+        status_message = restore_message(
+            message.get_bot(), message.chat_id, message.chat.type, status_message_id
+        )
+        try:
+            await edit_status_message(status_message, text)
+            return status_message
+        except Exception as e:
+            logger.debug(f"Could not reuse status message {status_message_id}: {e}")
+    
+    status_message = await message.reply_text(text)
+    await advance_job(job, job['stage'], status_message_id=status_message.message_id)
+    return status_message
+
+async def resume_job(bot, job):
+    """Continue a job an earlier run accepted but did not finish."""
+    job_id = job['job_id']
+    chat_id, message_id = job['chat_id'], job['message_id']
+    payload = job['payload']
+    
+    if await database.is_message_processed(chat_id, message_id):
+        # Finished, but the process stopped before the job was removed
+        await database.finish_job(job_id)
+        scratch.forget(job_key(job))
+        return
+    
+    message = restore_message(bot, chat_id, payload.get('chat_type', Chat.PRIVATE), message_id, payload.get('text'))
+    attempts = await database.record_job_attempt(job_id)
+    if attempts > JOB_MAX_ATTEMPTS:
+        logger.warning(f"Giving up on job {job_id} after {attempts - 1} resumes")
+        await database.finish_job(job_id)
+        scratch.forget(job_key(job))
+        await message.reply_text("Sorry, I couldn't finish this after several restarts. Please send it again.")
+        return
+    
+    logger.info(f"Resuming {job['kind']} job {job_id} for chat {chat_id} from stage {job['stage']}")
+    if job['kind'] == 'youtube':
+        await run_job(job, process_youtube_message, message, downloader.extract_youtube_urls(payload['text']), job)
+    elif job['kind'] == 'transcription':
+        await run_job(job, transcribe_audio_message, message, job)
+    elif job['kind'] == 'youtube_transcript':
+        await run_job(job, transcribe_youtube, message, payload['url'], job)
+    else:
+        logger.error(f"Unknown job kind {job['kind']!r}; dropping job {job_id}")
+        await database.finish_job(job_id)
+
+async def stream_transcription_to_message(status_message, audio, language: str = None, timeout: int = 300):
+    """
+    Transcribe audio, editing status_message with the text decoded so far.
+    
+    Args:
+        status_message: Message to edit with progress
+        audio: Path or file object holding the audio
+        language: Optional language hint; skips language detection
+        timeout: Seconds allowed for the whole transcription
+    
+    Returns:
+        Tuple of (full transcribed text, metadata of the last segment plus the
+        clip's mean avg_logprob); the text is empty if transcription failed
+    
+    Raises:
+        TranscriptionBusyError: If every worker is busy and the queue is full
+        TranscriptionCancelledError: If the bot shuts down first; the job
+            stays unfinished and is resumed on the next start
+    """
+    parts = []
+    logprobs = []
+    metadata = {'language': language or 'unknown'}
+    last_edit = time.monotonic()
+    
+    async def on_queued(position: int):
+        await edit_status_message(status_message, f"Busy, queued at position {position}... ⏳")
+    
+    try:
+        async for segment in transcription.transcribe_stream(
+            audio, language=language, timeout=timeout, on_queued=on_queued
+        ):
+            if segment.text:
+                parts.append(segment.text)
+            metadata.update(segment.metadata)
+            if segment.metadata.get('avg_logprob') is not None:
+                logprobs.append(segment.metadata['avg_logprob'])
+            
+            if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                partial = " ".join(parts)
+                if len(partial) > MAX_MESSAGE_LENGTH:
+                    partial = '…' + partial[-MAX_MESSAGE_LENGTH:]
+                try:
+                    await edit_status_message(
+                        status_message, f"📝 Transcribing ({metadata['language']})... ⏳\n\n{partial}"
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not update transcription progress: {e}")
+                last_edit = time.monotonic()
+    except (transcription.TranscriptionBusyError, transcription.TranscriptionCancelledError):
+        raise
+    except Exception as e:
+        logger.error(f"Transcription failed: {e}")
+        return "", metadata
+    
+    metadata['avg_logprob'] = sum(logprobs) / len(logprobs) if logprobs else None
+    return " ".join(parts), metadata
+
+async def update_language_memory(chat_id: int, hint: str, metadata: dict):
+    """
+    Record the outcome of a clip in the chat's language memory.
+    
+    Detected languages extend or reset the chat's streak. A hinted clip that
+    decoded with low confidence clears the hint so the next clip is detected.
+    """
+    if hint is None:
+        probability = metadata.get('language_probability') or 0.0
+        await database.record_detected_language(
+            chat_id,
+            metadata['language'],
+            confident=probability >= LANGUAGE_HINT_MIN_PROBABILITY
+        )
+        return
+    
+    avg_logprob = metadata.get('avg_logprob')
+    if avg_logprob is not None and avg_logprob < LANGUAGE_HINT_MIN_AVG_LOGPROB:
+        logger.info(
+            f"Low confidence ({avg_logprob:.2f}) with language hint {hint} in chat {chat_id}; "
+            f"falling back to detection"
+        )
+        await database.clear_language_hint(chat_id)
+
+async def send_transcription(status_message, text: str, language: str):
+    """Put the final transcription in status_message, continuing in replies if it is too long."""
+    chunks = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)]
+    for i, chunk in enumerate(chunks):
+        if len(chunks) > 1:
+            header = f"📝 Transcription ({language}) - Part {i + 1}/{len(chunks)}:\n\n"
+        else:
+            header = f"📝 Transcription ({language}):\n\n"
+        if i == 0:
+            await edit_status_message(status_message, header + chunk)
+        else:
+            await status_message.reply_text(header + chunk)
+
 async def handle_audio_message(update: Update, context: CallbackContext):
     """Handle audio files and voice messages for transcription."""
     chat_id = update.effective_chat.id
@@ -206,47 +829,78 @@ async def handle_audio_message(update: Update, context: CallbackContext):
         logger.debug(f"Audio {audio_file.file_id} already processed, skipping")
         return
     
-    await update.message.reply_text('Transcribing audio... ⏳')
+    job = await database.create_job('transcription', chat_id, message_id, {
+        'file_id': audio_file.file_id,
+        'file_size': audio_file.file_size,
+        'is_audio': update.message.audio is not None,
+        'chat_type': update.effective_chat.type,
+    })
+    await run_job(job, transcribe_audio_message, update.message, job)
+
+async def transcribe_audio_message(message, job):
+    """Transcribe the audio a job refers to; also how an interrupted job is resumed."""
+    chat_id = message.chat_id
+    message_id = message.message_id
+    payload = job['payload']
+    
+    status_message = await open_status_message(message, job, 'Transcribing audio... ⏳')
     
-    temp_file_path = None
-    try:
-        file = await context.bot.get_file(audio_file.file_id)
-        file_extension = '.ogg' if update.message.voice else '.mp3'
-        temp_file_path = f"temp_audio_{audio_file.file_id}{file_extension}"
+    # Kept in memory and decoded straight to samples; only unusually large
+    # files spill to a temporary file, in a scratch directory whose size
+    # counts against the scratch quota.
+    file_size = payload.get('file_size') or 0
+    spill_bytes = file_size if file_size > transcription.IN_MEMORY_AUDIO_MAX_BYTES else 0
+    async with scratch.job_dir('audio', spill_bytes) as workdir:
+        audio_buffer = tempfile.SpooledTemporaryFile(max_size=transcription.IN_MEMORY_AUDIO_MAX_BYTES, dir=workdir)
+        try:
+            await advance_job(job, 'downloading')
+            file = await message.get_bot().get_file(payload['file_id'])
+            await file.download_to_memory(out=audio_buffer)
         
-        await file.download_to_drive(temp_file_path)
+            hint = await database.get_language_hint(chat_id, LANGUAGE_HINT_MIN_STREAK, LANGUAGE_RECHECK_EVERY)
+            if hint:
+                logger.debug(f"Using remembered language {hint} for chat {chat_id}; skipping detection")
         
-        result = await transcription.transcribe_audio_safe(temp_file_path)
+            await advance_job(job, 'transcribing')
+            transcribed_text, metadata = await stream_transcription_to_message(status_message, audio_buffer, hint)
         
-        if result and result.text:
-            transcribed_text = result.text
-            language = result.metadata.get('language', 'unknown')
-            await update.message.reply_text(
-                f"📝 Transcription ({language}):\n\n{transcribed_text}"
-            )
+            if transcribed_text:
+                await send_transcription(status_message, transcribed_text, metadata['language'])
             
-            await database.mark_message_processed(chat_id, message_id)
+                try:
+                    await update_language_memory(chat_id, hint, metadata)
+                except Exception as e:
+                    logger.warning(f"Could not update language memory for chat {chat_id}: {e}")
             
-            if update.message.audio:
-                await database.mark_audio_processed(audio_file.file_id)
+                await database.mark_message_processed(chat_id, message_id)
             
-            logger.info(f"Transcription completed for message {message_id} in chat {chat_id}")
-        else:
-            await update.message.reply_text(
-                'Sorry, I could not transcribe the audio. Please try again or check if the audio is clear.'
-            )
+                if payload.get('is_audio'):
+                    await database.mark_audio_processed(payload['file_id'])
+            
+                logger.info(f"Transcription completed for message {message_id} in chat {chat_id}")
+            else:
+                await edit_status_message(
+                    status_message,
+                    'Sorry, I could not transcribe the audio. Please try again or check if the audio is clear.'
+                )
         
-        delete_after = await database.get_delete_after_transcription(chat_id)
-        if delete_after and temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            logger.info(f"Deleted audio file for chat {chat_id} per settings")
+        except transcription.TranscriptionBusyError as e:
+            logger.warning(f"Transcription queue full for message {message_id} in chat {chat_id}: {e}")
+            await edit_status_message(
+                status_message,
+                'Sorry, all transcription workers are busy right now. Please send the audio again in a few minutes.'
+            )
         
-    except Exception as e:
-        logger.error(f"Error transcribing audio: {e}", exc_info=True)
-        await update.message.reply_text(f'Sorry, an error occurred during transcription: {str(e)}')
+        except transcription.TranscriptionCancelledError:
+            # Shutting down; the job is resumed on the next start
+            raise
         
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        except Exception as e:
+            logger.error(f"Error transcribing audio: {e}", exc_info=True)
+            await message.reply_text(f'Sorry, an error occurred during transcription: {str(e)}')
+    
+        finally:
+            audio_buffer.close()
 
 async def process_startup_history(application: Application):
     logger.info("Processing startup history for unprocessed messages...")
@@ -260,20 +914,98 @@ async def process_startup_history(application: Application):
         except Exception as e:
             logger.error(f"Error accessing chat {chat_id}: {e}")
     
+    # Jobs accepted before the last shutdown or crash continue in the
+    # background, each from the last stage it recorded
+    for job in await database.get_unfinished_jobs():
+        application.create_task(resume_job(application.bot, job))
+    
     logger.info("Startup history processing complete")
 
+async def warm_up_model(attempt: int) -> bool:
+    """
+    Run one model warmup, recording the failure for /ready if it fails.
+    
+    Args:
+        attempt: Number of this attempt, starting at 1
+        
+    Returns:
+        True if the warmup succeeded
+    """
+    try:
+        await transcription.warmup()
+    except Exception as e:
+        logger.error(f"Whisper warmup attempt {attempt} failed: {e}", exc_info=True)
+        warmup_failure.update({'warmup_error': str(e), 'warmup_attempts': attempt})
+        return False
+    warmup_failure.clear()
+    return True
+
+async def retry_warmup():
+    """Retry a failed warmup every WARMUP_RETRY_SECONDS, then mark the bot ready."""
+    attempt = 1
+    while True:
+        await asyncio.sleep(WARMUP_RETRY_SECONDS)
+        attempt += 1
+        if await warm_up_model(attempt):
+            startup_complete.set()
+            return
+
+# Background task retrying a failed startup warmup
+_warmup_retry = None
+
 async def post_init(application: Application):
+    global _warmup_retry
     database.init_database()
     logger.info("Database initialized")
+    
+    # Clears scratch directories a crashed run left behind, except partial
+    # downloads of jobs about to be resumed, then keeps sweeping
+    for job in await database.get_unfinished_jobs():
+        scratch.retain(job_key(job))
+    scratch.start_janitor()
+    
+    warmed_up = not transcription.WHISPER_PRELOAD or await warm_up_model(1)
+
+    try:
+        await downloader.prewarm()
+    except Exception as e:
+        # Downloads still work; they build their YoutubeDL instances on demand
+        logger.warning(f"YoutubeDL prewarm failed: {e}")
+
+    if warmed_up:
+        startup_complete.set()
+    else:
+        # Stay unready so the deploy does not route traffic here, but still
+        # resume the previous run's jobs while the warmup is retried
+        _warmup_retry = asyncio.ensure_future(retry_warmup())
     await process_startup_history(application)
 
+async def post_shutdown(application: Application):
+    if _warmup_retry is not None:
+        _warmup_retry.cancel()
+    await downloader.shutdown()
+    await transcription.shutdown()
+    await scratch.stop_janitor()
+    await database.close_database()
+
 def main():
     """Start the bot."""
     # Create the Application
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+    # Updates are handled concurrently so one chat's download or transcription
+    # does not hold up the others; the worker pools bound the actual work
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("format", handle_format_command))
+    application.add_handler(CommandHandler("transcribe", handle_transcribe_command))
     application.add_handler(CallbackQueryHandler(handle_deletion_callback, pattern="^delete_"))
     application.add_handler(MessageHandler(filters.AUDIO | filters.VOICE, handle_audio_message))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
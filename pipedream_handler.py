@@ -19,8 +19,9 @@ Dependencies (add in Pipedream):
 
 import os
 import logging
+import tempfile
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Dict, Any
 
 # Configure logging
 logging.basicConfig(
@@ -29,10 +30,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Audio downloads up to this size stay in memory; larger ones spill to disk
+IN_MEMORY_AUDIO_MAX_BYTES = int(os.environ.get('IN_MEMORY_AUDIO_MAX_BYTES', str(8 * 1024 * 1024)))
+# YouTube downloads running at once, on a dedicated thread pool
+YOUTUBE_DOWNLOAD_WORKERS = int(os.environ.get('YOUTUBE_DOWNLOAD_WORKERS', '4'))
+# 'mp3' re-encodes to 192 kbps MP3; 'm4a' remuxes YouTube's native AAC
+# stream without re-encoding
+YOUTUBE_AUDIO_FORMAT = os.environ.get('YOUTUBE_AUDIO_FORMAT', 'mp3')
+
 
 class TelegramWebhookHandler:
     """Handler for Telegram webhook updates."""
     
+    # Shared by all handler instances in this process
+    _download_executor = None
+    
     def __init__(self, bot_token: str):
         """Initialize the handler with bot token."""
         from telegram import Bot
@@ -122,8 +134,6 @@ class TelegramWebhookHandler:
     
     async def _download_youtube_audio(self, update, url: str):
         """Download YouTube video and convert to MP3."""
-        import yt_dlp
-        
         chat_id = update.message.chat_id
         
         # Validate URL
@@ -140,39 +150,43 @@ class TelegramWebhookHandler:
             text='⏳ Downloading...'
         )
         
-        mp3_file = None
+        audio_file = None
         
         try:
             # Configure yt-dlp
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
+            if YOUTUBE_AUDIO_FORMAT == 'm4a':
+                # FFmpegExtractAudio stream-copies AAC into .m4a
+                audio_format = 'bestaudio[ext=m4a]/bestaudio/best'
+                postprocessor = {'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}
+            else:
+                audio_format = 'bestaudio/best'
+                postprocessor = {
                     'key': 'FFmpegExtractAudio',
                     'preferredcodec': 'mp3',
                     'preferredquality': '192',
-                }],
+                }
+            ydl_opts = {
+                'format': audio_format,
+                'postprocessors': [postprocessor],
                 'outtmpl': str(self.temp_dir / '%(title)s.%(ext)s'),
                 'quiet': True,
                 'no_warnings': True,
             }
             
-            # Download
+            # Download on the download pool so the event loop stays free
             logger.info(f"Downloading: {url}")
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                mp3_file = filename.rsplit('.', 1)[0] + '.mp3'
+            info, audio_file = await self._run_download(url, ydl_opts, chat_id, status_msg.message_id)
             
             # Update status
             await self.bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=status_msg.message_id,
-                text='📤 Uploading MP3...'
+                text=f'📤 Uploading {postprocessor["preferredcodec"].upper()}...'
             )
             
             # Send file
-            logger.info(f"Sending MP3: {mp3_file}")
-            with open(mp3_file, 'rb') as audio:
+            logger.info(f"Sending audio: {audio_file}")
+            with open(audio_file, 'rb') as audio:
                 await self.bot.send_audio(
                     chat_id=chat_id,
                     audio=audio,
@@ -203,10 +217,10 @@ class TelegramWebhookHandler:
         
         finally:
             # Clean up
-            if mp3_file and os.path.exists(mp3_file):
+            if audio_file and os.path.exists(audio_file):
                 try:
-                    os.remove(mp3_file)
-                    logger.info(f"🗑️ Cleaned up: {mp3_file}")
+                    os.remove(audio_file)
+                    logger.info(f"🗑️ Cleaned up: {audio_file}")
                 except Exception as e:
                     logger.error(f"Error cleaning up file: {e}")
     
@@ -224,23 +238,24 @@ class TelegramWebhookHandler:
             text='⏳ Transcribing audio...'
         )
         
-        temp_file = None
+        # Download into memory; only files above the threshold spill to disk
+        audio_buffer = tempfile.SpooledTemporaryFile(
+            max_size=IN_MEMORY_AUDIO_MAX_BYTES, dir=self.temp_dir
+        )
         
         try:
             # Download file
             file = await self.bot.get_file(audio_file.file_id)
-            file_extension = '.ogg' if update.message.voice else '.mp3'
-            temp_file = self.temp_dir / f"audio_{audio_file.file_id}{file_extension}"
-            
-            await file.download_to_drive(temp_file)
+            await file.download_to_memory(out=audio_buffer)
+            audio_buffer.seek(0)
             
-            # Transcribe
-            logger.info(f"Transcribing: {temp_file}")
-            result = await self._transcribe_audio(str(temp_file))
+            # Transcribe, showing the text decoded so far in the status message
+            logger.info(f"Transcribing audio {audio_file.file_id}")
+            text, language = await self._stream_transcription(
+                audio_buffer, chat_id, status_msg.message_id
+            )
             
-            if result and result.get('text'):
-                text = result['text']
-                language = result.get('language', 'unknown')
+            if text:
                 
                 # Send transcription (split if too long)
                 max_length = 4000
@@ -284,64 +299,169 @@ class TelegramWebhookHandler:
                 )
         
         finally:
-            # Clean up
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                    logger.info(f"🗑️ Cleaned up: {temp_file}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up file: {e}")
+            # Releases the memory, or deletes the spooled file if it rolled over
+            audio_buffer.close()
+    
+    async def _run_download(self, url: str, ydl_opts: Dict[str, Any], chat_id: int, message_id: int):
+        """
+        Run yt-dlp on the download thread pool, reporting progress in the status message.
+        
+        Returns:
+            Tuple of (info dict, audio file path)
+        """
+        import asyncio
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        import yt_dlp
+        
+        if TelegramWebhookHandler._download_executor is None:
+            TelegramWebhookHandler._download_executor = ThreadPoolExecutor(
+                max_workers=YOUTUBE_DOWNLOAD_WORKERS,
+                thread_name_prefix='youtube-download'
+            )
+        
+        loop = asyncio.get_event_loop()
+        last_edit = 0.0
+        
+        async def show(text: str):
+            try:
+                await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+            except Exception as e:
+                logger.warning(f"Could not update download progress: {e}")
+        
+        def on_progress(status):
+            # Runs on the event loop; stage changes always show, byte counts
+            # at most every two seconds
+            nonlocal last_edit
+            if status.get('status') == 'downloading':
+                if time.monotonic() - last_edit < 2.0:
+                    return
+                total = status.get('total_bytes') or status.get('total_bytes_estimate')
+                downloaded = status.get('downloaded_bytes') or 0
+                text = f'⏳ Downloading... {downloaded / total:.0%}' if total else '⏳ Downloading...'
+            elif status.get('status') == 'started':
+                text = '🎛 Converting audio...'
+            else:
+                return
+            last_edit = time.monotonic()
+            asyncio.ensure_future(show(text))
+        
+        def hook(status):
+            loop.call_soon_threadsafe(on_progress, status)
+        
+        def download():
+            opts = dict(ydl_opts, progress_hooks=[hook], postprocessor_hooks=[hook])
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                info = ydl.extract_info(url, download=True)
+                filename = ydl.prepare_filename(info)
+            extension = ydl_opts['postprocessors'][0]['preferredcodec']
+            return info, f"{filename.rsplit('.', 1)[0]}.{extension}"
+        
+        return await loop.run_in_executor(TelegramWebhookHandler._download_executor, download)
     
-    async def _transcribe_audio(self, audio_path: str) -> Optional[Dict[str, Any]]:
+    async def _stream_transcription(self, audio, chat_id: int, message_id: int):
         """
-        Transcribe audio using faster-whisper.
+        Transcribe audio, editing the status message as segments arrive.
         
         Args:
-            audio_path: Path to audio file
+            audio: Binary file object holding the encoded audio
+            chat_id: Chat holding the status message
+            message_id: Status message to update
             
         Returns:
-            Dict with transcription results or None on failure
+            Tuple of (transcribed text, language); text is empty on failure
         """
+        import time
+        
+        parts = []
+        language = 'unknown'
+        last_edit = time.monotonic()
+        
         try:
-            from faster_whisper import WhisperModel
-            import asyncio
-            
-            logger.info("Loading Whisper model...")
-            
-            # Load model (will be cached after first use)
-            loop = asyncio.get_event_loop()
-            model = await loop.run_in_executor(
-                None,
-                lambda: WhisperModel("base", device="cpu", compute_type="int8")
-            )
-            
-            logger.info(f"Transcribing audio: {audio_path}")
+            async for segment_text, language in self._transcribe_stream(audio):
+                if segment_text:
+                    parts.append(segment_text)
+                
+                # Throttle edits to stay well inside Telegram's rate limits
+                if time.monotonic() - last_edit >= 2.0:
+                    partial = " ".join(parts)
+                    if len(partial) > 4000:
+                        partial = '…' + partial[-4000:]
+                    try:
+                        await self.bot.edit_message_text(
+                            chat_id=chat_id,
+                            message_id=message_id,
+                            text=f"⏳ Transcribing ({language})...\n\n{partial}"
+                        )
+                    except Exception as e:
+                        logger.warning(f"Could not update transcription progress: {e}")
+                    last_edit = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error in transcription: {e}", exc_info=True)
+            return "", language
+        
+        return " ".join(parts), language
+    
+    async def _transcribe_stream(self, audio):
+        """
+        Transcribe audio using faster-whisper, yielding segments as they decode.
+        
+        The audio is decoded in memory to 16 kHz mono samples; nothing is
+        written to disk.
+        
+        Args:
+            audio: Binary file object holding the encoded audio
             
-            # Transcribe
-            segments_gen, info = await loop.run_in_executor(
-                None,
-                lambda: model.transcribe(
-                    audio_path,
+        Yields:
+            Tuple of (segment text, detected language)
+        """
+        from faster_whisper import WhisperModel, decode_audio
+        import asyncio
+        import threading
+        
+        logger.info("Loading Whisper model...")
+        
+        # Load model (will be cached after first use)
+        loop = asyncio.get_event_loop()
+        model = await loop.run_in_executor(
+            None,
+            lambda: WhisperModel("base", device="cpu", compute_type="int8")
+        )
+        
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        
+        def decode():
+            # Runs in a worker thread: faster-whisper decodes lazily while
+            # the segment generator is iterated.
+            try:
+                samples = decode_audio(audio, sampling_rate=16000)
+                segments_gen, info = model.transcribe(
+                    samples,
                     beam_size=5,
                     best_of=5,
                     temperature=0.0
                 )
-            )
-            
-            # Collect segments
-            segments = list(segments_gen)
-            text = " ".join(segment.text.strip() for segment in segments)
-            
-            return {
-                'text': text,
-                'language': info.language,
-                'language_probability': info.language_probability,
-                'duration': info.duration
-            }
-            
-        except Exception as e:
-            logger.error(f"Error in transcription: {e}", exc_info=True)
-            return None
+                for segment in segments_gen:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(
+                        queue.put_nowait, (segment.text.strip(), info.language)
+                    )
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        future = loop.run_in_executor(None, decode)
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            await future
+        finally:
+            stop.set()
     
     async def _handle_callback_query(self, update):
         """Handle callback queries from inline keyboards."""
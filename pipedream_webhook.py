@@ -16,6 +16,7 @@ Setup Instructions:
 import os
 import logging
 import asyncio
+import threading
 from pathlib import Path
 from typing import Dict, Any, Optional
 
@@ -26,6 +27,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Idle YoutubeDL instances per option profile. Pipedream keeps module state
+# while a worker stays warm, so later invocations skip building a new one.
+_ydl_pool: Dict[str, list] = {}
+_ydl_pool_lock = threading.Lock()
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', '2'))
+
 
 async def process_webhook(event: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -127,10 +134,36 @@ async def handle_callback_query(bot: Bot, update: Update) -> None:
         )
 
 
+def _extract_with_pool(profile: str, ydl_opts: Dict[str, Any], url: str):
+    """Run extract_info on a pooled YoutubeDL; returns (info, filename)."""
+    import yt_dlp
+
+    with _ydl_pool_lock:
+        idle = _ydl_pool.get(profile)
+        ydl = idle.pop() if idle else None
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL(ydl_opts)
+
+    try:
+        info = ydl.extract_info(url, download=True)
+        filename = ydl.prepare_filename(info)
+    except Exception:
+        # Do not reuse an instance left in an unknown state
+        ydl.close()
+        raise
+
+    with _ydl_pool_lock:
+        idle = _ydl_pool.setdefault(profile, [])
+        if len(idle) < YDL_POOL_SIZE:
+            idle.append(ydl)
+            ydl = None
+    if ydl is not None:
+        ydl.close()
+    return info, filename
+
+
 async def handle_youtube_download(bot: Bot, update: Update) -> None:
     """Download YouTube video as MP3."""
-    import yt_dlp
-    
     url = update.message.text
     chat_id = update.message.chat_id
     
@@ -170,10 +203,10 @@ async def handle_youtube_download(bot: Bot, update: Update) -> None:
         
         # Download the audio
         logger.info(f"Downloading YouTube audio: {url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-            mp3_file = filename.rsplit('.', 1)[0] + '.mp3'
+        info, filename = await asyncio.get_event_loop().run_in_executor(
+            None, _extract_with_pool, 'mp3-192', ydl_opts, url
+        )
+        mp3_file = filename.rsplit('.', 1)[0] + '.mp3'
         
         # Update status
         await bot.edit_message_text(
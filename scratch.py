@@ -0,0 +1,227 @@
+"""
+Per-job scratch directories with a shared byte quota.
+
+Every job that writes intermediate files (yt-dlp downloads, FFmpeg output,
+audio that is too large to keep in memory) gets its own directory under
+SCRATCH_DIR, removed when the job ends. Point SCRATCH_DIR at a tmpfs mount
+such as /dev/shm to keep this I/O in RAM.
+
+Jobs declare how many bytes they expect to write. Once the reservations of
+running jobs reach SCRATCH_MAX_BYTES, new jobs wait for space instead of
+filling the disk. A janitor removes directories left behind by a process
+that crashed or was killed, except those of jobs that will be resumed:
+a job can name its directory with a stable key, so a restarted job finds
+the partial files of its previous run.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SCRATCH_DIR = os.environ.get('SCRATCH_DIR', 'scratch')
+# Bytes all running jobs may reserve together; further jobs wait
+SCRATCH_MAX_BYTES = int(os.environ.get('SCRATCH_MAX_BYTES', str(1024 * 1024 * 1024)))
+# Seconds between janitor sweeps
+SCRATCH_JANITOR_INTERVAL = float(os.environ.get('SCRATCH_JANITOR_INTERVAL', '600'))
+
+_reserved = 0
+_space: Optional[asyncio.Condition] = None
+# Directories of jobs running in this process; the lock keeps the janitor
+# from seeing a directory between its creation and its registration
+_owned: Set[str] = set()
+_owned_lock = threading.Lock()
+# Keys of resumable jobs whose directories must survive until they restart
+_retained: Set[str] = set()
+_janitor_task: Optional[asyncio.Task] = None
+
+
+def _get_space() -> asyncio.Condition:
+    global _space
+    if _space is None:
+        _space = asyncio.Condition()
+    return _space
+
+
+def make_dir(prefix: str) -> str:
+    """
+    Create a scratch directory owned by this process.
+
+    The directory is not charged against the quota; use ``job_dir`` for
+    work whose size should be bounded. Remove it with ``remove_dir``.
+    """
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    with _owned_lock:
+        # The PID in the name tells the janitor whose directory it is
+        path = tempfile.mkdtemp(prefix=f"{prefix}-{os.getpid()}-", dir=SCRATCH_DIR)
+        _owned.add(path)
+    return path
+
+
+def _open_keyed_dir(prefix: str, key: str) -> str:
+    path = os.path.join(SCRATCH_DIR, f"{prefix}-{key}")
+    with _owned_lock:
+        os.makedirs(path, exist_ok=True)
+        _owned.add(path)
+    return path
+
+
+def retain(key: str):
+    """Keep the directories of a resumable job (``key`` or ``key.*``) from the janitor."""
+    with _owned_lock:
+        _retained.add(key)
+
+
+def forget(key: str):
+    """Let the janitor remove a finished job's directories."""
+    with _owned_lock:
+        _retained.discard(key)
+
+
+def _is_retained(name: str) -> bool:
+    key = name.split('-', 1)[-1]
+    return any(key == retained or key.startswith(retained + '.') for retained in _retained)
+
+
+def remove_dir(path: str):
+    """Delete a directory created by ``make_dir``."""
+    shutil.rmtree(path, ignore_errors=True)
+    with _owned_lock:
+        _owned.discard(path)
+
+
+@asynccontextmanager
+async def job_dir(prefix: str, expected_bytes: int = 0, key: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Reserve quota and provide a private scratch directory for one job.
+
+    Waits while other jobs hold the quota. The directory and everything in
+    it is deleted when the block exits, so move results out before then.
+    A keyed directory is kept instead if the job is cancelled or the
+    process dies, as long as its key is retained for the next run.
+
+    Args:
+        prefix: Start of the directory name, e.g. the kind of job
+        expected_bytes: Most bytes the job is expected to have on disk at once
+        key: Stable name for a resumable job; the same key reopens the
+            directory, and whatever a previous run left in it
+    """
+    global _reserved
+
+    # A job larger than the whole quota could never start; let it run alone
+    nbytes = min(max(int(expected_bytes), 0), SCRATCH_MAX_BYTES)
+    space = _get_space()
+    async with space:
+        if _reserved + nbytes > SCRATCH_MAX_BYTES:
+            logger.info(
+                f"Scratch quota full ({_reserved} of {SCRATCH_MAX_BYTES} bytes reserved); "
+                f"{prefix} job waiting for {nbytes} bytes"
+            )
+        await space.wait_for(lambda: _reserved + nbytes <= SCRATCH_MAX_BYTES)
+        _reserved += nbytes
+
+    loop = asyncio.get_event_loop()
+    try:
+        if key is None:
+            path = await loop.run_in_executor(None, make_dir, prefix)
+        else:
+            path = await loop.run_in_executor(None, _open_keyed_dir, prefix, key)
+        try:
+            yield path
+        except asyncio.CancelledError:
+            if key is None:
+                await loop.run_in_executor(None, remove_dir, path)
+            else:
+                # Interrupted, e.g. by a shutdown; keep the partial files for the resume
+                with _owned_lock:
+                    _owned.discard(path)
+                    _retained.add(key)
+            raise
+        except BaseException:
+            await loop.run_in_executor(None, remove_dir, path)
+            raise
+        else:
+            await loop.run_in_executor(None, remove_dir, path)
+    finally:
+        async with space:
+            _reserved -= nbytes
+            space.notify_all()
+
+
+def _owner_alive(name: str) -> bool:
+    """Whether the process that created a scratch entry is still running."""
+    try:
+        pid = int(name.rsplit('-', 2)[-2])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        # Ours but not registered: its job ended without cleaning up
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sweep() -> int:
+    """
+    Remove scratch entries no running job owns.
+
+    Returns:
+        Number of entries removed
+    """
+    if not os.path.isdir(SCRATCH_DIR):
+        return 0
+
+    removed = 0
+    with _owned_lock:
+        for entry in os.scandir(SCRATCH_DIR):
+            if entry.path in _owned or _is_retained(entry.name) or _owner_alive(entry.name):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+            logger.info(f"Janitor removed orphaned scratch entry {entry.path}")
+    return removed
+
+
+async def _janitor():
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, sweep)
+        except Exception as e:
+            logger.warning(f"Scratch janitor failed: {e}")
+        await asyncio.sleep(SCRATCH_JANITOR_INTERVAL)
+
+
+def start_janitor():
+    """Sweep now and then every SCRATCH_JANITOR_INTERVAL seconds."""
+    global _janitor_task
+    if _janitor_task is None:
+        _janitor_task = asyncio.ensure_future(_janitor())
+
+
+async def stop_janitor():
+    global _janitor_task
+    if _janitor_task is not None:
+        task, _janitor_task = _janitor_task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
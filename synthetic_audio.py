@@ -0,0 +1,41 @@
+"""Synthetic audio for the tests and the benchmark scripts."""
+
+import math
+import struct
+import wave
+from pathlib import Path
+from typing import Sequence, Union
+
+
+def write_synthetic_wav(
+    path: Union[str, Path],
+    seconds: float,
+    tones: Sequence[Sequence[float]] = ((220.0, 330.0),),
+    sample_rate: int = 16000
+) -> None:
+    """
+    Write a 16-bit WAV of amplitude-modulated tones.
+
+    Args:
+        path: Output file
+        seconds: Length of the audio
+        tones: Frequencies (Hz) mixed into each channel, one sequence per
+            channel; the default is mono, as Whisper takes it
+        sample_rate: Samples per second
+    """
+    frame_format = '<' + 'h' * len(tones)
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+        samples = (
+            sum(math.sin(2 * math.pi * f * t) for f in channel) / len(channel)
+            for channel in tones
+        )
+        frames += struct.pack(frame_format, *(int(0.3 * envelope * sample * 32767) for sample in samples))
+
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(len(tones))
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(bytes(frames))
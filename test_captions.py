@@ -0,0 +1,216 @@
+"""Tests for captions.py parsing and the caption-first transcript path."""
+
+import asyncio
+import io
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import captions
+import downloader
+from ydl_pool import YoutubeDLPool
+
+
+# Recorded the way YouTube serves them: automatic captions scroll, repeating
+# the previous line in every cue and timing each word
+AUTO_VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:00.320 --> 00:00:02.790 align:start position:0%
+ 
+all<00:00:00.640><c> right</c><00:00:00.880><c> so</c><00:00:01.120><c> here</c>
+
+00:00:02.790 --> 00:00:02.800 align:start position:0%
+all right so here
+ 
+
+00:00:02.800 --> 00:00:05.190 align:start position:0%
+all right so here
+we<00:00:03.120><c> are</c><00:00:03.360><c> in</c><00:00:03.600><c> front</c>
+
+00:00:05.190 --> 00:00:05.200 align:start position:0%
+we are in front
+ 
+
+00:00:05.200 --> 00:00:07.710 align:start position:0%
+we are in front
+of<00:00:05.440><c> the</c><00:00:05.680><c> elephants</c>
+"""
+
+MANUAL_VTT = """\ufeffWEBVTT
+Kind: captions
+Language: de
+
+NOTE recorded from a manual track
+
+1
+00:00:01.200 --> 00:00:03.360
+Hallo &amp; willkommen
+
+2
+00:00:03.360 --> 00:01:05.000
+<i>im Zoo</i>
+"""
+
+AUTO_SRV3 = """<?xml version="1.0" encoding="utf-8" ?><timedtext format="3">
+<head><ws id="0"/><ws id="1" mh="2" ju="0" sd="3"/><wp id="0"/><wp id="1" ap="6" ah="20" av="100" rc="2" cc="40"/></head>
+<body>
+<w t="0" id="1" wp="1" ws="1"/>
+<p t="320" d="4870" w="1"><s ac="0">all</s><s t="320" ac="0"> right</s><s t="560" ac="0"> so</s><s t="800" ac="0"> here</s></p>
+<p t="2790" d="2400" w="1" a="1">
+</p>
+<p t="2800" d="4910" w="1"><s ac="0">we</s><s t="320" ac="0"> are</s><s t="560" ac="0"> in</s><s t="800" ac="0"> front</s></p>
+</body></timedtext>
+"""
+
+MANUAL_SRV1 = """<?xml version="1.0" encoding="utf-8" ?><transcript>\
+<text start="1.2" dur="2.16">All right, so here we are in front of the &amp;lt;b&amp;gt;elephants&amp;lt;/b&amp;gt;</text>\
+<text start="5.318" dur="7.974">the cool thing about these guys is that they have really...</text>\
+<text start="13.292" dur="2.0"></text>\
+</transcript>"""
+
+
+def _tracks(language, *exts):
+    return [{'ext': ext, 'url': f"stub://{language}.{ext}", 'name': language} for ext in exts]
+
+
+def _video(subtitles=None, automatic_captions=None, language='en', duration=19):
+    return {
+        'id': 'jNQXAC9IVRw',
+        'title': 'Me at the zoo',
+        'duration': duration,
+        'language': language,
+        'subtitles': subtitles or {},
+        'automatic_captions': automatic_captions or {},
+    }
+
+
+class StubYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: serves one video's info and its caption files."""
+
+    info = None
+    files = {}
+    opened = []
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=True):
+        return dict(self.info)
+
+    def urlopen(self, url):
+        StubYoutubeDL.opened.append(url)
+        return io.BytesIO(self.files[url].encode())
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stub_youtube(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'yt_dlp', SimpleNamespace(YoutubeDL=StubYoutubeDL))
+    monkeypatch.setattr(downloader, '_ydl_pool', YoutubeDLPool())
+    StubYoutubeDL.opened = []
+    return StubYoutubeDL
+
+
+def test_auto_vtt_drops_scrolled_repeats():
+    cues = captions.parse_vtt(AUTO_VTT)
+
+    assert [cue.text for cue in cues] == ['all right so here', 'we are in front', 'of the elephants']
+    assert cues[0].start == pytest.approx(0.32)
+    assert cues[-1].end == pytest.approx(7.71)
+
+
+def test_manual_vtt_skips_header_and_notes():
+    cues = captions.parse_vtt(MANUAL_VTT)
+
+    assert [cue.text for cue in cues] == ['Hallo & willkommen', 'im Zoo']
+    assert cues[1].end == pytest.approx(65.0)
+
+
+def test_srv3_joins_word_spans_and_skips_line_breaks():
+    cues = captions.parse_captions(AUTO_SRV3, 'srv3')
+
+    assert [cue.text for cue in cues] == ['all right so here', 'we are in front']
+    assert cues[1].start == pytest.approx(2.8)
+
+
+def test_srv1_unescapes_markup():
+    cues = captions.parse_captions(MANUAL_SRV1, 'srv1')
+
+    assert cues[0].text == 'All right, so here we are in front of the elephants'
+    assert cues[1].end == pytest.approx(13.292)
+    assert len(cues) == 2
+
+
+def test_malformed_tracks_raise_caption_error():
+    with pytest.raises(captions.CaptionError):
+        captions.parse_captions('<timedtext><p t="0">', 'srv3')
+    with pytest.raises(captions.CaptionError):
+        captions.parse_captions('00:00:01.000 --> 00:00:02.000\nhi', 'vtt')
+    with pytest.raises(captions.CaptionError):
+        captions.parse_captions('{}', 'json3')
+
+
+def test_manual_subtitles_in_preferred_language_win():
+    info = _video(
+        subtitles={'en': _tracks('en', 'vtt'), 'de-DE': _tracks('de-DE', 'vtt', 'srv3')},
+        automatic_captions={'en-orig': _tracks('en-orig', 'vtt')},
+    )
+
+    track = captions.choose_track(info, ['de'])
+
+    assert track == captions.CaptionTrack('de-DE', 'srv3', 'stub://de-DE.srv3', False)
+    assert captions.choose_track(info, []).language == 'en'
+
+
+def test_automatic_captions_only_in_original_language():
+    translated = {'de': _tracks('de', 'vtt'), 'fr': _tracks('fr', 'vtt')}
+    info = _video(automatic_captions=dict(translated, **{'en-orig': _tracks('en-orig', 'vtt')}))
+
+    track = captions.choose_track(info, ['de'])
+
+    assert track.language == 'en'
+    assert track.automatic
+    assert captions.choose_track(_video(automatic_captions=translated), ['de']) is None
+    assert captions.choose_track(_video(subtitles={'live_chat': _tracks('live_chat', 'json')})) is None
+
+
+def test_fetch_captions_returns_transcription_result(stub_youtube):
+    stub_youtube.info = _video(automatic_captions={'en-orig': _tracks('en-orig', 'vtt')})
+    stub_youtube.files = {'stub://en-orig.vtt': AUTO_VTT}
+
+    result = asyncio.run(downloader.fetch_captions('https://youtu.be/jNQXAC9IVRw'))
+
+    assert result.text == 'all right so here we are in front of the elephants'
+    assert result.metadata['language'] == 'en'
+    assert result.metadata['source'] == 'automatic_captions'
+    assert result.metadata['segments_count'] == 3
+    assert result.metadata['duration'] == 19
+    assert result.metadata['file_size'] == len(AUTO_VTT)
+    # Same keys as a Whisper result, so callers need not care where it came from
+    assert {'language_probability', 'file_name', 'avg_logprob'} <= set(result.metadata)
+
+
+def test_fetch_captions_falls_back_without_usable_track(stub_youtube):
+    stub_youtube.info = _video()
+    assert asyncio.run(downloader.fetch_captions('https://youtu.be/jNQXAC9IVRw')) is None
+
+    stub_youtube.info = _video(subtitles={'en': _tracks('en', 'srv3')})
+    stub_youtube.files = {'stub://en.srv3': 'not xml'}
+    assert asyncio.run(downloader.fetch_captions('https://youtu.be/jNQXAC9IVRw')) is None
+    assert stub_youtube.opened == ['stub://en.srv3']
+
+
+def test_fetch_captions_ignores_duration_limit(stub_youtube, monkeypatch):
+    monkeypatch.setattr(downloader, 'YOUTUBE_MAX_DURATION', 600)
+    stub_youtube.info = _video(subtitles={'en': _tracks('en', 'srv1')}, duration=4 * 3600)
+    stub_youtube.files = {'stub://en.srv1': MANUAL_SRV1}
+
+    result = asyncio.run(downloader.fetch_captions('https://youtu.be/jNQXAC9IVRw'))
+
+    assert result.metadata['source'] == 'subtitles'
+    assert result.metadata['duration'] == 4 * 3600
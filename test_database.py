@@ -0,0 +1,280 @@
+"""Tests for database.py jobs, write-behind markers and the chat settings cache."""
+
+import asyncio
+import importlib
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+import database
+
+
+@pytest.fixture(autouse=True)
+def isolated_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'bot_data.db'))
+    database.init_database()
+    yield
+    asyncio.run(database.close_database())
+
+
+def _stored_messages():
+    with sqlite3.connect(database.DB_PATH) as conn:
+        return set(conn.execute("SELECT chat_id, message_id FROM processed_messages"))
+
+
+def test_markers_answer_lookups_before_they_are_committed(monkeypatch):
+    monkeypatch.setattr(database, 'DB_MARKER_FLUSH_MS', 60_000)
+
+    async def scenario():
+        await database.mark_message_processed(1, 10)
+        await database.mark_audio_processed('file-a')
+
+        assert await database.is_message_processed(1, 10)
+        assert await database.is_audio_processed('file-a')
+        assert not await database.is_message_processed(1, 11)
+        assert _stored_messages() == set()
+
+        assert await database.flush_markers() == 2
+        assert _stored_messages() == {(1, 10)}
+        assert await database.is_message_processed(1, 10)
+        assert await database.is_audio_processed('file-a')
+
+    asyncio.run(scenario())
+
+
+def test_markers_are_committed_after_the_interval(monkeypatch):
+    monkeypatch.setattr(database, 'DB_MARKER_FLUSH_MS', 20)
+
+    async def scenario():
+        for message_id in range(5):
+            await database.mark_message_processed(1, message_id)
+        assert _stored_messages() == set()
+        await asyncio.sleep(0.3)
+        assert _stored_messages() == {(1, message_id) for message_id in range(5)}
+
+    asyncio.run(scenario())
+
+
+def test_full_buffer_is_committed_without_waiting(monkeypatch):
+    monkeypatch.setattr(database, 'DB_MARKER_FLUSH_MS', 60_000)
+    monkeypatch.setattr(database, 'DB_MARKER_FLUSH_ITEMS', 3)
+
+    async def scenario():
+        for message_id in range(3):
+            await database.mark_message_processed(2, message_id)
+        await asyncio.sleep(0.3)
+        assert len(_stored_messages()) == 3
+
+    asyncio.run(scenario())
+
+
+def test_close_and_finished_jobs_commit_buffered_markers(monkeypatch):
+    monkeypatch.setattr(database, 'DB_MARKER_FLUSH_MS', 60_000)
+
+    async def scenario():
+        job = await database.create_job('youtube', 3, 30, {'text': 'x'})
+        await database.mark_message_processed(3, 30)
+        await database.finish_job(job['job_id'])
+        assert _stored_messages() == {(3, 30)}
+
+        await database.mark_message_processed(3, 31)
+        await database.close_database()
+        assert _stored_messages() == {(3, 30), (3, 31)}
+
+    asyncio.run(scenario())
+
+
+def test_settings_are_cached_and_written_through():
+    async def scenario():
+        assert await database.get_delete_after_transcription(5) is True
+        assert await database.get_admin_prompted(5) is False
+        # The missing row is cached too
+        assert database.settings_cache_stats()['misses'] == 1
+
+        await database.set_delete_after_transcription(5, False)
+        await database.set_audio_format(5, 'm4a')
+        assert await database.get_delete_after_transcription(5) is False
+        assert await database.get_audio_format(5) == 'm4a'
+
+        stats = database.settings_cache_stats()
+        assert (stats['hits'], stats['misses']) == (3, 1)
+
+    asyncio.run(scenario())
+
+
+def test_settings_cache_is_warmed_and_bounded(monkeypatch):
+    async def write_settings():
+        for chat_id in range(4):
+            await database.set_admin_prompted(chat_id, True)
+
+    asyncio.run(write_settings())
+    monkeypatch.setattr(database, 'DB_SETTINGS_CACHE_SIZE', 3)
+    database.init_database()
+    assert database.settings_cache_stats()['size'] == 3
+
+    async def scenario():
+        for chat_id in range(4):
+            assert await database.get_admin_prompted(chat_id) is True
+        return database.settings_cache_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['size'] == 3
+    assert stats['hits'] + stats['misses'] == 4
+    assert stats['misses'] >= 1
+
+
+def test_peeking_at_the_language_hint_does_not_count_towards_a_recheck():
+    async def scenario():
+        for _ in range(3):
+            await database.record_detected_language(9, 'de', confident=True)
+        assert await database.peek_language_hint(9, 4) is None
+
+        for _ in range(5):
+            assert await database.peek_language_hint(9, 3) == 'de'
+        assert await database.get_language_hint(9, 3, 2) == 'de'
+        assert await database.get_language_hint(9, 3, 2) == 'de'
+        # Time for detection again, though the chat was peeked at five times
+        assert await database.get_language_hint(9, 3, 2) is None
+        assert await database.peek_language_hint(9, 3) == 'de'
+
+    asyncio.run(scenario())
+
+
+def test_language_hint_needs_a_streak_of_confident_detections():
+    async def scenario():
+        await database.record_detected_language(4, 'en', confident=True)
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 20) is None
+
+        # An unsure detection or another language starts the streak over
+        await database.record_detected_language(4, 'en', confident=False)
+        await database.record_detected_language(4, 'en', confident=True)
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 20) is None
+        await database.record_detected_language(4, 'fr', confident=True)
+        await database.record_detected_language(4, 'en', confident=True)
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 20) is None
+
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 20) == 'en'
+        assert await database.get_language_hint(5, 3, 20) is None
+
+    asyncio.run(scenario())
+
+
+def test_language_hint_is_rechecked_and_cleared():
+    async def scenario():
+        for _ in range(3):
+            await database.record_detected_language(4, 'en', confident=True)
+        assert [await database.get_language_hint(4, 3, 2) for _ in range(3)] == ['en', 'en', None]
+        # The recheck's detection restarts the count of hinted clips
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 2) == 'en'
+
+        # A low-confidence hinted clip clears the hint until a new streak
+        await database.clear_language_hint(4)
+        assert await database.get_language_hint(4, 3, 2) is None
+        for _ in range(2):
+            await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 2) is None
+        await database.record_detected_language(4, 'en', confident=True)
+        assert await database.get_language_hint(4, 3, 2) == 'en'
+
+    asyncio.run(scenario())
+
+
+def test_file_ids_are_stored_per_format_and_bitrate():
+    async def scenario():
+        await database.store_youtube_file_id('aaaaaaaaaaa', 'mp3', '192', 'mp3-file')
+        await database.store_youtube_file_id('aaaaaaaaaaa', 'm4a', 'native', 'm4a-file')
+
+        assert await database.get_youtube_file_id('aaaaaaaaaaa', 'mp3', '192') == 'mp3-file'
+        assert await database.get_youtube_file_id('aaaaaaaaaaa', 'm4a', 'native') == 'm4a-file'
+        assert await database.get_youtube_file_id('aaaaaaaaaaa', 'mp3', '128') is None
+
+        await database.delete_youtube_file_id('aaaaaaaaaaa', 'mp3', '192')
+        assert await database.get_youtube_file_id('aaaaaaaaaaa', 'mp3', '192') is None
+        assert await database.get_youtube_file_id('aaaaaaaaaaa', 'm4a', 'native') == 'm4a-file'
+
+    asyncio.run(scenario())
+
+
+def test_job_lifecycle_survives_a_restart():
+    async def scenario():
+        first = await database.create_job('youtube', 7, 70, {'text': 'https://youtu.be/x'})
+        second = await database.create_job('transcribe', 7, 71, {'file_id': 'f'})
+        assert first['stage'] == 'queued' and first['artifacts'] == {}
+        assert first['payload'] == {'text': 'https://youtu.be/x'}
+
+        # A redelivered update finds the job it already created
+        again = await database.create_job('youtube', 7, 70, {'text': 'other'})
+        assert again['job_id'] == first['job_id']
+        assert again['payload'] == first['payload']
+
+        await database.update_job(first['job_id'], 'downloading', {'status_message_id': 5})
+        await database.update_job(first['job_id'], 'uploading')
+        with pytest.raises(ValueError):
+            await database.update_job(first['job_id'], 'sleeping')
+        assert await database.record_job_attempt(first['job_id']) == 1
+        await database.close_database()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    database.init_database()
+
+    async def after_restart():
+        jobs = await database.get_unfinished_jobs()
+        assert [job['job_id'] for job in jobs] == [first['job_id'], second['job_id']]
+        assert jobs[0]['stage'] == 'uploading'
+        assert jobs[0]['artifacts'] == {'status_message_id': 5}
+        assert jobs[0]['attempts'] == 1
+        assert jobs[1]['stage'] == 'queued'
+
+        await database.finish_job(first['job_id'])
+        return [job['job_id'] for job in await database.get_unfinished_jobs()]
+
+    assert asyncio.run(after_restart()) == [second['job_id']]
+
+
+def test_advance_job_writes_only_changes(monkeypatch):
+    pytest.importorskip('telegram')
+    pytest.importorskip('flask')
+    monkeypatch.setenv('BOT_TOKEN', 'test-token')
+    main = importlib.import_module('main')
+    writes = []
+
+    async def update_job(job_id, stage, artifacts=None):
+        writes.append((job_id, stage, artifacts))
+
+    monkeypatch.setattr(database, 'update_job', update_job)
+
+    async def scenario():
+        job = await database.create_job('youtube', 8, 80, {})
+        await main.advance_job(job, 'downloading', status_message_id=3)
+        await main.advance_job(job, 'downloading', status_message_id=3)
+        await main.advance_job(job, 'uploading')
+        return job
+
+    job = asyncio.run(scenario())
+
+    assert writes == [
+        (job['job_id'], 'downloading', {'status_message_id': 3}),
+        (job['job_id'], 'uploading', {'status_message_id': 3}),
+    ]
+
+
+def test_invalid_synchronous_setting_fails_at_import():
+    result = subprocess.run(
+        [sys.executable, '-c', 'import database'],
+        cwd=os.path.dirname(os.path.abspath(database.__file__)),
+        env=dict(os.environ, DB_SYNCHRONOUS='fast'),
+        capture_output=True,
+        text=True
+    )
+
+    assert result.returncode != 0
+    assert "Invalid DB_SYNCHRONOUS 'FAST'" in result.stderr
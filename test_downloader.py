@@ -0,0 +1,645 @@
+"""Tests for downloader.py delivery bookkeeping, with yt-dlp and FFmpeg stubbed out."""
+
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import downloader
+import scratch
+from ydl_pool import YoutubeDLPool
+
+
+VIDEO_URL = 'https://www.youtube.com/watch?v=aaaaaaaaaaa'
+
+
+@pytest.fixture(autouse=True)
+def isolated_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(downloader, 'YOUTUBE_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(scratch, 'SCRATCH_DIR', str(tmp_path / 'scratch'))
+    monkeypatch.setattr(downloader, '_holders', {})
+    monkeypatch.setattr(downloader, '_kept', set())
+    monkeypatch.setattr(downloader, '_part_holders', {})
+    monkeypatch.setattr(downloader, '_flights', {})
+    monkeypatch.setattr(downloader, '_slots', None)
+    os.makedirs(tmp_path / 'cache')
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """Make FFmpeg's segment muxer write two empty parts."""
+    def run(args, check=True, **kwargs):
+        pattern = args[-1]
+        for index in range(2):
+            open(pattern % index, 'wb').close()
+
+    monkeypatch.setattr(downloader.subprocess, 'run', run)
+
+
+def _cache_file(video_id: str, audio_format: str, size: int, duration: int = 600) -> str:
+    path = downloader._cache_path(video_id, downloader.get_audio_format(audio_format))
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    with open(path + '.json', 'w') as f:
+        json.dump({'id': video_id, 'title': 'Cached', 'duration': duration}, f)
+    return path
+
+
+def test_concurrent_cache_hits_each_remove_their_parts(monkeypatch, fake_ffmpeg):
+    monkeypatch.setattr(downloader, 'TELEGRAM_UPLOAD_LIMIT_BYTES', 1000)
+    path = _cache_file('aaaaaaaaaaa', 'mp3', 1500)
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            downloader.download_audio(VIDEO_URL), downloader.download_audio(VIDEO_URL)
+        )
+        directories = {os.path.dirname(first.parts[0]), os.path.dirname(second.parts[0])}
+        assert len(directories) == 2
+
+        await downloader.release(first, keep=True)
+        assert not os.path.exists(os.path.dirname(first.parts[0]))
+        assert os.path.exists(os.path.dirname(second.parts[0]))
+
+        await downloader.release(second, keep=True)
+        return directories
+
+    directories = asyncio.run(scenario())
+
+    assert not any(os.path.exists(directory) for directory in directories)
+    assert os.path.exists(path)
+    assert downloader._holders == {} and downloader._part_holders == {}
+
+
+def test_cancelled_fetch_waits_for_its_worker_thread(monkeypatch):
+    audio_format = downloader.get_audio_format('mp3')
+    info = {'id': 'aaaaaaaaaaa', 'duration': 60}
+    started = threading.Event()
+    writes = []
+
+    def download(info, planned, emit, cancel_event, workdir):
+        started.set()
+        cancel_event.wait(5)
+        # Still writing when the cancellation arrives, like yt-dlp between hooks
+        time.sleep(0.2)
+        with open(os.path.join(workdir, 'late.part'), 'wb') as f:
+            f.write(b'x')
+        writes.append(workdir)
+        raise downloader.DownloadCancelledError('cancelled')
+
+    monkeypatch.setattr(downloader, '_prepare_blocking', lambda *args: (info, audio_format, None))
+    monkeypatch.setattr(downloader, '_download_blocking', download)
+    monkeypatch.setattr(downloader, '_slots', None)
+
+    async def scenario():
+        task = asyncio.ensure_future(downloader._fetch(VIDEO_URL, audio_format, [], for_upload=False))
+        await asyncio.get_event_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # The slot came back only after the thread was done with its directory
+        assert len(writes) == 1
+        assert not downloader._get_slots().locked()
+        assert downloader._get_slots()._value == downloader.YOUTUBE_DOWNLOAD_WORKERS
+
+    asyncio.run(scenario())
+    assert not os.path.exists(writes[0])
+
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    """Replace yt-dlp with a download that takes a moment and writes a small file."""
+    calls = []
+
+    def prepare(url, audio_format, emit, for_upload):
+        return {'id': downloader.parse_video_id(url), 'title': 'Video', 'duration': 60}, audio_format, None
+
+    def download(info, audio_format, emit, cancel_event, workdir):
+        calls.append(info['id'])
+        emit({'stage': 'downloading', 'downloaded_bytes': 1})
+        time.sleep(0.1)
+        path = downloader._cache_path(info['id'], audio_format)
+        with open(path, 'wb') as f:
+            f.write(b'audio')
+        return downloader.DownloadedAudio(path, info, audio_format)
+
+    monkeypatch.setattr(downloader, '_prepare_blocking', prepare)
+    monkeypatch.setattr(downloader, '_download_blocking', download)
+    return calls
+
+
+def test_concurrent_requests_share_one_download(fake_download):
+    events = ([], [])
+
+    async def scenario():
+        return await asyncio.gather(
+            downloader.download_audio(VIDEO_URL, on_progress=events[0].append),
+            downloader.download_audio(VIDEO_URL, on_progress=events[1].append),
+        )
+
+    first, second = asyncio.run(scenario())
+
+    assert fake_download == ['aaaaaaaaaaa']
+    assert first.path == second.path
+    assert events[0] == events[1] == [{'stage': 'downloading', 'downloaded_bytes': 1}]
+    assert downloader._holders == {first.path: 2}
+    assert downloader._flights == {}
+
+
+def test_file_is_removed_only_after_the_last_holder_releases(fake_download, monkeypatch):
+    monkeypatch.setattr(downloader, 'YOUTUBE_CACHE_MAX_BYTES', 0)
+
+    async def scenario():
+        first, second = await asyncio.gather(
+            downloader.download_audio(VIDEO_URL), downloader.download_audio(VIDEO_URL)
+        )
+        await downloader.release(first, keep=False)
+        assert os.path.exists(first.path)
+        await downloader.release(second, keep=False)
+        return first.path
+
+    path = asyncio.run(scenario())
+
+    assert not os.path.exists(path)
+    assert downloader._holders == {} and downloader._kept == set()
+
+
+def test_file_is_kept_if_any_holder_asks_to(fake_download):
+    async def scenario():
+        first, second = await asyncio.gather(
+            downloader.download_audio(VIDEO_URL), downloader.download_audio(VIDEO_URL)
+        )
+        await downloader.release(first, keep=True)
+        await downloader.release(second, keep=False)
+        return first.path
+
+    path = asyncio.run(scenario())
+
+    assert os.path.exists(path) and os.path.exists(path + '.json')
+    assert downloader._holders == {} and downloader._kept == set()
+
+
+def test_download_is_cancelled_when_every_caller_gives_up(fake_download):
+    async def scenario():
+        callers = [asyncio.ensure_future(downloader.download_audio(VIDEO_URL)) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        flight = downloader._flights[downloader.cache_key('aaaaaaaaaaa', downloader.get_audio_format())]
+
+        callers[0].cancel()
+        await asyncio.sleep(0)
+        assert not flight.task.cancelled()
+
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+        assert downloader._flights == {}
+
+    asyncio.run(scenario())
+    assert downloader._holders == {}
+
+
+class StubDownloadDL:
+    """Stands in for yt_dlp.YoutubeDL: reports progress through its hooks and writes the file."""
+
+    # Set after the first progress hook; the download then waits for resume
+    hooked = None
+    resume = None
+    # Status of every progress hook call: 'ok', or 'cancelled' if it raised
+    hook_calls = []
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=True):
+        return {'id': downloader.parse_video_id(url), 'title': 'Video', 'duration': 60}
+
+    def prepare_filename(self, info):
+        return os.path.join(self.params['paths']['home'], self.params['outtmpl'] % {'id': info['id'], 'ext': 'webm'})
+
+    def process_ie_result(self, info, download=True):
+        for downloaded in (1, 2):
+            try:
+                for hook in self.params['progress_hooks']:
+                    hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': 2})
+            except downloader.DownloadCancelledError:
+                StubDownloadDL.hook_calls.append('cancelled')
+                raise
+            StubDownloadDL.hook_calls.append('ok')
+            StubDownloadDL.hooked.set()
+            StubDownloadDL.resume.wait(5)
+        for hook in self.params['postprocessor_hooks']:
+            hook({'status': 'started', 'postprocessor': 'ExtractAudio'})
+
+        codec = self.params['postprocessors'][0]['preferredcodec']
+        with open(f"{self.prepare_filename(info).rsplit('.', 1)[0]}.{codec}", 'wb') as f:
+            f.write(b'audio')
+        return info
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stub_download(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'yt_dlp', SimpleNamespace(YoutubeDL=StubDownloadDL))
+    monkeypatch.setattr(downloader, '_ydl_pool', YoutubeDLPool())
+    StubDownloadDL.hooked = threading.Event()
+    StubDownloadDL.resume = threading.Event()
+    StubDownloadDL.resume.set()
+    StubDownloadDL.hook_calls = []
+    return StubDownloadDL
+
+
+def test_progress_hooks_reach_the_callback_on_the_event_loop(stub_download):
+    events = []
+    threads = set()
+
+    def on_progress(event):
+        threads.add(threading.get_ident())
+        events.append(event)
+
+    async def scenario():
+        return await downloader.download_audio(VIDEO_URL, on_progress=on_progress)
+
+    download = asyncio.run(scenario())
+
+    assert threads == {threading.get_ident()}
+    assert events == [
+        {'stage': 'checking'},
+        {'stage': 'downloading', 'downloaded_bytes': 1, 'total_bytes': 2, 'speed': None, 'eta': None},
+        {'stage': 'downloading', 'downloaded_bytes': 2, 'total_bytes': 2, 'speed': None, 'eta': None},
+        {'stage': 'transcoding', 'postprocessor': 'ExtractAudio'},
+    ]
+    with open(download.path, 'rb') as f:
+        assert f.read() == b'audio'
+
+
+def test_downloads_beyond_the_wait_queue_are_turned_away(stub_download, monkeypatch):
+    monkeypatch.setattr(downloader, 'YOUTUBE_DOWNLOAD_WORKERS', 1)
+    monkeypatch.setattr(downloader, 'YOUTUBE_DOWNLOAD_MAX_QUEUE', 1)
+    stub_download.resume.clear()
+
+    async def scenario():
+        running = asyncio.ensure_future(downloader.download_audio('https://youtu.be/aaaaaaaaaaa'))
+        await asyncio.get_event_loop().run_in_executor(None, stub_download.hooked.wait, 5)
+        queued = asyncio.ensure_future(downloader.download_audio('https://youtu.be/bbbbbbbbbbb'))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(downloader.DownloadBusyError):
+            await downloader.download_audio('https://youtu.be/ccccccccccc')
+        assert not any(key.startswith('ccccccccccc') for key in downloader._flights)
+
+        stub_download.resume.set()
+        return await asyncio.gather(running, queued)
+
+    downloads = asyncio.run(scenario())
+
+    assert [download.info['id'] for download in downloads] == ['aaaaaaaaaaa', 'bbbbbbbbbbb']
+
+
+def test_abandoned_download_stops_at_its_next_hook(stub_download):
+    stub_download.resume.clear()
+
+    async def scenario():
+        caller = asyncio.ensure_future(downloader.download_audio(VIDEO_URL))
+        await asyncio.get_event_loop().run_in_executor(None, stub_download.hooked.wait, 5)
+        flight = downloader._flights[downloader.cache_key('aaaaaaaaaaa', downloader.get_audio_format())]
+
+        caller.cancel()
+        await asyncio.sleep(0.05)
+        stub_download.resume.set()
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+
+    asyncio.run(scenario())
+
+    assert stub_download.hook_calls == ['ok', 'cancelled']
+    assert not os.path.exists(downloader._cache_path('aaaaaaaaaaa', downloader.get_audio_format()))
+
+
+def test_eviction_removes_least_recently_used_files_down_to_the_budget(monkeypatch):
+    monkeypatch.setattr(downloader, 'YOUTUBE_CACHE_MAX_BYTES', 250)
+    paths = [_cache_file(video_id, 'mp3', 100) for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc')]
+    for age, path in zip((30, 20, 10), paths):
+        os.utime(path, (time.time() - age, time.time() - age))
+    partial = os.path.join(downloader.YOUTUBE_CACHE_DIR, 'ddddddddddd-mp3-192.mp3.part')
+    with open(partial, 'wb') as f:
+        f.write(b'\0' * 500)
+
+    # The oldest file is still being delivered, so the next oldest goes
+    downloader._evict(frozenset({paths[0]}))
+
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+    assert not os.path.exists(paths[1] + '.json')
+    assert os.path.exists(partial)
+
+    monkeypatch.setattr(downloader, 'YOUTUBE_CACHE_MAX_BYTES', 100)
+    downloader._evict(frozenset())
+
+    assert [os.path.exists(path) for path in paths] == [False, False, True]
+
+
+def test_cache_hit_needs_the_sidecar_and_marks_the_file_used(monkeypatch):
+    audio_format = downloader.get_audio_format('mp3')
+    path = _cache_file('aaaaaaaaaaa', 'mp3', 100)
+    os.utime(path, (time.time() - 3600, time.time() - 3600))
+
+    cached = downloader._cached_audio('aaaaaaaaaaa', audio_format)
+
+    assert cached == downloader.DownloadedAudio(
+        path, {'id': 'aaaaaaaaaaa', 'title': 'Cached', 'duration': 600}, audio_format, cached=True
+    )
+    assert time.time() - os.path.getmtime(path) < 60
+
+    # Without a readable sidecar the file may still be downloading
+    with open(path + '.json', 'w') as f:
+        f.write('{')
+    assert downloader._cached_audio('aaaaaaaaaaa', audio_format) is None
+    os.remove(path + '.json')
+    assert downloader._cached_audio('aaaaaaaaaaa', audio_format) is None
+
+
+def test_deleted_download_never_stays_in_the_cache(fake_download):
+    async def scenario():
+        download = await downloader.download_audio(VIDEO_URL)
+        # Registered while it is being delivered...
+        assert os.path.exists(download.path + '.json')
+        await downloader.release(download, keep=False)
+        return download.path
+
+    path = asyncio.run(scenario())
+
+    # ...but a chat that deletes files does not leave it behind
+    assert not os.path.exists(path) and not os.path.exists(path + '.json')
+    assert os.listdir(downloader.YOUTUBE_CACHE_DIR) == []
+
+def _info(duration=None, **stream):
+    return dict({'id': 'aaaaaaaaaaa', 'duration': duration, 'url': 'stub://audio'}, **stream)
+
+
+def test_delivery_keeps_the_requested_format_when_it_fits(monkeypatch):
+    monkeypatch.setattr(downloader, 'TELEGRAM_UPLOAD_LIMIT_BYTES', 1_000_000)
+    mp3 = downloader.get_audio_format('mp3')
+
+    # 30 s at 192 kbps is 720 kB
+    assert downloader._plan_delivery(_info(30), mp3) is mp3
+    # Nothing to estimate from
+    assert downloader._plan_delivery(_info(), downloader.get_audio_format('m4a')).name == 'm4a'
+
+
+def test_delivery_lowers_mp3_bitrate_to_fit_one_upload(monkeypatch):
+    monkeypatch.setattr(downloader, 'TELEGRAM_UPLOAD_LIMIT_BYTES', 1_000_000)
+
+    # 50 s is 1.2 MB at 192 kbps and 1.0 MB at 160, above the 950 kB budget
+    planned = downloader._plan_delivery(_info(50), downloader.get_audio_format('mp3'))
+
+    assert (planned.bitrate, planned.quality) == ('128', '128')
+    assert downloader.cache_key('aaaaaaaaaaa', planned) == 'aaaaaaaaaaa-mp3-128'
+
+
+def test_delivery_splits_native_audio_that_does_not_fit(monkeypatch):
+    monkeypatch.setattr(downloader, 'TELEGRAM_UPLOAD_LIMIT_BYTES', 1_000_000)
+    monkeypatch.setattr(downloader, 'YOUTUBE_MAX_PARTS', 3)
+    m4a = downloader.get_audio_format('m4a')
+
+    # m4a is never re-encoded, so it is split instead of downsampled
+    assert downloader._plan_delivery(_info(600, filesize=2_500_000), m4a) is m4a
+    assert downloader._plan_delivery(_info(600, abr=24), m4a) is m4a
+
+    with pytest.raises(downloader.DownloadRejectedError, match='would take 4 files'):
+        downloader._plan_delivery(_info(600, filesize=3_000_000), m4a)
+
+
+def test_delivery_rejects_long_videos_and_oversized_mp3(monkeypatch):
+    monkeypatch.setattr(downloader, 'TELEGRAM_UPLOAD_LIMIT_BYTES', 1_000_000)
+    monkeypatch.setattr(downloader, 'YOUTUBE_MAX_PARTS', 4)
+    mp3 = downloader.get_audio_format('mp3')
+
+    # Even 96 kbps needs 1.8 MB, so the 3.6 MB file at 192 kbps is split in 4
+    assert downloader._plan_delivery(_info(150), mp3) is mp3
+    with pytest.raises(downloader.DownloadRejectedError, match='would take 6 files'):
+        downloader._plan_delivery(_info(200), mp3)
+
+    monkeypatch.setattr(downloader, 'YOUTUBE_MAX_DURATION', 3600)
+    with pytest.raises(downloader.DownloadRejectedError, match='1:00:01 long'):
+        downloader._plan_delivery(_info(3601), mp3)
+
+
+def test_m4a_downloads_the_native_aac_stream_and_remuxes_it():
+    opts = downloader._build_ydl_opts(downloader.get_audio_format('m4a'))
+
+    assert opts['format'].split('/')[0] == 'bestaudio[ext=m4a]'
+    # No target quality, so FFmpegExtractAudio copies the AAC stream
+    assert opts['postprocessors'] == [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'm4a'}]
+
+
+def test_mp3_is_encoded_at_the_planned_bitrate():
+    mp3 = downloader.get_audio_format('mp3')
+    opts = downloader._build_ydl_opts(mp3._replace(bitrate='128', quality='128'))
+
+    assert opts['format'] == 'bestaudio/best'
+    assert opts['postprocessors'] == [
+        {'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '128'}
+    ]
+    assert opts['outtmpl'] == '%(id)s-mp3-128.%(ext)s'
+
+
+def test_files_of_each_format_and_bitrate_are_cached_apart():
+    mp3 = downloader.get_audio_format('mp3')
+    paths = {
+        downloader._cache_path('aaaaaaaaaaa', audio_format)
+        for audio_format in (mp3, mp3._replace(bitrate='128', quality='128'), downloader.get_audio_format('m4a'))
+    }
+
+    assert {os.path.basename(path) for path in paths} == {
+        'aaaaaaaaaaa-mp3-192.mp3', 'aaaaaaaaaaa-mp3-128.mp3', 'aaaaaaaaaaa-m4a-native.m4a'
+    }
+    _cache_file('aaaaaaaaaaa', 'mp3', 10)
+    assert downloader._cached_audio('aaaaaaaaaaa', downloader.get_audio_format('m4a')) is None
+
+
+def test_ffmpeg_copies_aac_into_m4a_and_encodes_everything_else():
+    m4a = downloader.get_audio_format('m4a')
+    mp3 = downloader.get_audio_format('mp3')
+
+    assert downloader._ffmpeg_output_args(m4a, 'mp4a.40.2') == ['-c:a', 'copy', '-f', 'ipod']
+    assert downloader._ffmpeg_output_args(m4a, 'opus') == ['-c:a', 'aac', '-b:a', '128k', '-f', 'ipod']
+    assert downloader._ffmpeg_output_args(m4a, None) == ['-c:a', 'aac', '-b:a', '128k', '-f', 'ipod']
+    assert downloader._ffmpeg_output_args(mp3, 'mp4a.40.2') == ['-c:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3']
+
+
+class _FakeFFmpeg:
+    """Stands in for a streaming FFmpeg process: prints progress lines and writes its output."""
+
+    def __init__(self, command, lines, returncode, stderr):
+        self.command = command
+        self.stdout = iter(lines)
+        self.stderr = io.StringIO(stderr)
+        self.returncode = None
+        self.final_returncode = returncode
+        self.killed = False
+        with open(command[-1], 'wb') as f:
+            f.write(b'audio')
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = -9 if self.killed else self.final_returncode
+        return self.returncode
+
+    def kill(self):
+        self.killed = True
+
+
+@pytest.fixture
+def fake_popen(monkeypatch):
+    """Make subprocess.Popen start a _FakeFFmpeg with the given output."""
+    processes = []
+
+    def install(lines, returncode=0, stderr=''):
+        def popen(command, **kwargs):
+            processes.append(_FakeFFmpeg(command, lines, returncode, stderr))
+            return processes[-1]
+
+        monkeypatch.setattr(downloader.subprocess, 'Popen', popen)
+        return processes
+
+    return install
+
+
+_STREAM_INFO = {
+    'id': 'aaaaaaaaaaa', 'duration': 5, 'url': 'https://media.example/audio', 'acodec': 'mp4a.40.2',
+    'http_headers': {'User-Agent': 'test'},
+}
+
+
+def test_streaming_reports_ffmpeg_progress(fake_popen, tmp_path):
+    processes = fake_popen([
+        'out_time_us=1000000\n', 'speed=2x\n', 'out_time_us=N/A\n', 'out_time_us=2500000\n', 'progress=end\n'
+    ])
+    events = []
+    m4a = downloader.get_audio_format('m4a')
+
+    download = downloader._stream_blocking(_STREAM_INFO, m4a, events.append, threading.Event(), str(tmp_path))
+
+    command = processes[0].command
+    assert command[command.index('-progress') + 1] == 'pipe:1'
+    assert command[command.index('-headers') + 1] == 'User-Agent: test\r\n'
+    assert command[command.index('-i') + 1] == 'https://media.example/audio'
+    assert command[-5:-1] == ['-c:a', 'copy', '-f', 'ipod']
+    assert events == [
+        {'stage': 'streaming', 'processed_seconds': seconds, 'duration': 5} for seconds in (0, 1.0, 2.5)
+    ]
+    assert download.path == downloader._cache_path('aaaaaaaaaaa', m4a)
+    assert os.path.exists(download.path)
+
+
+def test_cancelled_stream_kills_ffmpeg(fake_popen, tmp_path):
+    processes = fake_popen(['out_time_us=1000000\n'])
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(downloader.DownloadCancelledError):
+        downloader._stream_blocking(
+            _STREAM_INFO, downloader.get_audio_format('m4a'), lambda event: None, cancel_event, str(tmp_path)
+        )
+
+    assert processes[0].killed
+    assert processes[0].returncode is not None
+
+
+def test_failed_stream_leaves_nothing_behind(fake_popen, monkeypatch):
+    fake_popen(['out_time_us=1000000\n'], returncode=1, stderr='Server returned 403 Forbidden\n')
+    m4a = downloader.get_audio_format('m4a')
+    monkeypatch.setattr(downloader, 'YOUTUBE_STREAMING_TRANSCODE', True)
+    monkeypatch.setattr(downloader, '_prepare_blocking', lambda *args: (dict(_STREAM_INFO), m4a, None))
+
+    async def scenario():
+        with pytest.raises(downloader.DownloadError, match='403 Forbidden'):
+            await downloader._fetch(VIDEO_URL, m4a, [], for_upload=False)
+        assert not downloader._get_slots().locked()
+        assert downloader._active == set()
+
+    asyncio.run(scenario())
+
+    assert os.listdir(scratch.SCRATCH_DIR) == []
+    assert not os.path.exists(downloader._cache_path('aaaaaaaaaaa', m4a))
+
+
+class StubPlaylistDL:
+    """Stands in for yt_dlp.YoutubeDL: pages through a fixed list of playlist entries."""
+
+    entries = []
+    fetched = 0
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=True, process=True):
+        def pages():
+            for entry in StubPlaylistDL.entries:
+                if isinstance(entry, Exception):
+                    raise entry
+                StubPlaylistDL.fetched += 1
+                yield entry
+
+        return {'_type': 'playlist', 'entries': pages()}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def stub_playlist(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'yt_dlp', SimpleNamespace(YoutubeDL=StubPlaylistDL))
+    monkeypatch.setattr(downloader, '_ydl_pool', YoutubeDLPool())
+    StubPlaylistDL.fetched = 0
+    return StubPlaylistDL
+
+
+def _expand(url, max_items=None):
+    async def collect():
+        return [video async for video in downloader.expand_playlist(url, max_items)]
+
+    return asyncio.run(collect())
+
+
+def test_playlist_entries_are_yielded_in_order(stub_playlist):
+    stub_playlist.entries = [{'id': 'bbbbbbbbbbb'}, None, {'id': 'ccccccccccc'}, {'title': 'Private video'},
+                             {'id': 'ddddddddddd'}]
+
+    videos = _expand('https://www.youtube.com/playlist?list=PL1')
+
+    assert videos == [f"https://www.youtube.com/watch?v={video_id}"
+                      for video_id in ('bbbbbbbbbbb', 'ccccccccccc', 'ddddddddddd')]
+
+
+def test_playlist_stops_at_max_items(stub_playlist):
+    stub_playlist.entries = [{'id': f"video{index:06d}"} for index in range(10)]
+
+    videos = _expand('https://www.youtube.com/playlist?list=PL1', max_items=3)
+
+    assert [video[-11:] for video in videos] == ['video000000', 'video000001', 'video000002']
+    # The lazy entries generator was not paged past the limit
+    assert stub_playlist.fetched == 4
+
+
+def test_playlist_error_after_first_entries(stub_playlist):
+    stub_playlist.entries = [{'id': 'bbbbbbbbbbb'}, RuntimeError('HTTP Error 500')]
+    videos = []
+
+    async def collect():
+        async for video in downloader.expand_playlist('https://www.youtube.com/playlist?list=PL1'):
+            videos.append(video)
+
+    with pytest.raises(downloader.DownloadError, match='HTTP Error 500'):
+        asyncio.run(collect())
+    assert videos == ['https://www.youtube.com/watch?v=bbbbbbbbbbb']
@@ -0,0 +1,362 @@
+"""Tests for main.py job flows, with Telegram messages and the downloader replaced by doubles."""
+
+import asyncio
+import importlib
+from threading import Event
+from types import SimpleNamespace
+
+import pytest
+
+import captions
+import database
+import downloader
+import scratch
+import transcription
+
+pytest.importorskip('telegram')
+pytest.importorskip('flask')
+
+from telegram.error import BadRequest  # noqa: E402
+
+
+VIDEO_ID = 'aaaaaaaaaaa'
+VIDEO_URL = f'https://www.youtube.com/watch?v={VIDEO_ID}'
+
+
+@pytest.fixture(autouse=True)
+def isolated_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'bot_data.db'))
+    monkeypatch.setattr(scratch, 'SCRATCH_DIR', str(tmp_path / 'scratch'))
+    database.init_database()
+    yield
+    asyncio.run(database.close_database())
+
+
+@pytest.fixture
+def main(monkeypatch):
+    monkeypatch.setenv('BOT_TOKEN', 'test-token')
+    return importlib.import_module('main')
+
+
+class _FakeMessage:
+    """Stands in for a telegram Message: records replies and edits."""
+
+    def __init__(self, chat_id: int = 1, message_id: int = 10, rejected_file_ids=()):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.chat = SimpleNamespace(id=chat_id, type='private')
+        self.rejected_file_ids = set(rejected_file_ids)
+        self.audio_replies = []
+        self.texts = []
+
+    def get_bot(self):
+        async def get_file(file_id):
+            async def download_to_memory(out):
+                out.write(b'voice note ' + file_id.encode())
+            return SimpleNamespace(download_to_memory=download_to_memory)
+
+        return SimpleNamespace(get_file=get_file)
+
+    async def reply_audio(self, audio, **kwargs):
+        if isinstance(audio, str):
+            self.audio_replies.append(audio)
+            if audio in self.rejected_file_ids:
+                raise BadRequest('Wrong file identifier/http url specified')
+            return SimpleNamespace(audio=SimpleNamespace(file_id=audio))
+        self.audio_replies.append(audio.read())
+        return SimpleNamespace(audio=SimpleNamespace(file_id=f"fresh-{len(self.audio_replies)}"))
+
+    async def reply_text(self, text, **kwargs):
+        self.texts.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+@pytest.fixture
+def fake_downloads(tmp_path, monkeypatch):
+    """Replace downloads with small files and record every release."""
+    fetched = []
+    released = []
+    # Downloads of these video IDs wait until their event is set
+    gates = {}
+
+    async def download_audio(url, on_progress=None, audio_format=None, resume_key=None, for_upload=True):
+        video_id = downloader.parse_video_id(url)
+        fetched.append(video_id)
+        if video_id in gates:
+            await gates[video_id].wait()
+        path = tmp_path / f"{video_id}.{audio_format}"
+        path.write_bytes(b'audio of ' + video_id.encode())
+        return downloader.DownloadedAudio(
+            str(path), {'id': video_id, 'title': 'Video'}, downloader.get_audio_format(audio_format)
+        )
+
+    async def release(download, keep):
+        released.append((download.info['id'], keep))
+
+    async def download_for_transcription(url, on_progress=None, resume_key=None):
+        return await download_audio(url, on_progress, 'm4a', resume_key, for_upload=False)
+
+    monkeypatch.setattr(downloader, 'download_audio', download_audio)
+    monkeypatch.setattr(downloader, 'download_for_transcription', download_for_transcription)
+    monkeypatch.setattr(downloader, 'release', release)
+    return SimpleNamespace(fetched=fetched, released=released, gates=gates)
+
+
+def test_rejected_file_id_falls_back_to_a_fresh_download(main, fake_downloads):
+    audio_format = downloader.get_audio_format()
+    message = _FakeMessage(rejected_file_ids={'stale-id'})
+
+    async def scenario():
+        await database.store_youtube_file_id(VIDEO_ID, audio_format.name, audio_format.bitrate, 'stale-id')
+        job = await database.create_job('youtube', message.chat_id, message.message_id, {'text': VIDEO_URL})
+        await main.process_youtube_message(message, [VIDEO_URL], job)
+        return (
+            await database.get_youtube_file_id(VIDEO_ID, audio_format.name, audio_format.bitrate),
+            await database.is_message_processed(message.chat_id, message.message_id),
+        )
+
+    file_id, processed = asyncio.run(scenario())
+
+    assert message.audio_replies == ['stale-id', b'audio of ' + VIDEO_ID.encode()]
+    assert fake_downloads.fetched == [VIDEO_ID]
+    # The upload's file_id replaces the one Telegram rejected
+    assert file_id == 'fresh-2'
+    assert processed
+    assert fake_downloads.released == [(VIDEO_ID, False)]
+
+
+def test_known_file_id_is_sent_without_downloading(main, fake_downloads):
+    audio_format = downloader.get_audio_format()
+    message = _FakeMessage()
+
+    async def scenario():
+        await database.store_youtube_file_id(VIDEO_ID, audio_format.name, audio_format.bitrate, 'known-id')
+        job = await database.create_job('youtube', message.chat_id, message.message_id, {'text': VIDEO_URL})
+        await main.process_youtube_message(message, [VIDEO_URL], job)
+
+    asyncio.run(scenario())
+
+    assert message.audio_replies == ['known-id']
+    assert fake_downloads.fetched == []
+
+
+def test_cancelled_batch_releases_downloads_it_did_not_send(main, fake_downloads):
+    urls = [f'https://youtu.be/{video_id}' for video_id in ('aaaaaaaaaaa', 'bbbbbbbbbbb', 'ccccccccccc')]
+    message = _FakeMessage()
+
+    async def scenario():
+        # The first video stalls, so the two after it finish and wait their turn
+        fake_downloads.gates['aaaaaaaaaaa'] = asyncio.Event()
+        job = await database.create_job('youtube', message.chat_id, message.message_id, {'text': ' '.join(urls)})
+        batch = asyncio.ensure_future(main.download_batch(message, urls, job))
+        while len(fake_downloads.fetched) < 3:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+
+    asyncio.run(scenario())
+
+    assert message.audio_replies == []
+    assert sorted(fake_downloads.released) == [('bbbbbbbbbbb', False), ('ccccccccccc', False)]
+
+
+def _fake_stream(error):
+    """transcribe_stream double that decodes one segment and then fails with error."""
+    async def transcribe_stream(audio, language=None, timeout=300, on_queued=None):
+        yield transcription.TranscriptionResult('Hallo', {'language': 'de', 'avg_logprob': -0.3})
+        raise error
+
+    return transcribe_stream
+
+
+def _run_transcription_job(main, message):
+    async def scenario():
+        job = await database.create_job(
+            'transcription', message.chat_id, message.message_id, {'file_id': 'voice-1', 'file_size': 100}
+        )
+        await main.run_job(job, main.transcribe_audio_message, message, job)
+        return (
+            [unfinished['job_id'] for unfinished in await database.get_unfinished_jobs()],
+            job['job_id'],
+            await database.is_message_processed(message.chat_id, message.message_id),
+        )
+
+    return asyncio.run(scenario())
+
+
+def test_transcription_interrupted_by_shutdown_stays_resumable(main, monkeypatch):
+    monkeypatch.setattr(
+        transcription, 'transcribe_stream',
+        _fake_stream(transcription.TranscriptionCancelledError('Whisper worker pool is shut down'))
+    )
+    message = _FakeMessage()
+
+    unfinished, job_id, processed = _run_transcription_job(main, message)
+
+    assert unfinished == [job_id]
+    assert not processed
+    assert not any('Sorry' in text for text in message.texts)
+
+
+def test_failed_transcription_finishes_its_job(main, monkeypatch):
+    monkeypatch.setattr(
+        transcription, 'transcribe_stream', _fake_stream(transcription.TranscriptionError('decoder crashed'))
+    )
+    message = _FakeMessage()
+
+    unfinished, _, processed = _run_transcription_job(main, message)
+
+    assert unfinished == []
+    assert not processed
+    assert message.texts[-1].startswith('Sorry, I could not transcribe the audio.')
+
+
+@pytest.mark.parametrize('delete_after', [True, False])
+@pytest.mark.parametrize('error', [None, transcription.TranscriptionError('decoder crashed')])
+def test_video_audio_is_released_by_the_chats_delete_setting(main, fake_downloads, monkeypatch,
+                                                             delete_after, error):
+    async def transcribe_stream(audio, language=None, timeout=300, on_queued=None):
+        yield transcription.TranscriptionResult('Hello', {'language': 'en', 'avg_logprob': -0.3})
+        if error is not None:
+            raise error
+
+    monkeypatch.setattr(captions, 'YOUTUBE_CAPTIONS', False)
+    monkeypatch.setattr(transcription, 'transcribe_stream', transcribe_stream)
+    message = _FakeMessage()
+
+    async def scenario():
+        await database.set_delete_after_transcription(message.chat_id, delete_after)
+        job = await database.create_job(
+            'youtube_transcript', message.chat_id, message.message_id, {'url': VIDEO_URL}
+        )
+        await main.run_job(job, main.transcribe_youtube, message, VIDEO_URL, job)
+
+    asyncio.run(scenario())
+
+    assert fake_downloads.fetched == [VIDEO_ID]
+    assert fake_downloads.released == [(VIDEO_ID, not delete_after)]
+
+
+def test_language_memory_records_detections_and_drops_doubtful_hints(main):
+    async def hint(chat_id):
+        return await database.get_language_hint(
+            chat_id, main.LANGUAGE_HINT_MIN_STREAK, main.LANGUAGE_RECHECK_EVERY
+        )
+
+    async def scenario():
+        for _ in range(main.LANGUAGE_HINT_MIN_STREAK):
+            await main.update_language_memory(1, None, {'language': 'de', 'language_probability': 0.95})
+        assert await hint(1) == 'de'
+
+        # An unsure detection does not count towards the streak
+        for _ in range(main.LANGUAGE_HINT_MIN_STREAK - 1):
+            await main.update_language_memory(2, None, {'language': 'de', 'language_probability': 0.95})
+        await main.update_language_memory(2, None, {'language': 'de', 'language_probability': 0.5})
+        await main.update_language_memory(2, None, {'language': 'de', 'language_probability': 0.95})
+        assert await hint(2) is None
+
+        # A hinted clip that decoded well keeps the hint; a poor one clears it
+        await main.update_language_memory(1, 'de', {'language': 'de', 'avg_logprob': -0.4})
+        assert await hint(1) == 'de'
+        await main.update_language_memory(1, 'de', {'language': 'de', 'avg_logprob': -1.6})
+        assert await hint(1) is None
+
+    asyncio.run(scenario())
+
+
+def test_voice_note_is_transcribed_with_the_chats_language(main, monkeypatch):
+    languages = []
+
+    async def transcribe_stream(audio, language=None, timeout=300, on_queued=None):
+        languages.append(language)
+        yield transcription.TranscriptionResult(
+            'Hallo', {'language': 'de', 'language_probability': 0.95, 'avg_logprob': -0.3}
+        )
+
+    monkeypatch.setattr(transcription, 'transcribe_stream', transcribe_stream)
+
+    async def scenario():
+        for message_id in range(1, main.LANGUAGE_HINT_MIN_STREAK + 3):
+            message = _FakeMessage(message_id=message_id)
+            job = await database.create_job(
+                'transcription', message.chat_id, message_id, {'file_id': f'voice-{message_id}'}
+            )
+            await main.run_job(job, main.transcribe_audio_message, message, job)
+
+    asyncio.run(scenario())
+
+    streak = main.LANGUAGE_HINT_MIN_STREAK
+    assert languages == [None] * streak + ['de', 'de']
+
+
+@pytest.fixture
+def startup(main, monkeypatch):
+    """Run post_init with the model preloaded, everything but the warmup stubbed out."""
+    async def nothing(*args):
+        pass
+
+    monkeypatch.setattr(main, 'startup_complete', Event())
+    monkeypatch.setattr(main, 'warmup_failure', {})
+    monkeypatch.setattr(main, '_warmup_retry', None)
+    monkeypatch.setattr(main, 'WARMUP_RETRY_SECONDS', 0.01)
+    monkeypatch.setattr(main, 'process_startup_history', nothing)
+    monkeypatch.setattr(transcription, 'WHISPER_PRELOAD', True)
+    monkeypatch.setattr(downloader, 'prewarm', nothing)
+    monkeypatch.setattr(scratch, 'start_janitor', lambda: None)
+    return main.app.test_client()
+
+
+def test_ready_once_the_warmup_finishes(main, startup, monkeypatch):
+    warmed_up = asyncio.Event()
+
+    async def warmup():
+        await warmed_up.wait()
+
+    monkeypatch.setattr(transcription, 'warmup', warmup)
+
+    async def scenario():
+        init = asyncio.ensure_future(main.post_init(None))
+        await asyncio.sleep(0.01)
+        assert startup.get('/ready').status_code == 503
+
+        warmed_up.set()
+        await init
+        response = startup.get('/ready')
+        assert response.status_code == 200
+        assert response.get_json()['ready'] is True
+
+    asyncio.run(scenario())
+
+
+def test_failed_warmup_is_reported_and_retried(main, startup, monkeypatch):
+    attempts = []
+
+    async def warmup():
+        attempts.append(len(attempts) + 1)
+        if len(attempts) < 3:
+            raise transcription.ModelLoadError('no memory for the model')
+
+    monkeypatch.setattr(transcription, 'warmup', warmup)
+
+    async def scenario():
+        await main.post_init(None)
+        response = startup.get('/ready')
+        assert response.status_code == 503
+        assert response.get_json() == {
+            'ready': False, 'warmup_error': 'no memory for the model', 'warmup_attempts': 1
+        }
+
+        await asyncio.wait_for(main._warmup_retry, timeout=5)
+        response = startup.get('/ready')
+        assert response.status_code == 200
+        assert 'warmup_error' not in response.get_json()
+
+    asyncio.run(scenario())
+
+    assert attempts == [1, 2, 3]
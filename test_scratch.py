@@ -0,0 +1,136 @@
+"""Tests for scratch.py quota, keyed directories and the janitor."""
+
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+
+import scratch
+
+
+@pytest.fixture(autouse=True)
+def isolated_scratch(tmp_path, monkeypatch):
+    monkeypatch.setattr(scratch, 'SCRATCH_DIR', str(tmp_path / 'scratch'))
+    monkeypatch.setattr(scratch, 'SCRATCH_MAX_BYTES', 100)
+    monkeypatch.setattr(scratch, '_reserved', 0)
+    monkeypatch.setattr(scratch, '_space', None)
+    monkeypatch.setattr(scratch, '_owned', set())
+    monkeypatch.setattr(scratch, '_retained', set())
+
+
+def _dead_pid() -> int:
+    child = subprocess.Popen([sys.executable, '-c', 'pass'])
+    child.wait()
+    return child.pid
+
+
+def test_jobs_wait_for_quota_and_resume_on_release():
+    async def scenario():
+        order = []
+        release_first = asyncio.Event()
+
+        async def job(name, nbytes, hold=None):
+            async with scratch.job_dir(name, nbytes) as path:
+                order.append((name, 'start'))
+                assert os.path.isdir(path)
+                if hold is not None:
+                    await hold.wait()
+                order.append((name, 'end'))
+            return path
+
+        first = asyncio.ensure_future(job('first', 70, release_first))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(job('second', 50))
+        await asyncio.sleep(0.05)
+        # The second job does not fit beside the first
+        assert order == [('first', 'start')]
+        assert scratch._reserved == 70
+
+        release_first.set()
+        paths = await asyncio.gather(first, second)
+        assert order == [('first', 'start'), ('first', 'end'), ('second', 'start'), ('second', 'end')]
+        return paths
+
+    paths = asyncio.run(scenario())
+
+    assert scratch._reserved == 0
+    assert not any(os.path.exists(path) for path in paths)
+    assert scratch._owned == set()
+
+
+def test_job_larger_than_quota_runs_alone():
+    async def scenario():
+        async with scratch.job_dir('huge', 10 ** 9):
+            assert scratch._reserved == scratch.SCRATCH_MAX_BYTES
+
+    asyncio.run(scenario())
+    assert scratch._reserved == 0
+
+
+def test_failed_job_releases_quota_and_directory():
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with scratch.job_dir('failing', 40, key='job-1') as path:
+                raise ValueError('boom')
+        return path
+
+    path = asyncio.run(scenario())
+
+    assert not os.path.exists(path)
+    assert scratch._reserved == 0
+
+
+def test_cancelled_keyed_job_keeps_its_directory_for_resume():
+    async def scenario():
+        ready = asyncio.Event()
+
+        async def job():
+            async with scratch.job_dir('download', 10, key='job-7') as path:
+                with open(os.path.join(path, 'video.part'), 'wb') as f:
+                    f.write(b'partial')
+                ready.set()
+                await asyncio.sleep(60)
+
+        task = asyncio.ensure_future(job())
+        await ready.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The janitor leaves it alone while the key is retained
+        assert scratch.sweep() == 0
+        async with scratch.job_dir('download', 10, key='job-7') as path:
+            with open(os.path.join(path, 'video.part'), 'rb') as f:
+                assert f.read() == b'partial'
+
+    asyncio.run(scenario())
+
+    assert scratch._retained == {'job-7'}
+    scratch.forget('job-7')
+    assert not os.path.exists(os.path.join(scratch.SCRATCH_DIR, 'download-job-7'))
+
+
+def test_sweep_skips_live_processes_and_retained_keys():
+    os.makedirs(scratch.SCRATCH_DIR)
+    parent = os.path.join(scratch.SCRATCH_DIR, f"download-{os.getppid()}-abc")
+    dead = os.path.join(scratch.SCRATCH_DIR, f"download-{_dead_pid()}-def")
+    stale_own = os.path.join(scratch.SCRATCH_DIR, f"download-{os.getpid()}-ghi")
+    retained = os.path.join(scratch.SCRATCH_DIR, 'download-job-9.mp3')
+    for path in (parent, dead, stale_own, retained):
+        os.makedirs(path)
+    owned = scratch.make_dir('download')
+    scratch.retain('job-9')
+
+    assert scratch.sweep() == 2
+
+    assert os.path.exists(parent)
+    assert os.path.exists(owned)
+    assert os.path.exists(retained)
+    assert not os.path.exists(dead)
+    assert not os.path.exists(stale_own)
+
+    scratch.forget('job-9')
+    assert scratch.sweep() == 1
+    assert not os.path.exists(retained)
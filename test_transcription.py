@@ -0,0 +1,397 @@
+"""Tests for transcription.py scheduling behaviour."""
+
+import asyncio
+import io
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import transcription
+from synthetic_audio import write_synthetic_wav
+
+
+SAMPLE_RATE = 16000
+
+
+async def _measure_loop_gaps(coro):
+    """Await coro while a ticker records the longest event loop stall."""
+    max_gap = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal max_gap
+        last = time.monotonic()
+        while not done.is_set():
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            max_gap = max(max_gap, now - last)
+            last = now
+
+    ticker_task = asyncio.create_task(ticker())
+    try:
+        result = await coro
+    finally:
+        done.set()
+        await ticker_task
+    return result, max_gap
+
+
+class _SlowFakeModel:
+    """Model double whose segment generator burns time per segment."""
+
+    def __init__(self, segment_seconds: float, segments: int):
+        self.segment_seconds = segment_seconds
+        self.segments = segments
+        self.produced = 0
+
+    def transcribe(self, audio, **kwargs):
+        def generate():
+            for i in range(self.segments):
+                time.sleep(self.segment_seconds)
+                self.produced += 1
+                yield SimpleNamespace(text=f" word{i}", start=float(i), end=float(i + 1))
+
+        info = SimpleNamespace(language='en', language_probability=0.99, duration=float(self.segments))
+        return generate(), info
+
+
+@pytest.fixture(autouse=True)
+def isolated_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'bot_data.db'))
+    database.init_database()
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    model = _SlowFakeModel(segment_seconds=0.05, segments=40)
+
+    async def get_model():
+        return model
+
+    monkeypatch.setattr(transcription, '_get_model', get_model)
+    return model
+
+
+def test_decode_runs_off_event_loop(tmp_path, fake_model):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+
+    result, max_gap = asyncio.run(
+        _measure_loop_gaps(transcription.transcribe_audio(str(audio_path)))
+    )
+
+    assert result.metadata['segments_count'] == 40
+    assert result.text.startswith('word0 word1')
+    assert max_gap < 0.2
+
+
+def test_deadline_stops_decoding(tmp_path, fake_model):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+
+    with pytest.raises(transcription.TranscriptionTimeoutError):
+        asyncio.run(transcription.transcribe_audio(str(audio_path), timeout=0.3))
+
+    # The worker must stop at the next segment boundary instead of decoding
+    # the remaining segments in the background.
+    time.sleep(0.3)
+    produced = fake_model.produced
+    time.sleep(0.3)
+    assert fake_model.produced == produced
+    assert produced < fake_model.segments
+
+
+
+def test_jobs_after_shutdown_are_cancelled(tmp_path, fake_model, monkeypatch):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+    monkeypatch.setattr(transcription, '_shutting_down', False)
+
+    asyncio.run(transcription.shutdown())
+
+    with pytest.raises(transcription.TranscriptionCancelledError):
+        asyncio.run(transcription.transcribe_audio(str(audio_path)))
+    assert fake_model.produced == 0
+
+def test_deadline_checked_between_segments():
+    model = _SlowFakeModel(segment_seconds=0.01, segments=100)
+
+    with pytest.raises(transcription.TranscriptionTimeoutError):
+        transcription._decode_segments(
+            model, 'unused', {}, time.monotonic() + 0.05, threading.Event()
+        )
+
+    assert model.produced < model.segments
+
+
+def test_long_synthetic_audio_keeps_loop_responsive(tmp_path):
+    pytest.importorskip('faster_whisper')
+
+    audio_path = tmp_path / 'long.wav'
+    write_synthetic_wav(audio_path, 120)
+
+    result, max_gap = asyncio.run(
+        _measure_loop_gaps(transcription.transcribe_audio(str(audio_path)))
+    )
+
+    assert result.metadata['duration'] == pytest.approx(120, abs=1)
+    assert max_gap < 0.5
+
+
+def test_stream_yields_segments_before_decode_finishes(tmp_path, fake_model):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+
+    async def first_segment():
+        stream = transcription.transcribe_stream(str(audio_path))
+        try:
+            async for segment in stream:
+                return segment, fake_model.produced
+        finally:
+            await stream.aclose()
+
+    segment, produced = asyncio.run(first_segment())
+
+    assert segment.text == 'word0'
+    assert segment.metadata['language'] == 'en'
+    assert produced < fake_model.segments
+
+
+def test_cache_hit_for_reuploaded_audio(tmp_path, fake_model):
+    original = tmp_path / 'original.wav'
+    write_synthetic_wav(original, 1)
+    copy = tmp_path / 'forwarded.wav'
+    copy.write_bytes(original.read_bytes())
+
+    first = asyncio.run(transcription.transcribe_audio(str(original)))
+    produced = fake_model.produced
+
+    started = time.monotonic()
+    second = asyncio.run(transcription.transcribe_audio(str(copy)))
+
+    assert time.monotonic() - started < 0.5
+    assert fake_model.produced == produced
+    assert second.text == first.text
+    assert second.metadata['cached'] is True
+    assert second.metadata['file_name'] == 'forwarded.wav'
+    assert second.metadata['segments_count'] == first.metadata['segments_count']
+
+
+def test_cache_key_depends_on_decoding_options(tmp_path, fake_model):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+
+    asyncio.run(transcription.transcribe_audio(str(audio_path)))
+    produced = fake_model.produced
+    asyncio.run(transcription.transcribe_audio(str(audio_path), language='de'))
+
+    assert fake_model.produced > produced
+
+
+def test_file_object_is_decoded_in_memory(tmp_path, fake_model, monkeypatch):
+    audio_path = tmp_path / 'voice.wav'
+    write_synthetic_wav(audio_path, 1)
+    buffer = io.BytesIO(audio_path.read_bytes())
+    decoded = []
+
+    def load_audio(audio):
+        decoded.append(audio.read())
+        return [0.0] * SAMPLE_RATE
+
+    received = []
+    transcribe = fake_model.transcribe
+
+    def record_input(audio, **kwargs):
+        received.append(audio)
+        return transcribe(audio, **kwargs)
+
+    monkeypatch.setattr(transcription, '_load_audio', load_audio)
+    monkeypatch.setattr(fake_model, 'transcribe', record_input)
+
+    result = asyncio.run(transcription.transcribe_audio(buffer))
+
+    assert decoded == [audio_path.read_bytes()]
+    assert received == [[0.0] * SAMPLE_RATE]
+    assert result.metadata['file_name'] == 'in-memory audio'
+    assert result.metadata['file_size'] == len(decoded[0])
+
+
+class _SecondsModel:
+    """Model double that emits one segment per second of its input.
+
+    Each sample holds the file-relative second it belongs to, so a segment's
+    text tells which part of the file it was decoded from.
+    """
+
+    def __init__(self, slow_first_chunk: float):
+        self.slow_first_chunk = slow_first_chunk
+        self.detected_samples = []
+
+    def detect_language(self, audio):
+        self.detected_samples.append(len(audio))
+        return 'de', 0.9, []
+
+    def transcribe(self, audio, **kwargs):
+        def generate():
+            if audio[0] == 0:
+                # The first chunk finishes last
+                time.sleep(self.slow_first_chunk)
+            for second in range(len(audio) // SAMPLE_RATE):
+                yield SimpleNamespace(
+                    text=f" s{int(audio[second * SAMPLE_RATE])}", start=float(second), end=second + 1.0
+                )
+
+        info = SimpleNamespace(language='en', language_probability=1.0, duration=len(audio) / SAMPLE_RATE)
+        return generate(), info
+
+
+def test_short_files_are_not_decoded_up_front(tmp_path, fake_model, monkeypatch):
+    audio_path = tmp_path / 'clip.wav'
+    write_synthetic_wav(audio_path, 1)
+    monkeypatch.setattr(transcription, 'WHISPER_CHUNK_PARALLELISM', 4)
+    monkeypatch.setattr(transcription, '_probe_duration', lambda audio: 1.0)
+
+    def load_audio(audio):
+        raise AssertionError('short file decoded up front')
+
+    monkeypatch.setattr(transcription, '_load_audio', load_audio)
+
+    result = asyncio.run(transcription.transcribe_audio(str(audio_path)))
+
+    assert result.metadata['segments_count'] == 40
+
+
+def test_chunks_are_merged_in_order_with_file_offsets(tmp_path, monkeypatch):
+    audio_path = tmp_path / 'long.wav'
+    write_synthetic_wav(audio_path, 0.1)
+    seconds = 10
+    model = _SecondsModel(slow_first_chunk=0.3)
+
+    async def get_model():
+        return model
+
+    monkeypatch.setattr(transcription, '_get_model', get_model)
+    monkeypatch.setattr(transcription, 'WHISPER_CHUNK_PARALLELISM', 3)
+    monkeypatch.setattr(transcription, 'WHISPER_CHUNKING_MIN_SECONDS', 5)
+    monkeypatch.setattr(transcription, '_probe_duration', lambda audio: float(seconds))
+    monkeypatch.setattr(
+        transcription, '_load_audio',
+        lambda audio: [float(i // SAMPLE_RATE) for i in range(seconds * SAMPLE_RATE)]
+    )
+    monkeypatch.setattr(
+        transcription, '_plan_chunks',
+        lambda audio, limit: [(0, 4 * SAMPLE_RATE), (4 * SAMPLE_RATE, 7 * SAMPLE_RATE),
+                              (7 * SAMPLE_RATE, seconds * SAMPLE_RATE)]
+    )
+
+    async def stream():
+        return [segment async for segment in transcription.transcribe_stream(str(audio_path), language='en')]
+
+    streamed = asyncio.run(stream())
+    expected = [f's{second}' for second in range(seconds)]
+
+    assert [segment.text for segment in streamed] == expected
+    assert [segment.metadata['start'] for segment in streamed] == [float(s) for s in range(seconds)]
+    assert [segment.metadata['end'] for segment in streamed] == [s + 1.0 for s in range(seconds)]
+    assert streamed[0].metadata['duration'] == seconds
+
+    monkeypatch.setattr(transcription, 'TRANSCRIPTION_CACHE_ENABLED', False)
+    result = asyncio.run(transcription.transcribe_audio(str(audio_path), language='en'))
+
+    assert result.text == ' '.join(expected)
+    assert result.metadata['segments_count'] == seconds
+
+
+def test_language_is_detected_on_the_first_30_seconds_only(tmp_path, monkeypatch):
+    audio_path = tmp_path / 'long.wav'
+    write_synthetic_wav(audio_path, 0.1)
+    seconds = 45
+    model = _SecondsModel(slow_first_chunk=0)
+
+    async def get_model():
+        return model
+
+    monkeypatch.setattr(transcription, '_get_model', get_model)
+    monkeypatch.setattr(transcription, 'WHISPER_CHUNK_PARALLELISM', 2)
+    monkeypatch.setattr(transcription, 'WHISPER_CHUNKING_MIN_SECONDS', 5)
+    monkeypatch.setattr(transcription, '_probe_duration', lambda audio: float(seconds))
+    monkeypatch.setattr(transcription, '_load_audio', lambda audio: [0.0] * (seconds * SAMPLE_RATE))
+    monkeypatch.setattr(
+        transcription, '_plan_chunks',
+        lambda audio, limit: [(0, 20 * SAMPLE_RATE), (20 * SAMPLE_RATE, seconds * SAMPLE_RATE)]
+    )
+
+    result = asyncio.run(transcription.transcribe_audio(str(audio_path)))
+
+    assert model.detected_samples == [30 * SAMPLE_RATE]
+    assert result.metadata['language'] == 'de'
+    assert result.metadata['segments_count'] == seconds
+
+
+class _ClipModel:
+    """Model double for batched decoding: a clip's first sample picks its language."""
+
+    def detect_language(self, audio):
+        return ('de', 0.8, []) if audio[0] < 0 else ('en', 0.9, [])
+
+
+class _FakeBatchedPipeline:
+    """Stands in for BatchedInferencePipeline: two segments per clip, at file offsets."""
+
+    calls = []
+
+    def __init__(self, model):
+        self.model = model
+
+    def transcribe(self, audio, language, clip_timestamps, vad_filter, batch_size, **kwargs):
+        _FakeBatchedPipeline.calls.append((language, batch_size, len(audio)))
+
+        def generate():
+            for clip in clip_timestamps:
+                start = clip['start'] / SAMPLE_RATE
+                end = clip['end'] / SAMPLE_RATE
+                tag = f"{language}@{start:g}"
+                yield SimpleNamespace(text=f" {tag} first", start=start, end=start + 0.5, avg_logprob=-0.2)
+                yield SimpleNamespace(text=f" {tag} last", start=start + 0.5, end=end)
+
+        return generate(), SimpleNamespace(language=language)
+
+
+def test_batched_segments_land_in_their_clip_with_clip_timestamps(monkeypatch):
+    np = pytest.importorskip('numpy')
+    monkeypatch.setitem(
+        sys.modules, 'faster_whisper', SimpleNamespace(BatchedInferencePipeline=_FakeBatchedPipeline)
+    )
+    monkeypatch.setattr(_FakeBatchedPipeline, 'calls', [])
+    audios = [
+        np.full(2 * SAMPLE_RATE, 0.1, dtype=np.float32),
+        np.full(3 * SAMPLE_RATE, -0.1, dtype=np.float32),
+        np.full(1 * SAMPLE_RATE, 0.1, dtype=np.float32),
+    ]
+
+    results = transcription._decode_batch(
+        _ClipModel(), audios, {'beam_size': 5}, time.monotonic() + 10, threading.Event()
+    )
+
+    # English clips 0 and 2 share one batch; the German clip gets its own
+    assert _FakeBatchedPipeline.calls == [('en', 2, 3 * SAMPLE_RATE), ('de', 1, 3 * SAMPLE_RATE)]
+    english, german, short = results
+    assert [(s.text, s.start, s.end) for s in english[0]] == [
+        (' en@0 first', 0.0, 0.5), (' en@0 last', 0.5, 2.0)
+    ]
+    assert [(s.text, s.start, s.end) for s in short[0]] == [
+        (' en@2 first', 0.0, 0.5), (' en@2 last', 0.5, 1.0)
+    ]
+    assert [(s.text, s.start, s.end) for s in german[0]] == [
+        (' de@0 first', 0.0, 0.5), (' de@0 last', 0.5, 3.0)
+    ]
+    assert english[0][0].avg_logprob == -0.2
+    assert [info for _, info in results] == [
+        transcription.InfoRecord('en', 0.9, 2.0),
+        transcription.InfoRecord('de', 0.8, 3.0),
+        transcription.InfoRecord('en', 0.9, 1.0),
+    ]
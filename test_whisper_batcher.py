@@ -0,0 +1,124 @@
+"""Tests for whisper_batcher.py grouping, flushing and error delivery."""
+
+import asyncio
+
+import pytest
+
+from transcription import TranscriptionTimeoutError
+from whisper_batcher import MicroBatcher
+
+
+class _RecordingRunner:
+    """run_batch double: records each batch and answers with (key, item) pairs."""
+
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.batches = []
+
+    async def __call__(self, key, items):
+        self.batches.append((key, list(items)))
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [(key, item) for item in items]
+
+
+def test_group_flushes_when_the_window_expires():
+    async def scenario():
+        runner = _RecordingRunner()
+        batcher = MicroBatcher(runner, window=0.05, max_batch_size=8)
+
+        first = asyncio.ensure_future(batcher.submit('en', 1, timeout=5))
+        await asyncio.sleep(0.01)
+        second = asyncio.ensure_future(batcher.submit('en', 2, timeout=5))
+        await asyncio.sleep(0.01)
+        # Still inside the window
+        assert runner.batches == []
+
+        assert await asyncio.gather(first, second) == [('en', 1), ('en', 2)]
+        assert runner.batches == [('en', [1, 2])]
+        assert (batcher.batches_run, batcher.jobs_run) == (1, 2)
+
+    asyncio.run(scenario())
+
+
+def test_full_group_flushes_without_waiting_for_the_window():
+    async def scenario():
+        runner = _RecordingRunner()
+        batcher = MicroBatcher(runner, window=10, max_batch_size=3)
+
+        jobs = [asyncio.ensure_future(batcher.submit('en', item, timeout=20)) for item in range(4)]
+        _, pending = await asyncio.wait(jobs, timeout=1)
+
+        assert [job.result() for job in jobs[:3]] == [('en', 0), ('en', 1), ('en', 2)]
+        # The fourth job opened a new group, which waits out its window
+        assert pending == {jobs[3]}
+        assert runner.batches == [('en', [0, 1, 2])]
+        jobs[3].cancel()
+
+    asyncio.run(scenario())
+
+
+def test_jobs_are_batched_by_key():
+    async def scenario():
+        runner = _RecordingRunner()
+        batcher = MicroBatcher(runner, window=0.05, max_batch_size=8)
+
+        results = await asyncio.gather(
+            batcher.submit(('language', 'en'), 'a', timeout=5),
+            batcher.submit(('language', 'de'), 'b', timeout=5),
+            batcher.submit(('language', 'en'), 'c', timeout=5),
+        )
+
+        assert results == [(('language', 'en'), 'a'), (('language', 'de'), 'b'), (('language', 'en'), 'c')]
+        assert sorted(runner.batches) == [(('language', 'de'), ['b']), (('language', 'en'), ['a', 'c'])]
+
+    asyncio.run(scenario())
+
+
+def test_batch_failure_reaches_every_job():
+    async def scenario():
+        runner = _RecordingRunner(error=RuntimeError('decoder crashed'))
+        batcher = MicroBatcher(runner, window=0.01, max_batch_size=8)
+
+        results = await asyncio.gather(
+            batcher.submit('en', 1, timeout=5),
+            batcher.submit('en', 2, timeout=5),
+            return_exceptions=True
+        )
+
+        assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+        assert all(str(result) == 'decoder crashed' for result in results)
+
+    asyncio.run(scenario())
+
+
+def test_job_times_out_without_holding_up_its_batch():
+    async def scenario():
+        runner = _RecordingRunner(delay=0.3)
+        batcher = MicroBatcher(runner, window=0.01, max_batch_size=8)
+
+        patient = asyncio.ensure_future(batcher.submit('en', 1, timeout=5))
+        await asyncio.sleep(0)
+        with pytest.raises(TranscriptionTimeoutError):
+            await batcher.submit('en', 2, timeout=0.1)
+
+        assert await patient == ('en', 1)
+        assert runner.batches == [('en', [1, 2])]
+
+    asyncio.run(scenario())
+
+
+def test_job_that_timed_out_before_the_flush_is_left_out():
+    async def scenario():
+        runner = _RecordingRunner()
+        batcher = MicroBatcher(runner, window=0.2, max_batch_size=8)
+
+        with pytest.raises(TranscriptionTimeoutError):
+            await batcher.submit('en', 'gone', timeout=0.05)
+        assert await batcher.submit('en', 'kept', timeout=5) == ('en', 'kept')
+
+        assert runner.batches == [('en', ['kept'])]
+
+    asyncio.run(scenario())
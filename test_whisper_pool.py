@@ -0,0 +1,198 @@
+"""Tests for whisper_pool.py queueing and worker replacement, with a stand-in faster_whisper package."""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+import whisper_pool
+from transcription import TranscriptionBusyError, TranscriptionCancelledError, TranscriptionError
+from whisper_pool import WhisperWorkerPool
+
+
+# Loading fails while the file named by FAKE_WHISPER_FAIL_FILE exists
+FAKE_FASTER_WHISPER = '''
+import os
+
+
+class WhisperModel:
+    def __init__(self, *args, **kwargs):
+        if os.path.exists(os.environ.get('FAKE_WHISPER_FAIL_FILE', '')):
+            raise RuntimeError('no memory for the model')
+'''
+
+
+def _worker_pid(model, deadline, cancel_event, emit):
+    """Job: report which process ran it."""
+    return os.getpid()
+
+
+def _wait_for_cancel(model, seconds, deadline, cancel_event, emit):
+    """Job: hold the worker until cancelled or seconds pass."""
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        if cancel_event.is_set():
+            return 'cancelled'
+        time.sleep(0.01)
+    return 'done'
+
+
+def _crash(model, deadline, cancel_event, emit):
+    """Job: die the way an OOM-killed process does."""
+    os._exit(137)
+
+
+@pytest.fixture
+def fake_faster_whisper(tmp_path, monkeypatch):
+    # Worker processes are spawned, so the stand-in has to be importable from disk
+    package = tmp_path / 'faster_whisper'
+    package.mkdir()
+    (package / '__init__.py').write_text(FAKE_FASTER_WHISPER)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    fail_file = tmp_path / 'fail-loading'
+    monkeypatch.setenv('FAKE_WHISPER_FAIL_FILE', str(fail_file))
+    monkeypatch.setattr(whisper_pool, '_CHECK_INTERVAL', 0.05)
+    monkeypatch.setattr(whisper_pool, '_RESPAWN_DELAY', 0.2)
+    return fail_file
+
+
+def _run_pool(scenario, **kwargs):
+    async def main():
+        pool = WhisperWorkerPool(1, **kwargs)
+        await pool.start()
+        try:
+            await scenario(pool)
+        finally:
+            await pool.close()
+
+    asyncio.run(main())
+
+
+def test_dead_idle_worker_is_replaced_before_the_next_job(fake_faster_whisper):
+    async def scenario(pool):
+        first_pid = await pool.run(_worker_pid, timeout=10)
+        worker = pool._workers[0]
+        assert first_pid == worker.process.pid
+
+        worker.process.kill()
+        await asyncio.get_event_loop().run_in_executor(None, worker.process.join, 10)
+
+        second_pid = await pool.run(_worker_pid, timeout=10)
+        assert second_pid != first_pid
+        assert pool._workers[0] is not worker
+        assert pool._workers[0].process.pid == second_pid
+
+    _run_pool(scenario, max_queue=2)
+
+
+def test_worker_dying_mid_job_fails_the_job_promptly(fake_faster_whisper):
+    async def scenario(pool):
+        started = time.monotonic()
+        with pytest.raises(TranscriptionError, match='died while transcribing'):
+            await pool.run(_crash, timeout=30)
+        assert time.monotonic() - started < 5
+
+        assert await pool.run(_worker_pid, timeout=10) == pool._workers[0].process.pid
+
+    _run_pool(scenario)
+
+
+def test_replacement_that_fails_to_load_is_retried(fake_faster_whisper, caplog):
+    async def scenario(pool):
+        fake_faster_whisper.touch()
+        with pytest.raises(TranscriptionError):
+            await pool.run(_crash, timeout=10)
+
+        # Loading keeps failing until the cause goes away
+        await asyncio.sleep(0.6)
+        fake_faster_whisper.unlink()
+        assert await pool.run(_worker_pid, timeout=10) == pool._workers[0].process.pid
+
+    _run_pool(scenario)
+
+    assert 'Replacement whisper worker 0 failed to load model' in caplog.text
+
+
+def test_full_queue_rejects_jobs_with_their_position(fake_faster_whisper):
+    async def scenario(pool):
+        running = asyncio.ensure_future(pool.run(_wait_for_cancel, 2, timeout=10))
+        queued = asyncio.ensure_future(pool.run(_wait_for_cancel, 0, timeout=10))
+        await asyncio.sleep(0.05)
+        assert pool.queue_depth == 1
+
+        with pytest.raises(TranscriptionBusyError) as busy:
+            await pool.run(_worker_pid, timeout=10)
+        assert busy.value.position == 2
+
+        running.cancel()
+        assert await queued == 'done'
+
+    _run_pool(scenario, max_queue=1)
+
+
+def test_queued_jobs_are_told_their_position(fake_faster_whisper):
+    async def scenario(pool):
+        positions = {'second': [], 'third': []}
+        running = asyncio.ensure_future(pool.run(_wait_for_cancel, 0.3, timeout=10))
+        second = asyncio.ensure_future(
+            pool.run(_wait_for_cancel, 0.3, timeout=10, on_queued=positions['second'].append)
+        )
+        third = asyncio.ensure_future(
+            pool.run(_wait_for_cancel, 0, timeout=10, on_queued=positions['third'].append)
+        )
+
+        assert await asyncio.gather(running, second, third) == ['done', 'done', 'done']
+        assert positions == {'second': [1], 'third': [2, 1]}
+
+    _run_pool(scenario, max_queue=4)
+
+
+def test_cancelling_a_queued_job_removes_it(fake_faster_whisper):
+    async def scenario(pool):
+        running = asyncio.ensure_future(pool.run(_wait_for_cancel, 0.3, timeout=10))
+        queued = asyncio.ensure_future(pool.run(_worker_pid, timeout=10))
+        await asyncio.sleep(0.05)
+        assert pool.queue_depth == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert pool.queue_depth == 0
+        assert await running == 'done'
+        assert pool._jobs == {}
+
+    _run_pool(scenario, max_queue=4)
+
+
+def test_cancelling_a_running_job_stops_it_in_the_worker(fake_faster_whisper):
+    async def scenario(pool):
+        running = asyncio.ensure_future(pool.run(_wait_for_cancel, 5, timeout=10))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        running.cancel()
+
+        # The worker is free long before the job's five seconds are up
+        await pool.run(_worker_pid, timeout=10)
+        assert time.monotonic() - started < 2
+
+    _run_pool(scenario)
+
+
+def test_close_cancels_running_and_waiting_jobs(fake_faster_whisper):
+    async def main():
+        pool = WhisperWorkerPool(1, max_queue=4)
+        await pool.start()
+        running = asyncio.ensure_future(pool.run(_wait_for_cancel, 5, timeout=10))
+        waiting = asyncio.ensure_future(pool.run(_worker_pid, timeout=10))
+        await asyncio.sleep(0.2)
+
+        await pool.close()
+
+        for job in (running, waiting):
+            with pytest.raises(TranscriptionCancelledError):
+                await job
+        with pytest.raises(TranscriptionCancelledError):
+            await pool.run(_worker_pid, timeout=10)
+
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""Tests for ydl_pool.py checkout and reset, with yt_dlp stubbed out."""
+
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from ydl_pool import YoutubeDLPool
+
+
+class StubYoutubeDL:
+    """Stands in for yt_dlp.YoutubeDL: keeps its params and records close()."""
+
+    def __init__(self, params):
+        self.params = params
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def stub_yt_dlp(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'yt_dlp', SimpleNamespace(YoutubeDL=StubYoutubeDL))
+
+
+def _opts(**extra):
+    return lambda: dict({'quiet': True}, **extra)
+
+
+def test_instances_are_reused_per_profile():
+    pool = YoutubeDLPool(max_idle=2)
+
+    with pool.checkout('mp3', _opts(format='bestaudio')) as first:
+        pass
+    with pool.checkout('mp3', _opts(format='bestaudio')) as second:
+        pass
+    with pool.checkout('m4a', _opts(format='140')) as other:
+        pass
+
+    assert second is first
+    assert other is not first
+    assert other.ydl.params['format'] == '140'
+    assert (pool.created, pool.reused) == (2, 1)
+
+
+def test_concurrent_checkouts_get_distinct_instances():
+    pool = YoutubeDLPool(max_idle=1)
+
+    with pool.checkout('mp3', _opts()) as first:
+        with pool.checkout('mp3', _opts()) as second:
+            assert second is not first
+
+    # Only one idle instance is kept; the other was closed
+    assert first.ydl.closed != second.ydl.closed
+    with pool.checkout('mp3', _opts()) as third:
+        assert not third.ydl.closed
+
+
+def test_job_params_and_hooks_are_reset():
+    pool = YoutubeDLPool()
+    events = []
+
+    with pool.checkout('mp3', _opts(outtmpl='default'), params={'outtmpl': 'job', 'paths': {'home': '/x'}}) as job:
+        job.progress_hook = events.append
+        assert job.ydl.params['outtmpl'] == 'job'
+        job.ydl.params['progress_hooks'][0]({'status': 'downloading'})
+
+    assert events == [{'status': 'downloading'}]
+
+    with pool.checkout('mp3', _opts()) as reused:
+        assert reused is job
+        assert reused.ydl.params['outtmpl'] == 'default'
+        assert 'paths' not in reused.ydl.params
+        assert reused.progress_hook is None
+        reused.ydl.params['progress_hooks'][0]({'status': 'finished'})
+
+    assert events == [{'status': 'downloading'}]
+
+
+def test_failed_job_discards_its_instance():
+    pool = YoutubeDLPool()
+
+    with pytest.raises(RuntimeError):
+        with pool.checkout('mp3', _opts()) as failed:
+            raise RuntimeError('extractor error')
+
+    assert failed.ydl.closed
+    with pool.checkout('mp3', _opts()) as fresh:
+        assert fresh is not failed
+    assert pool.reused == 0
+
+
+def test_prewarm_fills_up_to_max_idle():
+    created = []
+    pool = YoutubeDLPool(max_idle=3, on_create=created.append)
+
+    pool.prewarm('mp3', _opts(), 5)
+    pool.prewarm('mp3', _opts(), 5)
+
+    assert len(created) == 3
+    with pool.checkout('mp3', _opts()) as instance:
+        assert instance.ydl in created
+    pool.close()
+    assert all(ydl.closed for ydl in created)
@@ -0,0 +1,95 @@
+"""Micro-batching scheduler that groups short transcription jobs into one inference."""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from transcription import TranscriptionTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Collect jobs that arrive within a short window and run them together.
+
+    Jobs are grouped by key (jobs with different decoding options never share
+    a batch). A group is flushed when its window expires or it reaches
+    max_batch_size, whichever comes first; each caller then receives its own
+    entry from the batch result.
+    """
+
+    def __init__(self, run_batch: Callable[[Hashable, List[Any]], Awaitable[List[Any]]],
+                 window: float, max_batch_size: int):
+        """
+        Initialize the batcher.
+
+        Args:
+            run_batch: Coroutine function taking (key, items) and returning one
+                result per item, in order
+            window: Seconds to wait for more jobs after the first one arrives
+            max_batch_size: Flush as soon as a group holds this many jobs
+        """
+        self._run_batch = run_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self.batches_run = 0
+        self.jobs_run = 0
+
+    async def submit(self, key: Hashable, item: Any, timeout: float) -> Any:
+        """
+        Queue an item for the next batch with the same key and wait for its result.
+
+        Raises:
+            TranscriptionTimeoutError: If the result is not ready within timeout
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        group = self._pending.setdefault(key, [])
+        group.append((item, future))
+
+        if len(group) >= self.max_batch_size:
+            self._flush(key)
+        elif len(group) == 1:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TranscriptionTimeoutError(f"Transcription timed out after {timeout} seconds")
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def _flush(self, key: Hashable):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        group = [(item, future) for item, future in self._pending.pop(key, []) if not future.done()]
+        if not group:
+            return
+
+        task = asyncio.ensure_future(self._run(key, group))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, group: List[Tuple[Any, asyncio.Future]]):
+        self.batches_run += 1
+        self.jobs_run += len(group)
+        logger.debug(f"Running batch of {len(group)} jobs")
+
+        try:
+            results = await self._run_batch(key, [item for item, _ in group])
+        except Exception as e:
+            for _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(group, results):
+            if not future.done():
+                future.set_result(result)
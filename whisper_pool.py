@@ -0,0 +1,501 @@
+"""Multi-process faster-whisper worker pool with a bounded job queue."""
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Deque, List, Set
+
+from transcription import (
+    TranscriptionError,
+    TranscriptionTimeoutError,
+    TranscriptionBusyError,
+    TranscriptionCancelledError,
+    ModelLoadError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for worker processes that died (OOM kill, segfault)
+_CHECK_INTERVAL = 1.0
+# Seconds before respawning a worker that died before its model was loaded
+_RESPAWN_DELAY = 5.0
+
+
+class _CancelFlag:
+    """Cancel event backed by a shared value holding the cancelled job id."""
+
+    def __init__(self, shared_value, job_id: int):
+        self._shared_value = shared_value
+        self._job_id = job_id
+
+    def is_set(self) -> bool:
+        return self._shared_value.value == self._job_id
+
+
+def _worker_main(worker_id: int, model_name: str, compute_type: str, cpu_threads: int,
+                 jobs, events, cancel_value):
+    """
+    Worker process entry point: load a private model and run jobs until told to stop.
+
+    Jobs are callables invoked as ``fn(model, *args, deadline, cancel_event, emit)``.
+    Anything passed to ``emit`` and the job's return value must be picklable.
+    ``events`` is the write end of a pipe only this process uses, so a worker
+    killed mid-send cannot leave a lock held that its replacement needs.
+    """
+    try:
+        from faster_whisper import WhisperModel
+
+        started = time.monotonic()
+        model = WhisperModel(
+            model_name,
+            device="cpu",
+            compute_type=compute_type,
+            cpu_threads=cpu_threads
+        )
+    except Exception as e:
+        events.send(('load_error', worker_id, None, str(e)))
+        return
+
+    events.send(('ready', worker_id, None, time.monotonic() - started))
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, fn, args, timeout = job
+
+        def emit(*payload, _job_id=job_id):
+            events.send(('event', worker_id, _job_id, payload))
+
+        try:
+            result = fn(model, *args, time.monotonic() + timeout, _CancelFlag(cancel_value, job_id), emit)
+            events.send(('result', worker_id, job_id, result))
+        except Exception as e:
+            events.send(('error', worker_id, job_id, (type(e).__name__, str(e))))
+
+
+class _Job:
+    """A submitted job and the state needed to route its events back."""
+
+    def __init__(self, job_id: int, fn: Callable, args: tuple, deadline: float,
+                 future: asyncio.Future, on_event: Optional[Callable],
+                 on_queued: Optional[Callable]):
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.deadline = deadline
+        self.future = future
+        self.on_event = on_event
+        self.on_queued = on_queued
+        self.worker: Optional['_Worker'] = None
+
+
+class _Worker:
+    """Parent-side handle for one worker process in slot ``index``."""
+
+    def __init__(self, worker_id: int, index: int, process, jobs, events, cancel_value):
+        self.worker_id = worker_id
+        self.index = index
+        self.process = process
+        self.jobs = jobs
+        self.events = events
+        self.cancel_value = cancel_value
+        self.job: Optional[_Job] = None
+        self.ready = False
+
+
+class WhisperWorkerPool:
+    """
+    Pool of worker processes, each holding its own WhisperModel.
+
+    Jobs that cannot start immediately wait in a bounded FIFO queue. When the
+    queue is full, ``run`` raises TranscriptionBusyError instead of piling up
+    more work; queued callers are told their position through ``on_queued``.
+    A worker process that dies is replaced, and the job it was running fails
+    with TranscriptionError instead of waiting out its timeout.
+    """
+
+    def __init__(self, workers: int, model_name: str = "base", compute_type: str = "int8",
+                 cpu_threads: int = 0, max_queue: int = 8):
+        """
+        Initialize the pool (processes are started by ``start``).
+
+        Args:
+            workers: Number of worker processes
+            model_name: faster-whisper model size or path
+            compute_type: CTranslate2 compute type
+            cpu_threads: Threads per worker; 0 splits the machine's cores evenly
+            max_queue: Maximum number of jobs waiting for a free worker
+        """
+        if workers < 1:
+            raise ValueError("WhisperWorkerPool needs at least one worker")
+
+        self.workers = workers
+        self.model_name = model_name
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads or max(1, (multiprocessing.cpu_count() or 1) // workers)
+        self.max_queue = max_queue
+
+        # spawn keeps CTranslate2's thread pools out of forked children
+        self._ctx = multiprocessing.get_context('spawn')
+        # Written to by the event loop to stop the reader or make it watch a new worker
+        self._wake_reader = None
+        self._wake_writer = None
+        self._workers: List[_Worker] = []
+        self._next_worker_id = 1
+        # Slots whose worker failed to load and waits out _RESPAWN_DELAY
+        self._respawning: Set[int] = set()
+        self._idle: Deque[_Worker] = deque()
+        self._waiting: Deque[_Job] = deque()
+        self._jobs: Dict[int, _Job] = {}
+        self._next_job_id = 1
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reader: Optional[threading.Thread] = None
+        self._started: Optional[asyncio.Future] = None
+        self._closed = False
+        self.load_times: Dict[int, float] = {}
+
+    async def start(self):
+        """
+        Spawn the worker processes and wait until every model is loaded.
+
+        Raises:
+            ModelLoadError: If a worker fails to load its model
+        """
+        self._loop = asyncio.get_event_loop()
+        self._started = self._loop.create_future()
+        self._wake_reader, self._wake_writer = self._ctx.Pipe(duplex=False)
+
+        logger.info(
+            f"Starting {self.workers} whisper workers ({self.model_name}, "
+            f"{self.compute_type}, {self.cpu_threads} threads each)"
+        )
+
+        for index in range(self.workers):
+            self._workers.append(self._spawn_worker(index))
+
+        self._reader = threading.Thread(target=self._read_events, name="whisper-pool-reader", daemon=True)
+        self._reader.start()
+
+        try:
+            await self._started
+        except ModelLoadError:
+            await self.close()
+            raise
+
+    def _spawn_worker(self, index: int) -> _Worker:
+        # Events name the process, not the slot, so those of a replaced
+        # process are told apart from its replacement's
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        jobs = self._ctx.Queue()
+        events, child_events = self._ctx.Pipe(duplex=False)
+        cancel_value = self._ctx.Value('q', 0, lock=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.model_name, self.compute_type, self.cpu_threads, jobs, child_events, cancel_value),
+            name=f"whisper-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        # Only the child holds the write end, so its exit shows up as EOF
+        child_events.close()
+        return _Worker(worker_id, index, process, jobs, events, cancel_value)
+
+    def _read_events(self):
+        """Forward worker events to the event loop and schedule liveness checks (runs in a daemon thread)."""
+        # A replaced worker's pipe stays watched until EOF, so its last
+        # events are still read (and ignored) and the pipe gets closed
+        watched = set()
+        # Pipes closed at EOF whose worker has not been replaced yet
+        finished = set()
+        last_check = time.monotonic()
+        try:
+            while True:
+                current = {worker.events for worker in list(self._workers)}
+                finished &= current
+                watched |= current - finished
+                ready = multiprocessing.connection.wait(
+                    [self._wake_reader, *watched], timeout=_CHECK_INTERVAL
+                )
+                for conn in ready:
+                    try:
+                        item = conn.recv()
+                    except (EOFError, OSError):
+                        if conn is self._wake_reader:
+                            return
+                        # The process exited; look at it now rather than at the next check
+                        watched.discard(conn)
+                        finished.add(conn)
+                        conn.close()
+                        last_check = 0
+                        continue
+                    if conn is self._wake_reader:
+                        if item is None:
+                            return
+                        continue
+                    self._loop.call_soon_threadsafe(self._handle_event, item)
+                if time.monotonic() - last_check >= _CHECK_INTERVAL:
+                    last_check = time.monotonic()
+                    self._loop.call_soon_threadsafe(self._check_workers)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+        finally:
+            for conn in watched:
+                conn.close()
+            self._wake_reader.close()
+
+    def _handle_event(self, item):
+        kind, worker_id, job_id, payload = item
+        worker = next((w for w in self._workers if w.worker_id == worker_id), None)
+        if worker is None:
+            # From a process that has been replaced; its job was already failed
+            return
+        index = worker.index
+
+        if kind == 'ready':
+            worker.ready = True
+            self.load_times[index] = payload
+            self._idle.append(worker)
+            if len(self.load_times) == self.workers and not self._started.done():
+                self._started.set_result(None)
+            self._dispatch()
+            return
+
+        if kind == 'load_error':
+            if not self._started.done():
+                logger.error(f"Whisper worker {index} failed to load model: {payload}")
+                self._started.set_exception(
+                    ModelLoadError(f"Failed to load faster-whisper model: {payload}")
+                )
+            else:
+                # The process exits; _check_workers starts another after a delay
+                logger.error(
+                    f"Replacement whisper worker {index} failed to load model: {payload}; "
+                    f"retrying in {_RESPAWN_DELAY:g}s"
+                )
+            return
+
+        job = self._jobs.get(job_id)
+
+        if kind == 'event':
+            if job is not None and job.on_event is not None and not job.future.done():
+                job.on_event(*payload)
+            return
+
+        # 'result' or 'error': the worker is free again
+        self._jobs.pop(job_id, None)
+        worker.job = None
+        self._idle.append(worker)
+
+        if job is not None and not job.future.done():
+            if kind == 'result':
+                job.future.set_result(payload)
+            else:
+                error_type, message = payload
+                if error_type == TranscriptionTimeoutError.__name__:
+                    job.future.set_exception(TranscriptionTimeoutError(message))
+                else:
+                    job.future.set_exception(TranscriptionError(f"{error_type}: {message}"))
+
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand waiting jobs to idle workers and refresh queue positions."""
+        moved = False
+        while self._idle and self._waiting:
+            job = self._waiting.popleft()
+            moved = True
+            if job.future.done():
+                continue
+
+            remaining = job.deadline - time.monotonic()
+            if remaining <= 0:
+                job.future.set_exception(TranscriptionTimeoutError("Transcription timed out while queued"))
+                continue
+
+            worker = self._idle.popleft()
+            if not worker.process.is_alive():
+                # Died while idle (e.g. killed for memory); the job waits for
+                # the replacement, which becomes idle once its model is loaded
+                self._waiting.appendleft(job)
+                self._replace_worker(worker)
+                continue
+
+            worker.job = job
+            job.worker = worker
+            self._jobs[job.job_id] = job
+            worker.jobs.put((job.job_id, job.fn, job.args, remaining))
+
+        if moved:
+            for position, job in enumerate(self._waiting, start=1):
+                self._notify_queued(job, position)
+
+    def _notify_queued(self, job: _Job, position: int):
+        if job.on_queued is None:
+            return
+        try:
+            result = job.on_queued(position)
+            if inspect.isawaitable(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            logger.warning(f"Queue position callback failed: {e}")
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a free worker."""
+        return len(self._waiting)
+
+    async def run(self, fn: Callable, *args, timeout: float,
+                  on_event: Optional[Callable] = None,
+                  on_queued: Optional[Callable[[int], Any]] = None) -> Any:
+        """
+        Run a job on the next free worker.
+
+        Args:
+            fn: Module-level callable run as ``fn(model, *args, deadline, cancel_event, emit)``
+            *args: Picklable positional arguments for fn
+            timeout: Seconds allowed for queueing plus execution
+            on_event: Called on the event loop with each payload the job emits
+            on_queued: Called with the 1-based queue position while the job waits;
+                may return an awaitable, which is scheduled
+
+        Returns:
+            The job's return value
+
+        Raises:
+            TranscriptionBusyError: If the wait queue is full
+            TranscriptionTimeoutError: If the job does not finish in time
+            TranscriptionCancelledError: If the pool is closed before the job finishes
+            TranscriptionError: If the job fails
+        """
+        if self._closed:
+            raise TranscriptionCancelledError("Whisper worker pool is shut down")
+
+        if not self._idle and len(self._waiting) >= self.max_queue:
+            raise TranscriptionBusyError(
+                f"All {self.workers} transcription workers are busy and "
+                f"{len(self._waiting)} jobs are already queued",
+                position=len(self._waiting) + 1
+            )
+
+        job = _Job(
+            self._next_job_id,
+            fn,
+            args,
+            time.monotonic() + timeout,
+            self._loop.create_future(),
+            on_event,
+            on_queued
+        )
+        self._next_job_id += 1
+
+        self._waiting.append(job)
+        self._dispatch()
+        if job.worker is None:
+            self._notify_queued(job, len(self._waiting))
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(job.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TranscriptionTimeoutError(f"Transcription timed out after {timeout} seconds")
+        finally:
+            self._abandon(job)
+
+    def _abandon(self, job: _Job):
+        """Stop tracking a job the caller no longer waits for."""
+        if not job.future.done():
+            job.future.cancel()
+
+        if job.worker is None:
+            try:
+                self._waiting.remove(job)
+            except ValueError:
+                pass
+        elif job.worker.job is job:
+            # The worker checks this between segments and stops the decode
+            job.worker.cancel_value.value = job.job_id
+            if not job.worker.process.is_alive():
+                self._replace_worker(job.worker)
+
+    def _check_workers(self):
+        """Replace worker processes that died; fail the jobs they were running."""
+        if self._closed or self._started is None or not self._started.done():
+            return
+        for worker in list(self._workers):
+            if not worker.process.is_alive():
+                self._replace_worker(worker)
+
+    def _replace_worker(self, worker: _Worker):
+        if self._workers[worker.index] is not worker or worker.index in self._respawning:
+            return
+
+        job = worker.job
+        worker.job = None
+        if job is not None:
+            self._jobs.pop(job.job_id, None)
+            if not job.future.done():
+                job.future.set_exception(TranscriptionError(
+                    f"Whisper worker {worker.index} died while transcribing "
+                    f"(exit code {worker.process.exitcode})"
+                ))
+        try:
+            self._idle.remove(worker)
+        except ValueError:
+            pass
+
+        if worker.ready:
+            logger.warning(
+                f"Whisper worker {worker.index} died (exit code {worker.process.exitcode}); "
+                f"starting a replacement"
+            )
+            self._workers[worker.index] = self._spawn_worker(worker.index)
+            self._wake_writer.send(True)
+        else:
+            # Never loaded its model; retrying at once would spin on a
+            # persistent failure such as a missing model or no memory
+            self._respawning.add(worker.index)
+            self._loop.call_later(_RESPAWN_DELAY, self._respawn, worker)
+
+    def _respawn(self, worker: _Worker):
+        self._respawning.discard(worker.index)
+        if not self._closed and self._workers[worker.index] is worker:
+            self._workers[worker.index] = self._spawn_worker(worker.index)
+            self._wake_writer.send(True)
+
+    async def close(self):
+        """Stop all workers; waiting and running jobs fail with TranscriptionCancelledError."""
+        if self._closed:
+            return
+        self._closed = True
+
+        # Failed before the workers are told to stop, so a job cut short
+        # by the cancel flag is not mistaken for one that timed out
+        unfinished = list(self._waiting) + list(self._jobs.values())
+        self._waiting.clear()
+        for job in unfinished:
+            if not job.future.done():
+                job.future.set_exception(TranscriptionCancelledError("Whisper worker pool is shut down"))
+
+        for worker in self._workers:
+            if worker.job is not None:
+                worker.cancel_value.value = worker.job.job_id
+            worker.jobs.put(None)
+
+        loop = asyncio.get_event_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.process.join, 10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+        if self._wake_writer is not None:
+            self._wake_writer.send(None)
+            self._wake_writer.close()
+
+        logger.info("Whisper worker pool stopped")
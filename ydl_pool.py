@@ -0,0 +1,155 @@
+"""Pool of reusable yt-dlp YoutubeDL instances, one free list per option profile."""
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class PooledYoutubeDL:
+    """
+    A YoutubeDL whose hooks are forwarded to the job currently holding it.
+
+    The instance is created once with dispatching progress and
+    postprocessor hooks; jobs set ``progress_hook`` and
+    ``postprocessor_hook`` instead of adding hooks to the YoutubeDL, and
+    per-job options given to ``checkout`` are restored afterwards, so
+    nothing from one job leaks into the next.
+    """
+
+    def __init__(self, opts: Dict[str, Any], on_create: Optional[Callable] = None):
+        import yt_dlp
+
+        self.progress_hook: Optional[Callable] = None
+        self.postprocessor_hook: Optional[Callable] = None
+        self._saved_params: Dict[str, Any] = {}
+        self.ydl = yt_dlp.YoutubeDL(dict(
+            opts,
+            progress_hooks=[self._on_progress],
+            postprocessor_hooks=[self._on_postprocessor]
+        ))
+        if on_create is not None:
+            on_create(self.ydl)
+
+    def _on_progress(self, status):
+        if self.progress_hook is not None:
+            self.progress_hook(status)
+
+    def _on_postprocessor(self, status):
+        if self.postprocessor_hook is not None:
+            self.postprocessor_hook(status)
+
+    def apply_params(self, params: Dict[str, Any]):
+        """Override options for the current job only."""
+        for key, value in params.items():
+            self._saved_params.setdefault(key, self.ydl.params.get(key, _MISSING))
+            self.ydl.params[key] = value
+
+    def reset(self):
+        """Detach the previous job before the instance is reused."""
+        self.progress_hook = None
+        self.postprocessor_hook = None
+        for key, value in self._saved_params.items():
+            if value is _MISSING:
+                self.ydl.params.pop(key, None)
+            else:
+                self.ydl.params[key] = value
+        self._saved_params = {}
+
+    def close(self):
+        try:
+            self.ydl.close()
+        except Exception as e:
+            logger.debug(f"Error closing YoutubeDL: {e}")
+
+
+class YoutubeDLPool:
+    """
+    Warm YoutubeDL instances checked out per job.
+
+    Building a YoutubeDL registers every extractor, parses options and later
+    sets up an HTTP session; reusing instances pays that once per instance
+    instead of once per request. Instances are kept per option profile,
+    since options are fixed at construction. An instance is used by one job
+    at a time and is discarded, not reused, if its job fails.
+    """
+
+    def __init__(self, max_idle: int = 4, on_create: Optional[Callable] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            max_idle: Idle instances kept per profile; extras are closed
+            on_create: Optional callable run on every new YoutubeDL, e.g. to
+                register extra extractors
+        """
+        self.max_idle = max_idle
+        self.on_create = on_create
+        self._idle: Dict[str, List[PooledYoutubeDL]] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _take(self, profile: str) -> Optional[PooledYoutubeDL]:
+        with self._lock:
+            idle = self._idle.get(profile)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            self.created += 1
+            return None
+
+    def _give_back(self, profile: str, instance: PooledYoutubeDL):
+        with self._lock:
+            idle = self._idle.setdefault(profile, [])
+            if len(idle) < self.max_idle:
+                idle.append(instance)
+                return
+        instance.close()
+
+    @contextmanager
+    def checkout(self, profile: str, build_opts: Callable[[], Dict[str, Any]],
+                 params: Optional[Dict[str, Any]] = None) -> Iterator[PooledYoutubeDL]:
+        """
+        Borrow an instance for one job.
+
+        Args:
+            profile: Name of the option profile; instances are only shared
+                between jobs with the same profile
+            build_opts: Returns the YoutubeDL options, called only when a new
+                instance is needed
+            params: Options that differ per job, such as output paths; only
+                options yt-dlp reads at use time (not hooks or outtmpl)
+        """
+        instance = self._take(profile) or PooledYoutubeDL(build_opts(), self.on_create)
+        succeeded = False
+        try:
+            if params:
+                instance.apply_params(params)
+            yield instance
+            succeeded = True
+        finally:
+            instance.reset()
+            if succeeded:
+                self._give_back(profile, instance)
+            else:
+                instance.close()
+
+    def prewarm(self, profile: str, build_opts: Callable[[], Dict[str, Any]], count: int):
+        """Create up to count idle instances for a profile (blocking; run it in a thread)."""
+        with self._lock:
+            missing = min(count, self.max_idle) - len(self._idle.get(profile, []))
+        for _ in range(missing):
+            self._give_back(profile, PooledYoutubeDL(build_opts(), self.on_create))
+        logger.info(f"Prewarmed {max(missing, 0)} YoutubeDL instances for {profile}")
+
+    def close(self):
+        """Close every idle instance."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for instance in instances:
+                instance.close()